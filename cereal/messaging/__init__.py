@@ -7,7 +7,9 @@ import msgq
 
 import os
 import capnp
+import struct
 import time
+import numpy as np
 
 from typing import Optional, List, Union, Dict
 
@@ -27,6 +29,44 @@ def log_from_bytes(dat: bytes, struct: capnp.lib.capnp._StructModule = log.Event
     return msg
 
 
+def _event_layout() -> tuple[int, int, int, bool, Dict[int, str]]:
+  fields = log.Event.schema.fields
+  valid = fields['valid'].proto.slot
+  union = {fields[s].proto.discriminantValue: s for s in log.Event.schema.union_fields}
+  return (8 * fields['logMonoTime'].proto.slot.offset, 2 * log.Event.schema.node.struct.discriminantOffset,
+          valid.offset, valid.defaultValue.bool, union)
+
+_LOG_MONO_TIME_OFFSET, _WHICH_OFFSET, _VALID_BIT, _VALID_DEFAULT, _EVENT_UNION = _event_layout()
+_HEADER_SIZE = max(_LOG_MONO_TIME_OFFSET + 8, _WHICH_OFFSET + 2, _VALID_BIT // 8 + 1)
+
+
+def event_header(dat: bytes) -> Optional[tuple[str, int, bool]]:
+  """
+    Reads which(), logMonoTime and valid of a serialized log.Event without decoding it.
+    Returns None if the message isn't laid out as expected, decode it with log_from_bytes instead.
+  """
+  try:
+    segments = struct.unpack_from('<I', dat)[0] + 1
+    root_offset = (4 * (segments + 1) + 7) & ~7
+    root = struct.unpack_from('<Q', dat, root_offset)[0]
+    # only a plain struct pointer with a data section holding all the fields
+    if root & 3 != 0 or (root >> 32) & 0xffff < (_HEADER_SIZE + 7) // 8:
+      return None
+    offset = (root >> 2) & 0x3fffffff
+    if offset & 0x20000000:
+      offset -= 0x40000000
+    data = root_offset + 8 * (offset + 1)
+    if data < 0:
+      return None
+
+    which = _EVENT_UNION.get(struct.unpack_from('<H', dat, data + _WHICH_OFFSET)[0])
+    log_mono_time = struct.unpack_from('<Q', dat, data + _LOG_MONO_TIME_OFFSET)[0]
+    valid = bool(dat[data + _VALID_BIT // 8] >> (_VALID_BIT % 8) & 1) != _VALID_DEFAULT
+  except (struct.error, IndexError):
+    return None
+  return None if which is None else (which, log_mono_time, valid)
+
+
 def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
   args = {
     'valid': False,
@@ -138,7 +178,12 @@ class FrequencyTracker:
 class SubMaster:
   def __init__(self, services: List[str], poll: Optional[str] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
-               ignore_valid: Optional[List[str]] = None, addr: str = "127.0.0.1", frequency: Optional[float] = None):
+               ignore_valid: Optional[List[str]] = None, addr: str = "127.0.0.1", frequency: Optional[float] = None,
+               lazy: bool = False):
+    """
+      lazy: keep the received bytes and only decode a message when it's accessed through sm[s],
+            the time spent decoding each service is tracked in decode_time and decode_count
+    """
     self.frame = -1
     self.services = services
     self.seen = {s: False for s in services}
@@ -151,7 +196,7 @@ class SubMaster:
 
     # zero-frequency / on-demand services are always alive and presumed valid; all others must pass checks
     on_demand = {s: SERVICE_LIST[s].frequency <= 1e-5 for s in services}
-    self.static_freq_services = set(s for s in services if not on_demand[s])
+    self.static_freq_services = [s for s in services if not on_demand[s]]
     self.alive = {s: on_demand[s] for s in services}
     self.freq_ok = {s: on_demand[s] for s in services}
     self.valid = {s: on_demand[s] for s in services}
@@ -167,13 +212,18 @@ class SubMaster:
 
     self.simulation = bool(int(os.getenv("SIMULATION", "0")))
 
+    self.lazy = lazy
+    self.raw: Dict[str, bytes] = {}
+    self.decode_time = {s: 0. for s in services}
+    self.decode_count = {s: 0 for s in services}
+
     # if freq and poll aren't specified, assume the max to be conservative
     assert frequency is None or poll is None, "Do not specify 'frequency' - frequency of the polled service will be used."
     self.update_freq = frequency or max([SERVICE_LIST[s].frequency for s in polled_services])
 
     for s in services:
       p = self.poller if s not in self.non_polled_services else None
-      self.sock[s] = sub_sock(s, poller=p, addr=addr, conflate=True)
+      self.sock[s] = self._sub_sock(s, p, addr)
 
       try:
         data = new_message(s)
@@ -183,44 +233,78 @@ class SubMaster:
       self.data[s] = getattr(data.as_reader(), s)
       self.freq_tracker[s] = FrequencyTracker(SERVICE_LIST[s].frequency, self.update_freq, s == poll)
 
+    # static frequency services are alive until 10x their expected period after the last message,
+    # checked for all of them at once every update
+    self.static_idx = {s: i for i, s in enumerate(self.static_freq_services)}
+    self.static_max_dt = [10. / SERVICE_LIST[s].frequency for s in self.static_freq_services]
+    self.alive_deadline = np.array(self.static_max_dt)
+    self.static_seen = np.zeros(len(self.static_freq_services), dtype=bool)
+
+  def _sub_sock(self, s: str, poller: Optional[Poller], addr: str) -> Optional[SubSocket]:
+    return sub_sock(s, poller=poller, addr=addr, conflate=True)
+
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if s in self.raw:
+      t = time.monotonic()
+      self.data[s] = getattr(log_from_bytes(self.raw.pop(s)), s)
+      self.decode_time[s] += time.monotonic() - t
+      self.decode_count[s] += 1
     return self.data[s]
 
   def _check_avg_freq(self, s: str) -> bool:
     return SERVICE_LIST[s].frequency > 0.99 and (s not in self.ignore_average_freq) and (s not in self.ignore_alive)
 
   def update(self, timeout: int = 100) -> None:
+    recv = (lambda sock: sock.receive(non_blocking=True)) if self.lazy else recv_one_or_none
     msgs = []
     for sock in self.poller.poll(timeout):
-      msgs.append(recv_one_or_none(sock))
+      msgs.append(recv(sock))
 
     # non-blocking receive for non-polled sockets
     for s in self.non_polled_services:
-      msgs.append(recv_one_or_none(self.sock[s]))
+      msgs.append(recv(self.sock[s]))
     self.update_msgs(time.monotonic(), msgs)
 
-  def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
+  def update_msgs(self, cur_time: float, msgs: List[Union[bytes, capnp.lib.capnp._DynamicStructReader, None]]) -> None:
+    """msgs are either decoded events or their serialized bytes, which are decoded on access"""
     self.frame += 1
     self.updated = dict.fromkeys(self.services, False)
     for msg in msgs:
       if msg is None:
         continue
 
-      s = msg.which()
+      if isinstance(msg, bytes) and (header := event_header(msg)) is not None:
+        s, self.logMonoTime[s], self.valid[s] = header
+        self.raw[s] = msg
+      else:
+        if isinstance(msg, bytes):
+          msg = log_from_bytes(msg)
+        s = msg.which()
+        if self.raw:
+          self.raw.pop(s, None)
+        self.data[s] = getattr(msg, s)
+        self.logMonoTime[s] = msg.logMonoTime
+        self.valid[s] = msg.valid
+
       self.seen[s] = True
       self.updated[s] = True
-
-      self.freq_tracker[s].record_recv_time(cur_time)
       self.recv_time[s] = cur_time
       self.recv_frame[s] = self.frame
-      self.data[s] = getattr(msg, s)
-      self.logMonoTime[s] = msg.logMonoTime
-      self.valid[s] = msg.valid
-
-    for s in self.static_freq_services:
-      # alive if delay is within 10x the expected frequency; checks relaxed in simulator
-      self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency) or (self.seen[s] and self.simulation)
-      self.freq_ok[s] = self.freq_tracker[s].valid or self.simulation
+
+      i = self.static_idx.get(s)
+      if i is not None:
+        # the frequency checks only change when a message is received
+        self.freq_tracker[s].record_recv_time(cur_time)
+        self.freq_ok[s] = self.freq_tracker[s].valid or self.simulation
+        self.alive_deadline[i] = cur_time + self.static_max_dt[i]
+        self.static_seen[i] = True
+
+    # alive if delay is within 10x the expected frequency; checks relaxed in simulator
+    alive = cur_time < self.alive_deadline
+    if self.simulation:
+      alive |= self.static_seen
+      self.freq_ok.update(dict.fromkeys(self.static_freq_services, True))
+    self.alive.update(zip(self.static_freq_services, alive.tolist(), strict=True))
 
   def all_alive(self, service_list: Optional[List[str]] = None) -> bool:
     return all(self.alive[s] for s in (service_list or self.services) if s not in self.ignore_alive)
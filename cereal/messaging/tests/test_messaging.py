@@ -72,6 +72,17 @@ class TestMessaging:
     assert not msg.valid
     assert evt == msg.which()
 
+  @parameterized.expand(events)
+  def test_event_header(self, evt):
+    try:
+      msg = messaging.new_message(evt)
+    except capnp.lib.capnp.KjException:
+      msg = messaging.new_message(evt, random.randrange(200))
+    msg.valid = random.choice([True, False])
+    dat = msg.to_bytes()
+    assert messaging.event_header(dat) == (evt, msg.logMonoTime, msg.valid)
+    assert messaging.event_header(dat[:8]) is None
+
   @parameterized.expand(events)
   def test_pub_sock(self, evt):
     messaging.pub_sock(evt)
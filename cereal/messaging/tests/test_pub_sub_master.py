@@ -63,6 +63,27 @@ class TestSubMaster:
       assert sm.frame == i
       assert all(sm.updated.values())
 
+  def test_update_lazy(self):
+    sock = "carState"
+    pub_sock = messaging.pub_sock(sock)
+    sm = messaging.SubMaster([sock,], lazy=True)
+    zmq_sleep()
+
+    for _ in range(3):
+      msg = random_carstate()
+      msg.valid = random.choice([True, False])
+      pub_sock.send(msg.to_bytes())
+      sm.update(1000)
+      assert sm.updated[sock]
+      assert sm.valid[sock] == msg.valid
+      assert sm.logMonoTime[sock] == msg.logMonoTime
+
+    # only the latest message is decoded, once
+    assert sm.decode_count[sock] == 0
+    assert_carstate(msg.carState, sm[sock])
+    assert_carstate(msg.carState, sm[sock])
+    assert sm.decode_count[sock] == 1
+
   def test_update_timeout(self):
     sock = random_sock()
     sm = messaging.SubMaster([sock,])
@@ -42,17 +42,24 @@ def atomic_write_in_dir(path: str, mode: str = 'w', buffering: int = -1, encodin
 
 
 def get_upload_stream(filepath: str, should_compress: bool) -> tuple[io.BufferedIOBase, int]:
+  """
+    Stream of the file, or of its zstd compressed version, and its size. The compressed file is spilled to an
+    anonymous temporary file next to it instead of memory, so its size is known before sending.
+  """
   if not should_compress:
     file_size = os.path.getsize(filepath)
     file_stream = open(filepath, "rb")
     return file_stream, file_size
 
   # Compress the file on the fly
-  compressed_stream = io.BytesIO()
-  compressor = zstd.ZstdCompressor(level=LOG_COMPRESSION_LEVEL)
-
-  with open(filepath, "rb") as f:
-    compressor.copy_stream(f, compressed_stream)
+  compressed_stream = tempfile.TemporaryFile(dir=os.path.dirname(filepath) or None)
+  try:
+    compressor = zstd.ZstdCompressor(level=LOG_COMPRESSION_LEVEL)
+    with open(filepath, "rb") as f:
+      compressor.copy_stream(f, compressed_stream)
     compressed_size = compressed_stream.tell()
     compressed_stream.seek(0)
-    return compressed_stream, compressed_size
+  except BaseException:
+    compressed_stream.close()
+    raise
+  return compressed_stream, compressed_size
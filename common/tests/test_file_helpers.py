@@ -1,7 +1,10 @@
 import os
 from uuid import uuid4
 
-from openpilot.common.file_helpers import atomic_write_in_dir
+import pytest
+import zstandard as zstd
+
+from openpilot.common.file_helpers import atomic_write_in_dir, get_upload_stream
 
 
 class TestFileHelpers:
@@ -17,3 +20,17 @@ class TestFileHelpers:
 
   def test_atomic_write_in_dir(self):
     self.run_atomic_write_func(atomic_write_in_dir)
+
+  @pytest.mark.parametrize("compress", [False, True])
+  def test_upload_stream(self, tmp_path, compress):
+    path = tmp_path / "rlog"
+    path.write_bytes(os.urandom(100_000) + bytes(1_000_000))
+
+    stream, size = get_upload_stream(str(path), compress)
+    with stream:
+      dat = stream.read()
+    assert len(dat) == size
+    assert (zstd.ZstdDecompressor().decompressobj().decompress(dat) if compress else dat) == path.read_bytes()
+
+    # the compressed file isn't left behind
+    assert os.listdir(tmp_path) == ["rlog"]
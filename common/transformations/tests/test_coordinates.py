@@ -1,6 +1,7 @@
 import numpy as np
 
 import openpilot.common.transformations.coordinates as coord
+from openpilot.common.transformations.transformations import ecef2geodetic_single, geodetic2ecef_single
 
 geodetic_positions = np.array([[37.7610403, -122.4778699, 115],
                                  [27.4840915, -68.5867592, 2380],
@@ -102,3 +103,14 @@ class TestNED:
     np.testing.assert_allclose(converter.ned2ecef(ned_offsets_batch),
                                                            ecef_positions_offset_batch,
                                                            rtol=1e-9, atol=1e-7)
+
+  def test_batch_matches_single(self):
+    np.testing.assert_array_equal(coord.geodetic2ecef(geodetic_positions), [geodetic2ecef_single(g) for g in geodetic_positions])
+    np.testing.assert_array_equal(coord.ecef2geodetic(ecef_positions), [ecef2geodetic_single(e) for e in ecef_positions])
+
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    np.testing.assert_array_equal(converter.ecef2ned(ecef_positions_offset_batch),
+                                  [converter.ecef2ned_single(e) for e in ecef_positions_offset_batch])
+    np.testing.assert_array_equal(converter.ned2ecef(ned_offsets_batch), [converter.ned2ecef_single(n) for n in ned_offsets_batch])
+    np.testing.assert_array_equal(converter.geodetic2ned(geodetic_positions), [converter.geodetic2ned_single(g) for g in geodetic_positions])
+    np.testing.assert_array_equal(converter.ned2geodetic(ned_offsets_batch), [converter.ned2geodetic_single(n) for n in ned_offsets_batch])
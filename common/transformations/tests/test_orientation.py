@@ -3,6 +3,7 @@ import numpy as np
 from openpilot.common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
                                                ned_euler_from_ecef
+from openpilot.common.transformations import transformations
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -59,3 +60,19 @@ class TestOrientation:
       np.testing.assert_allclose(ned_eulers[i], ned_euler_from_ecef(ecef_positions[i], eulers[i]), rtol=1e-7)
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
     # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+
+  def test_batch(self):
+    rng = np.random.default_rng(0)
+    batch_eulers = rng.uniform(-np.pi, np.pi, (10000, 3))
+    inputs = {
+      'euler2quat': batch_eulers,
+      'quat2euler': euler2quat(batch_eulers),
+      'quat2rot': euler2quat(batch_eulers),
+      'rot2quat': euler2rot(batch_eulers),
+      'euler2rot': batch_eulers,
+      'rot2euler': euler2rot(batch_eulers),
+    }
+    for name, inp in inputs.items():
+      expected = np.array([getattr(transformations, f"{name}_single")(x) for x in inp])
+      # same kernels, so the results are identical
+      np.testing.assert_array_equal(getattr(transformations, f"{name}_batch")(inp), expected)
@@ -32,6 +32,21 @@ cdef Matrix3 numpy2matrix(np.ndarray[double, ndim=2, mode="fortran"] m):
     assert m.shape[1] == 3
     return Matrix3(<double*>m.data)
 
+cdef Matrix3 array2matrix(np.ndarray[double, ndim=3, mode="c"] m, Py_ssize_t i):
+    # Matrix3 takes column-major data
+    cdef double data[9]
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            data[c * 3 + r] = m[i, r, c]
+    return Matrix3(data)
+
+cdef void matrix2array(Matrix3 m, np.ndarray[double, ndim=3, mode="c"] out, Py_ssize_t i):
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            out[i, r, c] = m(r, c)
+
 cdef ECEF list2ecef(ecef):
     cdef ECEF e
     e.x = ecef[0]
@@ -111,6 +126,101 @@ def ecef2geodetic_single(ecef):
     return [g.lat, g.lon, g.alt]
 
 
+# batch versions of the above, taking and returning (N, 3), (N, 4) or (N, 3, 3) float64 arrays
+
+def euler2quat_batch(np.ndarray[double, ndim=2, mode="c"] euler):
+    cdef Py_ssize_t i, n = euler.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 4))
+    cdef Quaternion q
+    for i in range(n):
+        q = euler2quat_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2]))
+        out[i, 0], out[i, 1], out[i, 2], out[i, 3] = q.w(), q.x(), q.y(), q.z()
+    return out
+
+def quat2euler_batch(np.ndarray[double, ndim=2, mode="c"] quat):
+    cdef Py_ssize_t i, n = quat.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+    cdef Vector3 e
+    for i in range(n):
+        e = quat2euler_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3]))
+        out[i, 0], out[i, 1], out[i, 2] = e(0), e(1), e(2)
+    return out
+
+def quat2rot_batch(np.ndarray[double, ndim=2, mode="c"] quat):
+    cdef Py_ssize_t i, n = quat.shape[0]
+    cdef np.ndarray[double, ndim=3, mode="c"] out = np.empty((n, 3, 3))
+    for i in range(n):
+        matrix2array(quat2rot_c(Quaternion(quat[i, 0], quat[i, 1], quat[i, 2], quat[i, 3])), out, i)
+    return out
+
+def rot2quat_batch(np.ndarray[double, ndim=3, mode="c"] rot):
+    cdef Py_ssize_t i, n = rot.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 4))
+    cdef Quaternion q
+    for i in range(n):
+        q = rot2quat_c(array2matrix(rot, i))
+        out[i, 0], out[i, 1], out[i, 2], out[i, 3] = q.w(), q.x(), q.y(), q.z()
+    return out
+
+def euler2rot_batch(np.ndarray[double, ndim=2, mode="c"] euler):
+    cdef Py_ssize_t i, n = euler.shape[0]
+    cdef np.ndarray[double, ndim=3, mode="c"] out = np.empty((n, 3, 3))
+    for i in range(n):
+        matrix2array(euler2rot_c(Vector3(euler[i, 0], euler[i, 1], euler[i, 2])), out, i)
+    return out
+
+def rot2euler_batch(np.ndarray[double, ndim=3, mode="c"] rot):
+    cdef Py_ssize_t i, n = rot.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+    cdef Vector3 e
+    for i in range(n):
+        e = rot2euler_c(array2matrix(rot, i))
+        out[i, 0], out[i, 1], out[i, 2] = e(0), e(1), e(2)
+    return out
+
+def ecef_euler_from_ned_batch(ecef_init, np.ndarray[double, ndim=2, mode="c"] ned_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i, n = ned_pose.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+    cdef Vector3 e
+    for i in range(n):
+        e = ecef_euler_from_ned_c(init, Vector3(ned_pose[i, 0], ned_pose[i, 1], ned_pose[i, 2]))
+        out[i, 0], out[i, 1], out[i, 2] = e(0), e(1), e(2)
+    return out
+
+def ned_euler_from_ecef_batch(ecef_init, np.ndarray[double, ndim=2, mode="c"] ecef_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef Py_ssize_t i, n = ecef_pose.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+    cdef Vector3 e
+    for i in range(n):
+        e = ned_euler_from_ecef_c(init, Vector3(ecef_pose[i, 0], ecef_pose[i, 1], ecef_pose[i, 2]))
+        out[i, 0], out[i, 1], out[i, 2] = e(0), e(1), e(2)
+    return out
+
+def geodetic2ecef_batch(np.ndarray[double, ndim=2, mode="c"] geodetic):
+    cdef Py_ssize_t i, n = geodetic.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+    cdef Geodetic g
+    cdef ECEF e
+    for i in range(n):
+        g.lat, g.lon, g.alt, g.radians = geodetic[i, 0], geodetic[i, 1], geodetic[i, 2], False
+        e = geodetic2ecef_c(g)
+        out[i, 0], out[i, 1], out[i, 2] = e.x, e.y, e.z
+    return out
+
+def ecef2geodetic_batch(np.ndarray[double, ndim=2, mode="c"] ecef):
+    cdef Py_ssize_t i, n = ecef.shape[0]
+    cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+    cdef ECEF e
+    cdef Geodetic g
+    for i in range(n):
+        e.x, e.y, e.z = ecef[i, 0], ecef[i, 1], ecef[i, 2]
+        g = ecef2geodetic_c(e)
+        out[i, 0], out[i, 1], out[i, 2] = g.lat, g.lon, g.alt
+    return out
+
+
 cdef class LocalCoord:
     cdef LocalCoord_c * lc
 
@@ -169,5 +279,53 @@ cdef class LocalCoord:
         cdef Geodetic g = self.lc.ned2geodetic(n)
         return [g.lat, g.lon, g.alt]
 
+    def ecef2ned_batch(self, np.ndarray[double, ndim=2, mode="c"] ecef):
+        assert self.lc
+        cdef Py_ssize_t i, n = ecef.shape[0]
+        cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+        cdef ECEF e
+        cdef NED ned
+        for i in range(n):
+            e.x, e.y, e.z = ecef[i, 0], ecef[i, 1], ecef[i, 2]
+            ned = self.lc.ecef2ned(e)
+            out[i, 0], out[i, 1], out[i, 2] = ned.n, ned.e, ned.d
+        return out
+
+    def ned2ecef_batch(self, np.ndarray[double, ndim=2, mode="c"] ned):
+        assert self.lc
+        cdef Py_ssize_t i, n = ned.shape[0]
+        cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+        cdef NED nd
+        cdef ECEF e
+        for i in range(n):
+            nd.n, nd.e, nd.d = ned[i, 0], ned[i, 1], ned[i, 2]
+            e = self.lc.ned2ecef(nd)
+            out[i, 0], out[i, 1], out[i, 2] = e.x, e.y, e.z
+        return out
+
+    def geodetic2ned_batch(self, np.ndarray[double, ndim=2, mode="c"] geodetic):
+        assert self.lc
+        cdef Py_ssize_t i, n = geodetic.shape[0]
+        cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+        cdef Geodetic g
+        cdef NED ned
+        for i in range(n):
+            g.lat, g.lon, g.alt, g.radians = geodetic[i, 0], geodetic[i, 1], geodetic[i, 2], False
+            ned = self.lc.geodetic2ned(g)
+            out[i, 0], out[i, 1], out[i, 2] = ned.n, ned.e, ned.d
+        return out
+
+    def ned2geodetic_batch(self, np.ndarray[double, ndim=2, mode="c"] ned):
+        assert self.lc
+        cdef Py_ssize_t i, n = ned.shape[0]
+        cdef np.ndarray[double, ndim=2, mode="c"] out = np.empty((n, 3))
+        cdef NED nd
+        cdef Geodetic g
+        for i in range(n):
+            nd.n, nd.e, nd.d = ned[i, 0], ned[i, 1], ned[i, 2]
+            g = self.lc.ned2geodetic(nd)
+            out[i, 0], out[i, 1], out[i, 2] = g.lat, g.lon, g.alt
+        return out
+
     def __dealloc__(self):
         del self.lc
@@ -244,6 +244,8 @@ class LongitudinalMpc:
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
+    self.lead_params = np.zeros((2, 4))
+    self.x_obstacles = np.zeros((N+1, 3))
     for i in range(N+1):
       self.solver.set(i, 'x', np.zeros(X_DIM))
     self.last_cloudlog_t = 0
@@ -251,6 +253,7 @@ class LongitudinalMpc:
     self.crash_cnt = 0.0
     self.solution_status = 0
     # timers
+    self.setup_time = 0.0
     self.solve_time = 0.0
     self.time_qp_solution = 0.0
     self.time_linearization = 0.0
@@ -298,25 +301,24 @@ class LongitudinalMpc:
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
+    # takes the state of one lead, or arrays with the states of several leads
+    x_lead, v_lead, a_lead, a_lead_tau = (np.asarray(arg)[..., None] for arg in (x_lead, v_lead, a_lead, a_lead_tau))
     a_lead_traj = a_lead * np.exp(-a_lead_tau * (T_IDXS**2)/2.)
-    v_lead_traj = np.clip(v_lead + np.cumsum(T_DIFFS * a_lead_traj), 0.0, 1e8)
-    x_lead_traj = x_lead + np.cumsum(T_DIFFS * v_lead_traj)
-    lead_xv = np.column_stack((x_lead_traj, v_lead_traj))
+    v_lead_traj = np.clip(v_lead + np.cumsum(T_DIFFS * a_lead_traj, axis=-1), 0.0, 1e8)
+    x_lead_traj = x_lead + np.cumsum(T_DIFFS * v_lead_traj, axis=-1)
+    lead_xv = np.stack((x_lead_traj, v_lead_traj), axis=-1)
     return lead_xv
 
-  def process_lead(self, lead):
+  def process_leads(self, leads):
     v_ego = self.x0[1]
-    if lead is not None and lead.status:
-      x_lead = lead.dRel
-      v_lead = lead.vLead
-      a_lead = lead.aLeadK
-      a_lead_tau = lead.aLeadTau
-    else:
-      # Fake a fast lead car, so mpc can keep running in the same mode
-      x_lead = 50.0
-      v_lead = v_ego + 10.0
-      a_lead = 0.0
-      a_lead_tau = _LEAD_ACCEL_TAU
+    lead_params = self.lead_params[:len(leads)]
+    for i, lead in enumerate(leads):
+      if lead is not None and lead.status:
+        lead_params[i] = lead.dRel, lead.vLead, lead.aLeadK, lead.aLeadTau
+      else:
+        # Fake a fast lead car, so mpc can keep running in the same mode
+        lead_params[i] = 50.0, v_ego + 10.0, 0.0, _LEAD_ACCEL_TAU
+    x_lead, v_lead, a_lead, a_lead_tau = lead_params.T
 
     # MPC will not converge if immediate crash is expected
     # Clip lead distance to what is still possible to brake for
@@ -327,19 +329,23 @@ class LongitudinalMpc:
     lead_xv = self.extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau)
     return lead_xv
 
+  def process_lead(self, lead):
+    return self.process_leads([lead])[0]
+
   def update(self, radarstate, v_cruise, x, v, a, j, personality=log.LongitudinalPersonality.standard):
+    t0 = time.monotonic()
     t_follow = get_T_FOLLOW(personality)
     v_ego = self.x0[1]
     self.status = radarstate.leadOne.status or radarstate.leadTwo.status
 
-    lead_xv_0 = self.process_lead(radarstate.leadOne)
-    lead_xv_1 = self.process_lead(radarstate.leadTwo)
+    lead_xv = self.process_leads((radarstate.leadOne, radarstate.leadTwo))
+    lead_xv_0 = lead_xv[0]
 
     # To estimate a safe distance from a moving lead, we calculate how much stopping
     # distance that lead needs as a minimum. We can add that to the current distance
     # and then treat that as a stopped car/obstacle at this new distance.
-    lead_0_obstacle = lead_xv_0[:,0] + get_stopped_equivalence_factor(lead_xv_0[:,1])
-    lead_1_obstacle = lead_xv_1[:,0] + get_stopped_equivalence_factor(lead_xv_1[:,1])
+    self.x_obstacles[:,:2] = (lead_xv[:,:,0] + get_stopped_equivalence_factor(lead_xv[:,:,1])).T
+    lead_0_obstacle, lead_1_obstacle = self.x_obstacles[:,0], self.x_obstacles[:,1]
 
     self.params[:,0] = ACCEL_MIN
     self.params[:,1] = ACCEL_MAX
@@ -356,8 +362,8 @@ class LongitudinalMpc:
       v_cruise_clipped = np.clip(v_cruise * np.ones(N+1),
                                  v_lower,
                                  v_upper)
-      cruise_obstacle = np.cumsum(T_DIFFS * v_cruise_clipped) + get_safe_obstacle_distance(v_cruise_clipped, t_follow)
-      x_obstacles = np.column_stack([lead_0_obstacle, lead_1_obstacle, cruise_obstacle])
+      self.x_obstacles[:,2] = np.cumsum(T_DIFFS * v_cruise_clipped) + get_safe_obstacle_distance(v_cruise_clipped, t_follow)
+      x_obstacles = self.x_obstacles
       self.source = SOURCES[np.argmin(x_obstacles[0])]
 
       # These are not used in ACC mode
@@ -366,8 +372,7 @@ class LongitudinalMpc:
     elif self.mode == 'blended':
       self.params[:,5] = 1.0
 
-      x_obstacles = np.column_stack([lead_0_obstacle,
-                                     lead_1_obstacle])
+      x_obstacles = self.x_obstacles[:,:2]
       cruise_target = T_IDXS * np.clip(v_cruise, v_ego - 2.0, 1e3) + x[0]
       xforward = ((v[1:] + v[:-1]) / 2) * (T_IDXS[1:] - T_IDXS[:-1])
       x = np.cumsum(np.insert(xforward, 0, x[0]))
@@ -391,6 +396,7 @@ class LongitudinalMpc:
     self.params[:,2] = np.min(x_obstacles, axis=1)
     self.params[:,3] = np.copy(self.prev_a)
     self.params[:,4] = t_follow
+    self.setup_time = time.monotonic() - t0
 
     self.run()
     if (np.any(lead_xv_0[FCW_IDXS,0] - self.x_sol[FCW_IDXS,0] < CRASH_DISTANCE) and
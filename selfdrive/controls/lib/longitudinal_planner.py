@@ -177,6 +177,10 @@ class LongitudinalPlanner:
     longitudinalPlan.modelMonoTime = sm.logMonoTime['modelV2']
     longitudinalPlan.processingDelay = (plan_send.logMonoTime / 1e9) - sm.logMonoTime['modelV2']
     longitudinalPlan.solverExecutionTime = self.mpc.solve_time
+    longitudinalPlan.solverSetupTime = self.mpc.setup_time
+    longitudinalPlan.solverLinearizationTime = self.mpc.time_linearization
+    longitudinalPlan.solverIntegratorTime = self.mpc.time_integrator
+    longitudinalPlan.solverQpTime = self.mpc.time_qp_solution
 
     longitudinalPlan.speeds = self.v_desired_trajectory.tolist()
     longitudinalPlan.accels = self.a_desired_trajectory.tolist()
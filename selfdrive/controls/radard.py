@@ -251,6 +251,12 @@ class RadarD:
     pm.send("radarState", radar_msg)
 
 
+def step(sm: messaging.SubMaster, pm: messaging.PubMaster, RD: RadarD) -> None:
+  """One iteration of the main loop, after sm was updated"""
+  RD.update(sm, sm['liveTracks'])
+  RD.publish(pm)
+
+
 # fuses camera and radar data for best lead detection
 def main() -> None:
   config_realtime_process(5, Priority.CTRL_LOW)
@@ -268,9 +274,7 @@ def main() -> None:
 
   while 1:
     sm.update()
-
-    RD.update(sm, sm['liveTracks'])
-    RD.publish(pm)
+    step(sm, pm, RD)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from openpilot.system import micd
+from openpilot.system.micd import FFT_SAMPLES, SAMPLE_BUFFER, SAMPLE_RATE, Mic
+
+N_BLOCKS = 1000
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Measure the CPU time of micd's audio callback")
+  parser.add_argument("--hop", type=int, default=FFT_SAMPLES, help="samples between windows")
+  parser.add_argument("--decimation", type=int, default=1, help="process every n-th window")
+  args = parser.parse_args()
+
+  # nothing is published
+  micd.messaging.PubMaster = lambda *args, **kwargs: None
+  mic = Mic(args.hop, args.decimation)
+
+  blocks = np.random.default_rng(0).normal(0, 0.1, (N_BLOCKS, SAMPLE_BUFFER, 1)).astype(np.float32)
+  ets = []
+  for block in blocks:
+    start_t = time.process_time_ns()
+    mic.callback(block, SAMPLE_BUFFER, None, None)
+    ets.append((time.process_time_ns() - start_t) * 1e-6)
+
+  print(f'{N_BLOCKS} blocks of {SAMPLE_BUFFER} samples, hop {args.hop}, decimation {args.decimation}')
+  print(f'{np.mean(ets):.3f} mean ms, {max(ets):.3f} max ms, {min(ets):.3f} min ms, {np.std(ets):.3f} std ms per callback')
+  print(f'{100 * np.sum(ets) * 1e-3 / (N_BLOCKS * SAMPLE_BUFFER / SAMPLE_RATE):.3f}% of one core')
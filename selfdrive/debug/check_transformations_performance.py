@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import time
+
+import numpy as np
+
+from openpilot.common.transformations import transformations
+from openpilot.common.transformations.coordinates import geodetic2ecef
+from openpilot.common.transformations.orientation import euler2quat, euler2rot
+
+N = 10000
+
+
+if __name__ == '__main__':
+  rng = np.random.default_rng(0)
+  eulers = rng.uniform(-np.pi, np.pi, (N, 3))
+  geodetics = np.column_stack([rng.uniform(-80, 80, N), rng.uniform(-180, 180, N), rng.uniform(-100, 1000, N)])
+  ecefs = geodetic2ecef(geodetics)
+  neds = rng.uniform(-1000, 1000, (N, 3))
+  ecef_init = ecefs[0].copy()
+  local_coord = transformations.LocalCoord.from_geodetic(geodetics[0])
+
+  # name -> (single, batch, inputs)
+  functions = {}
+  for name, inp in [('euler2quat', eulers), ('quat2euler', euler2quat(eulers)), ('quat2rot', euler2quat(eulers)),
+                    ('rot2quat', euler2rot(eulers)), ('euler2rot', eulers), ('rot2euler', euler2rot(eulers)),
+                    ('geodetic2ecef', geodetics), ('ecef2geodetic', ecefs)]:
+    functions[name] = (getattr(transformations, f"{name}_single"), getattr(transformations, f"{name}_batch"), inp)
+  for name in ('ecef_euler_from_ned', 'ned_euler_from_ecef'):
+    single, batch = getattr(transformations, f"{name}_single"), getattr(transformations, f"{name}_batch")
+    functions[name] = (lambda x, single=single: single(ecef_init, x), lambda inp, batch=batch: batch(ecef_init, inp), eulers)
+  for name, inp in [('ecef2ned', ecefs), ('ned2ecef', neds), ('geodetic2ned', geodetics), ('ned2geodetic', neds)]:
+    functions[f"LocalCoord.{name}"] = (getattr(local_coord, f"{name}_single"), getattr(local_coord, f"{name}_batch"), inp)
+
+  print(f'{N} inputs')
+  for name, (single, batch, inp) in functions.items():
+    start_t = time.process_time_ns()
+    for x in inp:
+      single(x)
+    single_ms = (time.process_time_ns() - start_t) * 1e-6
+
+    start_t = time.process_time_ns()
+    batch(inp)
+    batch_ms = (time.process_time_ns() - start_t) * 1e-6
+    print(f'{name}: {single_ms:.2f} ms single, {batch_ms:.2f} ms batch, {single_ms / batch_ms:.1f}x')
@@ -52,19 +52,38 @@ def rotate_std(rot_matrix, std_in):
 
 
 class NPQueue:
+  """
+    FIFO of the last maxlen rows with O(1) append. Every row is written twice into a buffer of 2 * maxlen rows,
+    so the rows from oldest to newest are always a contiguous view of it.
+  """
   def __init__(self, maxlen: int, rowsize: int) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self._buf = np.empty((2 * maxlen, rowsize))
+    self._start = 0
+    self._len = 0
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self._len
+
+  @property
+  def arr(self) -> np.ndarray:
+    return self._buf[self._start:self._start + self._len]
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    if self._len < self.maxlen:
+      idx = self._len
+      self._len += 1
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      idx = self._start
+      self._start = (self._start + 1) % self.maxlen
+    self._buf[idx] = pt
+    self._buf[idx + self.maxlen] = pt
+
+  def extend(self, pts: np.ndarray) -> None:
+    pts = np.concatenate([self.arr, pts])[-self.maxlen:]
+    self._start, self._len = 0, len(pts)
+    self._buf[:self._len] = pts
+    self._buf[self.maxlen:self.maxlen + self._len] = pts
 
 
 class PointBuckets:
@@ -95,7 +114,7 @@ class PointBuckets:
     raise NotImplementedError
 
   def get_points(self, num_points: int = None) -> Any:
-    points = np.vstack([x.arr for x in self.buckets.values()])
+    points = np.concatenate([x.arr for x in self.buckets.values()])
     if num_points is None:
       return points
     return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
@@ -2,7 +2,6 @@
 import os
 import numpy as np
 import capnp
-from collections import deque
 from functools import partial
 
 import cereal.messaging as messaging
@@ -41,8 +40,8 @@ def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np
   """
 
   eps = np.finfo(np.float64).eps
-  expected_sig = np.asarray(expected_sig, dtype=np.float64)
-  actual_sig = np.asarray(actual_sig, dtype=np.float64)
+  expected_sig = np.array(expected_sig, dtype=np.float64)
+  actual_sig = np.array(actual_sig, dtype=np.float64)
 
   expected_sig[~mask] = 0.0
   actual_sig[~mask] = 0.0
@@ -91,27 +90,120 @@ def masked_normalized_cross_correlation(expected_sig: np.ndarray, actual_sig: np
 
 class Points:
   def __init__(self, num_points: int):
-    self.times = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.okay = deque[bool]([False] * num_points, maxlen=num_points)
-    self.desired = deque[float]([0.0] * num_points, maxlen=num_points)
-    self.actual = deque[float]([0.0] * num_points, maxlen=num_points)
-
-  @property
-  def num_points(self):
-    return len(self.desired)
-
-  @property
-  def num_okay(self):
-    return np.count_nonzero(self.okay)
+    # ring buffers stored twice back to back, so the window is always a contiguous view
+    self.num_points = num_points
+    self.idx = 0  # index of the oldest point
+    self.times = np.zeros(2 * num_points, dtype=np.float64)
+    self.okay = np.zeros(2 * num_points, dtype=bool)
+    self.desired = np.zeros(2 * num_points, dtype=np.float64)
+    self.actual = np.zeros(2 * num_points, dtype=np.float64)
+    self.num_okay = 0
 
   def update(self, t: float, desired: float, actual: float, okay: bool):
-    self.times.append(t)
-    self.okay.append(okay)
-    self.desired.append(desired)
-    self.actual.append(actual)
+    self.num_okay += int(okay) - int(self.okay[self.idx])
+    for buf, value in ((self.times, t), (self.okay, okay), (self.desired, desired), (self.actual, actual)):
+      buf[self.idx] = buf[self.idx + self.num_points] = value
+    self.idx = (self.idx + 1) % self.num_points
 
   def get(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-    return np.array(self.times), np.array(self.desired), np.array(self.actual), np.array(self.okay)
+    """Views of the window from oldest to newest point, only valid until the next update"""
+    window = np.s_[self.idx:self.idx + self.num_points]
+    return self.times[window], self.desired[window], self.actual[window], self.okay[window]
+
+
+class MaskedCrossCorrelation:
+  """
+  Masked normalized cross-correlation of a moving window, for a fixed range of lags.
+  Equal to masked_normalized_cross_correlation(desired, actual, okay, n)[num_points - 1 + lags], but the masked sums over
+  the overlapping samples of each lag are updated as points enter and leave the window instead of recomputed with FFTs.
+  """
+  # rows of the sums: overlap count, sum(mask*actual), sum(desired*mask), sum(desired*actual), sum(mask*actual^2), sum(desired^2*mask)
+  NUM_SUMS = 6
+
+  def __init__(self, num_points: int, lags: np.ndarray):
+    assert lags[0] <= 0 <= lags[-1] < num_points - 1 and -lags[0] < num_points and np.all(np.diff(lags) == 1), "lags must be a range around 0"
+    self.num_points = num_points
+    self.lags = lags
+    # the sums of negative lags are followed by those of positive lags, so the partners of a sample are contiguous slices
+    self.num_neg, self.num_pos = np.count_nonzero(lags < 0), np.count_nonzero(lags >= 0)
+
+    # masked signals, stored twice back to back like Points
+    self.idx = 0
+    self.desired = np.zeros(2 * num_points, dtype=np.float64)
+    self.actual = np.zeros(2 * num_points, dtype=np.float64)
+    self.mask = np.zeros(2 * num_points, dtype=np.float64)
+
+    self.sums = np.zeros((self.NUM_SUMS, len(lags)), dtype=np.float64)
+    # the running sums accumulate rounding errors, they're recomputed once per window
+    self.updates_since_resync = 0
+
+  @staticmethod
+  def _pair_sums(desired, desired_mask, actual, actual_mask) -> np.ndarray:
+    # sums over pairs of a desired sample and the actual sample lag samples later
+    return np.array([desired_mask * actual_mask, desired_mask * actual, desired * actual_mask,
+                     desired * actual, desired_mask * actual ** 2, desired ** 2 * actual_mask])
+
+  def _add_oldest(self, sign: float):
+    # the oldest sample is the desired one for positive lags and the actual one for negative lags
+    i, neg, pos = self.idx, self.num_neg, self.num_pos
+    partners = np.s_[i + neg:i:-1]
+    self.sums[:, :neg] += sign * self._pair_sums(self.desired[partners], self.mask[partners], self.actual[i], 1.)
+    partners = np.s_[i:i + pos]
+    self.sums[:, neg:] += sign * self._pair_sums(self.desired[i], 1., self.actual[partners], self.mask[partners])
+
+  def _add_newest(self, sign: float):
+    # the newest sample is the actual one for positive lags and the desired one for negative lags
+    i, neg, pos = self.idx + self.num_points - 1, self.num_neg, self.num_pos
+    partners = np.s_[i - neg:i]
+    self.sums[:, :neg] += sign * self._pair_sums(self.desired[i], 1., self.actual[partners], self.mask[partners])
+    partners = np.s_[i:i - pos:-1]
+    self.sums[:, neg:] += sign * self._pair_sums(self.desired[partners], self.mask[partners], self.actual[i], 1.)
+
+  def update(self, desired: float, actual: float, okay: bool):
+    n = self.num_points
+    self.updates_since_resync += 1
+    resync = self.updates_since_resync >= n
+
+    # masked samples don't contribute to any of the sums
+    if self.mask[self.idx] and not resync:
+      self._add_oldest(-1.)
+
+    for buf, value in ((self.desired, desired), (self.actual, actual), (self.mask, 1.)):
+      buf[self.idx] = buf[self.idx + n] = value if okay else 0.
+    self.idx = (self.idx + 1) % n
+
+    if resync:
+      self.resync()
+    elif okay:
+      self._add_newest(1.)
+
+  def resync(self):
+    n = self.num_points
+    desired, actual, mask = (buf[self.idx:self.idx + n] for buf in (self.desired, self.actual, self.mask))
+    for col, lag in enumerate(self.lags):
+      i, j = np.s_[max(0, -lag):min(n, n - lag)], np.s_[max(0, lag):min(n, n + lag)]
+      self.sums[:, col] = self._pair_sums(desired[i], mask[i], actual[j], mask[j]).sum(axis=1)
+    self.updates_since_resync = 0
+
+  def get(self) -> np.ndarray:
+    eps = np.finfo(np.float64).eps
+    overlap, actual_sum, desired_sum, cross_sum, actual_sq_sum, desired_sq_sum = self.sums
+    overlap = np.fmax(np.round(overlap), eps)
+
+    numerator = cross_sum - actual_sum * desired_sum / overlap
+    actual_denom = np.fmax(actual_sq_sum - actual_sum ** 2 / overlap, 0.0)
+    desired_denom = np.fmax(desired_sq_sum - desired_sum ** 2 / overlap, 0.0)
+    denom = np.sqrt(actual_denom * desired_denom)
+
+    # zero-out samples with very small denominators, relative to the largest one in the range of lags
+    tol = 1e3 * eps * np.max(np.abs(denom), keepdims=True)
+    nonzero_indices = denom > tol
+
+    ncc = np.zeros_like(denom)
+    ncc[nonzero_indices] = numerator[nonzero_indices] / denom[nonzero_indices]
+    np.clip(ncc, -1, 1, out=ncc)
+
+    return ncc
 
 
 class BlockAverage:
@@ -198,6 +290,7 @@ class LateralLagEstimator:
   def reset(self, initial_lag: float, valid_blocks: int):
     window_len = int(self.window_sec / self.dt)
     self.points = Points(window_len)
+    self.corr = MaskedCrossCorrelation(window_len, self.lags(self.dt, MAX_LAG))
     self.block_avg = BlockAverage(self.block_count, self.block_size, valid_blocks, initial_lag)
 
   def get_msg(self, valid: bool, debug: bool = False) -> capnp._DynamicStructBuilder:
@@ -288,25 +381,31 @@ class LateralLagEstimator:
            fast and turning and has_recovered and calib_valid and sensors_valid and la_valid
 
     self.points.update(self.t, la_desired, la_actual_pose, okay)
+    self.corr.update(la_desired, la_actual_pose, okay)
 
   def update_estimate(self):
     if not self.points_enough():
       return
 
-    times, desired, actual, okay = self.points.get()
+    times, _, _, okay = self.points.get()
     # check if there are any new valid data points since the last update
     is_valid = self.points_valid()
     if self.last_estimate_t != 0 and times[0] <= self.last_estimate_t:
-      new_values_start_idx = next(-i for i, t in enumerate(reversed(times)) if t <= self.last_estimate_t)
-      is_valid = is_valid and not (new_values_start_idx == 0 or not np.any(okay[new_values_start_idx:]))
+      new_values_start_idx = np.flatnonzero(times <= self.last_estimate_t)[-1] + 1
+      is_valid = is_valid and not (new_values_start_idx == len(times) or not np.any(okay[new_values_start_idx:]))
 
-    delay, corr, confidence = self.actuator_delay(desired, actual, okay, self.dt, MAX_LAG)
+    delay, corr, confidence = self.lag_from_ncc(self.corr.get(), self.dt, MAX_LAG)
     if corr < self.min_ncc or confidence < self.min_confidence or not is_valid:
       return
 
     self.block_avg.update(delay)
     self.last_estimate_t = self.t
 
+  @staticmethod
+  def lags(dt: float, max_lag: float) -> np.ndarray:
+    # lags from 0 to max_lag, extended by CORR_BORDER_OFFSET samples on both sides
+    return np.arange(-CORR_BORDER_OFFSET, int(max_lag / dt) + CORR_BORDER_OFFSET)
+
   @staticmethod
   def actuator_delay(expected_sig: np.ndarray, actual_sig: np.ndarray, mask: np.ndarray, dt: float, max_lag: float) -> tuple[float, float, float]:
     assert len(expected_sig) == len(actual_sig)
@@ -314,12 +413,14 @@ class LateralLagEstimator:
     padded_size = fft_next_good_size(len(expected_sig) + max_lag_samples)
 
     ncc = masked_normalized_cross_correlation(expected_sig, actual_sig, mask, padded_size)
+    return LateralLagEstimator.lag_from_ncc(ncc[len(expected_sig) - 1 + LateralLagEstimator.lags(dt, max_lag)], dt, max_lag)
 
+  @staticmethod
+  def lag_from_ncc(extended_roi_ncc: np.ndarray, dt: float, max_lag: float) -> tuple[float, float, float]:
+    """Lag, correlation and confidence from the normalized cross-correlation at lags(dt, max_lag)"""
     # only consider lags from 0 to max_lag
-    roi = np.s_[len(expected_sig) - 1: len(expected_sig) - 1 + max_lag_samples]
-    extended_roi = np.s_[roi.start - CORR_BORDER_OFFSET: roi.stop + CORR_BORDER_OFFSET]
-    roi_ncc = ncc[roi]
-    extended_roi_ncc = ncc[extended_roi]
+    max_lag_samples = int(max_lag / dt)
+    roi_ncc = extended_roi_ncc[CORR_BORDER_OFFSET:CORR_BORDER_OFFSET + max_lag_samples]
 
     max_corr_index = np.argmax(roi_ncc)
     corr = roi_ncc[max_corr_index]
@@ -360,6 +461,26 @@ def retrieve_initial_lag(params: Params, CP: car.CarParams):
   return None
 
 
+def step(sm: messaging.SubMaster, pm: messaging.PubMaster, params: Params, lag_learner: LateralLagEstimator, debug: bool) -> None:
+  """One iteration of the main loop, after sm was updated"""
+  if sm.all_checks():
+    for which in sorted(sm.updated.keys(), key=lambda x: sm.logMonoTime[x]):
+      if sm.updated[which]:
+        t = sm.logMonoTime[which] * 1e-9
+        lag_learner.handle_log(t, which, sm[which])
+    lag_learner.update_points()
+
+  # 4Hz driven by livePose
+  if sm.frame % 5 == 0:
+    lag_learner.update_estimate()
+    lag_msg = lag_learner.get_msg(sm.all_checks(), debug)
+    lag_msg_dat = lag_msg.to_bytes()
+    pm.send('liveDelay', lag_msg_dat)
+
+    if sm.frame % 1200 == 0: # cache every 60 seconds
+      params.put_nonblocking("LiveDelay", lag_msg_dat)
+
+
 def main():
   config_realtime_process([0, 1, 2, 3], 5)
 
@@ -381,19 +502,4 @@ def main():
 
   while True:
     sm.update()
-    if sm.all_checks():
-      for which in sorted(sm.updated.keys(), key=lambda x: sm.logMonoTime[x]):
-        if sm.updated[which]:
-          t = sm.logMonoTime[which] * 1e-9
-          lag_learner.handle_log(t, which, sm[which])
-      lag_learner.update_points()
-
-    # 4Hz driven by livePose
-    if sm.frame % 5 == 0:
-      lag_learner.update_estimate()
-      lag_msg = lag_learner.get_msg(sm.all_checks(), DEBUG)
-      lag_msg_dat = lag_msg.to_bytes()
-      pm.send('liveDelay', lag_msg_dat)
-
-      if sm.frame % 1200 == 0: # cache every 60 seconds
-        params.put_nonblocking("LiveDelay", lag_msg_dat)
+    step(sm, pm, params, lag_learner, DEBUG)
@@ -28,6 +28,7 @@ INPUT_INVALID_LIMIT = 2.0 # 1 (camodo) / 9 (sensor) bad input[s] ignored
 INPUT_INVALID_RECOVERY = 10.0 # ~10 secs to resume after exceeding allowed bad inputs by one
 POSENET_STD_INITIAL_VALUE = 10.0
 POSENET_STD_HIST_HALF = 20
+CRITICAL_SERVICES = ["accelerometer", "gyroscope", "cameraOdometry"]
 
 
 def calculate_invalid_input_decay(invalid_limit, recovery_time, frequency):
@@ -253,6 +254,71 @@ def sensor_all_checks(acc_msgs, gyro_msgs, sensor_valid, sensor_recv_time, senso
   return all(sensor_alive.values()) and all(sensor_valid.values())
 
 
+class LocationdState:
+  """Estimator and input validity tracking of locationd's main loop"""
+
+  def __init__(self, params: Params, debug: bool, simulation: bool):
+    self.simulation = simulation
+    self.estimator = LocationEstimator(debug)
+    self.filter_initialized = False
+    self.sensor_alive, self.sensor_valid, self.sensor_recv_time = defaultdict(bool), defaultdict(bool), defaultdict(float)
+    self.observation_input_invalid: dict[str, float] = defaultdict(int)
+
+    input_invalid_limit = {s: round(INPUT_INVALID_LIMIT * (SERVICE_LIST[s].frequency / 20.)) for s in CRITICAL_SERVICES}
+    self.input_invalid_threshold = {s: input_invalid_limit[s] - 0.5 for s in CRITICAL_SERVICES}
+    self.input_invalid_decay = {s: calculate_invalid_input_decay(input_invalid_limit[s], INPUT_INVALID_RECOVERY, SERVICE_LIST[s].frequency)
+                                for s in CRITICAL_SERVICES}
+
+    initial_pose_data = params.get("LocationFilterInitialState")
+    if initial_pose_data is not None:
+      with log.Event.from_bytes(initial_pose_data) as lp_msg:
+        filter_state = lp_msg.livePose.debugFilterState
+        x_initial = np.array(filter_state.value, dtype=np.float64) if len(filter_state.value) != 0 else PoseKalman.initial_x
+        P_initial = np.diag(np.array(filter_state.std, dtype=np.float64)) if len(filter_state.std) != 0 else PoseKalman.initial_P
+        self.estimator.reset(None, x_initial, P_initial)
+
+
+def step(sm: messaging.SubMaster, pm: messaging.PubMaster, state: LocationdState, acc_msgs: list, gyro_msgs: list) -> None:
+  """One iteration of the main loop, after sm was updated and the sensor sockets were drained"""
+  if state.filter_initialized:
+    msgs = []
+    for msg in acc_msgs + gyro_msgs:
+      t, valid, which, data = msg.logMonoTime, msg.valid, msg.which(), getattr(msg, msg.which())
+      msgs.append((t, valid, which, data))
+    for which, updated in sm.updated.items():
+      if not updated:
+        continue
+      t, valid, data = sm.logMonoTime[which], sm.valid[which], sm[which]
+      msgs.append((t, valid, which, data))
+
+    for log_mono_time, valid, which, msg in sorted(msgs, key=lambda x: x[0]):
+      if valid:
+        t = log_mono_time * 1e-9
+        res = state.estimator.handle_log(t, which, msg)
+        if which not in CRITICAL_SERVICES:
+          continue
+
+        if res == HandleLogResult.TIMING_INVALID:
+          cloudlog.warning(f"Observation {which} ignored due to failed timing check")
+          state.observation_input_invalid[which] += 1
+        elif res == HandleLogResult.INPUT_INVALID:
+          cloudlog.warning(f"Observation {which} ignored due to failed sanity check")
+          state.observation_input_invalid[which] += 1
+        elif res == HandleLogResult.SUCCESS:
+          state.observation_input_invalid[which] *= state.input_invalid_decay[which]
+  else:
+    state.filter_initialized = sm.all_checks() and sensor_all_checks(acc_msgs, gyro_msgs, state.sensor_valid, state.sensor_recv_time,
+                                                                     state.sensor_alive, state.simulation)
+
+  if sm.updated["cameraOdometry"]:
+    critical_service_inputs_valid = all(state.observation_input_invalid[s] < state.input_invalid_threshold[s] for s in CRITICAL_SERVICES)
+    inputs_valid = sm.all_valid() and critical_service_inputs_valid
+    sensors_valid = sensor_all_checks(acc_msgs, gyro_msgs, state.sensor_valid, state.sensor_recv_time, state.sensor_alive, state.simulation)
+
+    msg = state.estimator.get_msg(sensors_valid, inputs_valid, state.filter_initialized)
+    pm.send("livePose", msg)
+
+
 def main():
   config_realtime_process([0, 1, 2, 3], 5)
 
@@ -263,69 +329,14 @@ def main():
   sm = messaging.SubMaster(['carState', 'liveCalibration', 'cameraOdometry'], poll='cameraOdometry')
   # separate sensor sockets for efficiency
   sensor_sockets = [messaging.sub_sock(which, timeout=20) for which in ['accelerometer', 'gyroscope']]
-  sensor_alive, sensor_valid, sensor_recv_time = defaultdict(bool), defaultdict(bool), defaultdict(float)
-
-  params = Params()
-
-  estimator = LocationEstimator(DEBUG)
 
-  filter_initialized = False
-  critcal_services = ["accelerometer", "gyroscope", "cameraOdometry"]
-  observation_input_invalid = defaultdict(int)
-
-  input_invalid_limit = {s: round(INPUT_INVALID_LIMIT * (SERVICE_LIST[s].frequency / 20.)) for s in critcal_services}
-  input_invalid_threshold = {s: input_invalid_limit[s] - 0.5 for s in critcal_services}
-  input_invalid_decay = {s: calculate_invalid_input_decay(input_invalid_limit[s], INPUT_INVALID_RECOVERY, SERVICE_LIST[s].frequency) for s in critcal_services}
-
-  initial_pose_data = params.get("LocationFilterInitialState")
-  if initial_pose_data is not None:
-    with log.Event.from_bytes(initial_pose_data) as lp_msg:
-      filter_state = lp_msg.livePose.debugFilterState
-      x_initial = np.array(filter_state.value, dtype=np.float64) if len(filter_state.value) != 0 else PoseKalman.initial_x
-      P_initial = np.diag(np.array(filter_state.std, dtype=np.float64)) if len(filter_state.std) != 0 else PoseKalman.initial_P
-      estimator.reset(None, x_initial, P_initial)
+  state = LocationdState(Params(), DEBUG, SIMULATION)
 
   while True:
     sm.update()
 
     acc_msgs, gyro_msgs = (messaging.drain_sock(sock) for sock in sensor_sockets)
-
-    if filter_initialized:
-      msgs = []
-      for msg in acc_msgs + gyro_msgs:
-        t, valid, which, data = msg.logMonoTime, msg.valid, msg.which(), getattr(msg, msg.which())
-        msgs.append((t, valid, which, data))
-      for which, updated in sm.updated.items():
-        if not updated:
-          continue
-        t, valid, data = sm.logMonoTime[which], sm.valid[which], sm[which]
-        msgs.append((t, valid, which, data))
-
-      for log_mono_time, valid, which, msg in sorted(msgs, key=lambda x: x[0]):
-        if valid:
-          t = log_mono_time * 1e-9
-          res = estimator.handle_log(t, which, msg)
-          if which not in critcal_services:
-            continue
-
-          if res == HandleLogResult.TIMING_INVALID:
-            cloudlog.warning(f"Observation {which} ignored due to failed timing check")
-            observation_input_invalid[which] += 1
-          elif res == HandleLogResult.INPUT_INVALID:
-            cloudlog.warning(f"Observation {which} ignored due to failed sanity check")
-            observation_input_invalid[which] += 1
-          elif res == HandleLogResult.SUCCESS:
-            observation_input_invalid[which] *= input_invalid_decay[which]
-    else:
-      filter_initialized = sm.all_checks() and sensor_all_checks(acc_msgs, gyro_msgs, sensor_valid, sensor_recv_time, sensor_alive, SIMULATION)
-
-    if sm.updated["cameraOdometry"]:
-      critical_service_inputs_valid = all(observation_input_invalid[s] < input_invalid_threshold[s] for s in critcal_services)
-      inputs_valid = sm.all_valid() and critical_service_inputs_valid
-      sensors_valid = sensor_all_checks(acc_msgs, gyro_msgs, sensor_valid, sensor_recv_time, sensor_alive, SIMULATION)
-
-      msg = estimator.get_msg(sensors_valid, inputs_valid, filter_initialized)
-      pm.send("livePose", msg)
+    step(sm, pm, state, acc_msgs, gyro_msgs)
 
 
 if __name__ == "__main__":
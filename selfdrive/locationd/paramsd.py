@@ -261,6 +261,24 @@ def retrieve_initial_vehicle_params(params: Params, CP: car.CarParams, replay: b
   return steer_ratio, stiffness_factor, angle_offset_deg, p_initial
 
 
+def step(sm: messaging.SubMaster, pm: messaging.PubMaster, params: Params, learner: VehicleParamsLearner, debug: bool) -> None:
+  """One iteration of the main loop, after sm was updated"""
+  if sm.all_checks():
+    for which in sorted(sm.updated.keys(), key=lambda x: sm.logMonoTime[x]):
+      if sm.updated[which]:
+        t = sm.logMonoTime[which] * 1e-9
+        learner.handle_log(t, which, sm[which])
+
+  if sm.updated['livePose']:
+    msg = learner.get_msg(sm.all_checks(), debug=debug)
+
+    msg_dat = msg.to_bytes()
+    if sm.frame % 1200 == 0:  # once a minute
+      params.put_nonblocking("LiveParametersV2", msg_dat)
+
+    pm.send('liveParameters', msg_dat)
+
+
 def main():
   config_realtime_process([0, 1, 2, 3], 5)
 
@@ -280,20 +298,7 @@ def main():
 
   while True:
     sm.update()
-    if sm.all_checks():
-      for which in sorted(sm.updated.keys(), key=lambda x: sm.logMonoTime[x]):
-        if sm.updated[which]:
-          t = sm.logMonoTime[which] * 1e-9
-          learner.handle_log(t, which, sm[which])
-
-    if sm.updated['livePose']:
-      msg = learner.get_msg(sm.all_checks(), debug=DEBUG)
-
-      msg_dat = msg.to_bytes()
-      if sm.frame % 1200 == 0:  # once a minute
-        params.put_nonblocking("LiveParametersV2", msg_dat)
-
-      pm.send('liveParameters', msg_dat)
+    step(sm, pm, params, learner, DEBUG)
 
 
 if __name__ == "__main__":
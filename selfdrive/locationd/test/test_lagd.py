@@ -4,8 +4,8 @@ import time
 import pytest
 
 from cereal import messaging, log, car
-from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, retrieve_initial_lag, masked_normalized_cross_correlation, \
-                                               BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
+from openpilot.selfdrive.locationd.lagd import LateralLagEstimator, MaskedCrossCorrelation, Points, retrieve_initial_lag, \
+                                               masked_normalized_cross_correlation, BLOCK_NUM_NEEDED, BLOCK_SIZE, MIN_OKAY_WINDOW_SEC
 from openpilot.selfdrive.test.process_replay.migration import migrate, migrate_carParams
 from openpilot.selfdrive.locationd.test.test_locationd_scenarios import TEST_ROUTE
 from openpilot.common.params import Params
@@ -86,6 +86,19 @@ class TestLagd:
     corr = masked_normalized_cross_correlation(desired_sig, actual_sig, mask, 200)[len(desired_sig) - 1:len(desired_sig) + 20]
     assert np.argmax(corr) in range(lag_frames - MAX_ERR_FRAMES, lag_frames + MAX_ERR_FRAMES + 1)
 
+  def test_streaming_ncc(self):
+    n, lags = 200, LateralLagEstimator.lags(DT, 1.0)
+    points, corr = Points(n), MaskedCrossCorrelation(n, lags)
+    # run over a few windows, so the running sums are recomputed in between
+    for i in range(5 * n):
+      desired, actual, okay = np.random.normal(), np.random.normal(), random.random() < 0.6
+      points.update(i * DT, desired, actual, okay)
+      corr.update(desired, actual, okay)
+      if i > n // 2 and i % 10 == 0:
+        _, desired_sig, actual_sig, mask = points.get()
+        expected = masked_normalized_cross_correlation(desired_sig, actual_sig, mask, 2 * n)[n - 1 + lags]
+        np.testing.assert_allclose(corr.get(), expected, atol=1e-9)
+
   def test_empty_estimator(self):
     mocked_CP = car.CarParams(steerActuatorDelay=0.8)
     estimator = LateralLagEstimator(mocked_CP, DT)
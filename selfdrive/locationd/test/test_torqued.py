@@ -1,5 +1,6 @@
-from cereal import car
-from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+import numpy as np
+from cereal import car, log
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator, TorqueSeries, POINTS_PER_BUCKET
 
 
 def test_cal_percent():
@@ -23,3 +24,55 @@ def test_cal_percent():
 
   msg = est.get_msg()
   assert msg.liveTorqueParameters.calPerc == 100
+
+
+def test_buckets_keep_newest_points():
+  est = TorqueEstimator(car.CarParams())
+  (low, high), bucket = next(iter(est.filtered_points.buckets.items()))
+  xs = np.linspace(low, high, 2 * POINTS_PER_BUCKET + 7, endpoint=False)
+  for i, x in enumerate(xs):
+    est.filtered_points.add_point(x, float(i))
+    assert len(bucket) == min(i + 1, POINTS_PER_BUCKET)
+
+  # oldest points are dropped first, the rest stay in insertion order
+  expected = np.column_stack([xs, np.ones_like(xs), np.arange(len(xs))])[-POINTS_PER_BUCKET:]
+  np.testing.assert_array_equal(bucket.arr, expected)
+  np.testing.assert_array_equal(est.filtered_points.get_points(), expected)
+
+
+def new_message(service, log_mono_time, **fields):
+  # messaging.new_message inits the service after building the event, which would drop the fields
+  return log.Event.new_message(logMonoTime=log_mono_time, valid=True, **{service: fields}).as_reader()
+
+
+def test_fit_series_matches_online():
+  CP = car.CarParams()
+  msgs = []
+  for i in range(120 * 100):
+    t = i * 10**7
+    steer = float(0.4 * np.sin(i * 0.003) + np.random.normal(0, 0.05))
+    msgs.append(new_message('carControl', t + 1, latActive=(i // 3000) % 4 != 3))
+    msgs.append(new_message('carOutput', t + 2, actuatorsOutput={'torque': -steer}))
+    msgs.append(new_message('carState', t + 3, vEgo=20.0, steeringPressed=bool(np.random.random() < 0.002)))
+    if i % 5 == 0:
+      yaw_rate = float(steer * 0.1 / 20 + np.random.normal(0, 0.003))
+      msgs.append(new_message('livePose', t + 4, orientationNED={'x': float(np.random.normal(0, 0.02))},
+                              angularVelocityDevice={'x': 0.001, 'z': yaw_rate}))
+    if i % 25 == 0:
+      msgs.append(new_message('liveCalibration', t + 5, rpyCalib=[0.0, 0.03, 0.02]))
+    if i % 2000 == 500:
+      msgs.append(new_message('liveDelay', t + 6, lateralDelay=0.2 + 0.01 * (i // 2000)))
+
+  online = TorqueEstimator(CP, track_all_points=True)
+  for m in msgs:
+    online.handle_log(m.logMonoTime * 1e-9, m.which(), getattr(m, m.which()))
+  batch = TorqueEstimator(CP, track_all_points=True)
+  np.random.seed(0)
+  batch_fit = batch.fit_series(TorqueSeries.from_log(msgs))
+  np.random.seed(0)
+  online_fit = online.estimate_params()
+
+  assert len(online.filtered_points) > 0
+  np.testing.assert_allclose(batch.filtered_points.get_points(), online.filtered_points.get_points(), atol=1e-12)
+  np.testing.assert_allclose(batch.all_torque_points, online.all_torque_points, atol=1e-12)
+  np.testing.assert_allclose(batch_fit, online_fit, rtol=1e-9)
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import numpy as np
 from collections import deque, defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 
 import cereal.messaging as messaging
 from cereal import car, log
@@ -9,6 +11,7 @@ from openpilot.common.params import Params
 from openpilot.common.realtime import config_realtime_process, DT_MDL
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.swaglog import cloudlog
+from openpilot.common.transformations.orientation import rot_from_euler
 from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator, PoseCalibrator, Pose
 
 HISTORY = 5  # secs
@@ -48,6 +51,136 @@ class TorqueBuckets(PointBuckets):
         self.buckets[(bound_min, bound_max)].append([x, 1.0, y])
         break
 
+  def add_points(self, xs: np.ndarray, ys: np.ndarray):
+    """add_point for every point, in order"""
+    assert all(a[1] == b[0] for a, b in zip(self.x_bounds[:-1], self.x_bounds[1:], strict=True)), "bucket bounds must be contiguous"
+    edges = [bound_min for bound_min, _ in self.x_bounds] + [self.x_bounds[-1][1]]
+    bucket_idxs = np.digitize(xs, edges) - 1
+    for i, bounds in enumerate(self.x_bounds):
+      in_bucket = bucket_idxs == i
+      if np.any(in_bucket):
+        self.buckets[bounds].extend(np.column_stack([xs[in_bucket], np.ones(np.count_nonzero(in_bucket)), ys[in_bucket]]))
+
+
+def _empty(*shape):
+  return field(default_factory=lambda: np.empty((0, *shape)))
+
+
+@dataclass
+class TorqueSeries:
+  """
+    Columns of the messages TorqueEstimator uses over a whole route, for offline analysis.
+    Times are logMonoTime in seconds and increasing, steer_torque is the negated carOutput.actuatorsOutput.torque.
+  """
+  carControl_t: np.ndarray = _empty()
+  lat_active: np.ndarray = _empty()
+  carOutput_t: np.ndarray = _empty()
+  steer_torque: np.ndarray = _empty()
+  carState_t: np.ndarray = _empty()
+  vego: np.ndarray = _empty()
+  steer_override: np.ndarray = _empty()
+  livePose_t: np.ndarray = _empty()
+  angular_velocity: np.ndarray = _empty(3)  # device frame
+  roll: np.ndarray = _empty()  # device frame
+  liveCalibration_t: np.ndarray = _empty()
+  rpy_calib: np.ndarray = _empty(3)
+  liveDelay_t: np.ndarray = _empty()
+  lateral_delay: np.ndarray = _empty()
+
+  @classmethod
+  def from_log(cls, msgs: Iterable[log.Event]) -> 'TorqueSeries':
+    cols = defaultdict(list)
+    for msg in sorted(msgs, key=lambda m: m.logMonoTime):
+      which, t = msg.which(), msg.logMonoTime * 1e-9
+      if which == "carControl":
+        cols['carControl_t'].append(t)
+        cols['lat_active'].append(msg.carControl.latActive)
+      elif which == "carOutput":
+        cols['carOutput_t'].append(t)
+        cols['steer_torque'].append(-msg.carOutput.actuatorsOutput.torque)
+      elif which == "carState":
+        cols['carState_t'].append(t)
+        cols['vego'].append(msg.carState.vEgo)
+        cols['steer_override'].append(msg.carState.steeringPressed)
+      elif which == "livePose":
+        angular_velocity = msg.livePose.angularVelocityDevice
+        cols['livePose_t'].append(t)
+        cols['angular_velocity'].append([angular_velocity.x, angular_velocity.y, angular_velocity.z])
+        cols['roll'].append(msg.livePose.orientationNED.x)
+      elif which == "liveCalibration":
+        cols['liveCalibration_t'].append(t)
+        cols['rpy_calib'].append(list(msg.liveCalibration.rpyCalib))
+      elif which == "liveDelay":
+        cols['liveDelay_t'].append(t)
+        cols['lateral_delay'].append(msg.liveDelay.lateralDelay)
+
+    series = cls()
+    for k, v in cols.items():
+      setattr(series, k, np.array(v, dtype=np.float64))
+    return series
+
+
+def _interp_window(x: np.ndarray, xp: np.ndarray, fp: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+  # np.interp(x, xp[lo:hi], fp[lo:hi]) for each element, the window bounds broadcast with x
+  return np.interp(np.clip(x, xp[lo], xp[hi - 1]), xp, fp)
+
+
+def torque_points(series: TorqueSeries, hist_len: int, chunk_size: int = 4096) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """
+    Steer torque and lateral acceleration at every livePose, and whether it's a point TorqueEstimator uses,
+    the same as calling TorqueEstimator.handle_log for every message of the series in order.
+  """
+  def lag_at(t):
+    # the last lateral delay received before t
+    idx = np.searchsorted(series.liveDelay_t, t, side='left') - 1
+    return np.where(idx >= 0, series.lateral_delay[np.maximum(idx, 0)], 0.0) if len(series.lateral_delay) else np.zeros_like(t)
+
+  def history(ts, values):
+    # the raw points histories at every livePose are the last hist_len messages received before it
+    hi = np.searchsorted(ts, t_pose, side='left')
+    return ts + lag_at(ts), np.asarray(values, dtype=np.float64), np.maximum(hi - hist_len, 0), np.maximum(hi, 1), hi > 0
+
+  t_pose = series.livePose_t
+  cc_t, lat_active, cc_lo, cc_hi, cc_seen = history(series.carControl_t, series.lat_active)
+  co_t, steer_torque, co_lo, co_hi, _ = history(series.carOutput_t, series.steer_torque)
+  cs_t, steer_override, cs_lo, cs_hi, cs_seen = history(series.carState_t, series.steer_override)
+  vego_values = np.asarray(series.vego, dtype=np.float64)
+
+  # livePose is only used once the steer torque history is full
+  full = (np.searchsorted(series.carOutput_t, t_pose, side='left') >= hist_len) & cc_seen & cs_seen
+  idxs = np.flatnonzero(full)
+  if len(idxs) == 0:
+    return np.empty(0), np.empty(0), np.empty(0, dtype=bool)
+
+  calib_idx = np.searchsorted(series.liveCalibration_t, t_pose[idxs], side='left') - 1
+  calib_from_device = np.concatenate([np.eye(3)[None], rot_from_euler(series.rpy_calib).transpose(0, 2, 1)]) if len(series.rpy_calib) else np.eye(3)[None]
+  yaw_rate = np.einsum('ij,ij->i', calib_from_device[calib_idx + 1, 2], series.angular_velocity[idxs])
+
+  t = t_pose[idxs]
+  vego = _interp_window(t, cs_t, vego_values, cs_lo[idxs], cs_hi[idxs])
+  steer = _interp_window(t, co_t, steer_torque, co_lo[idxs], co_hi[idxs])
+  lateral_acc = (vego * yaw_rate) - (np.sin(series.roll[idxs]) * ACCELERATION_DUE_TO_GRAVITY)
+
+  # lat active and no steer override from MIN_ENGAGE_BUFFER before up to the lag after, same grid as np.arange
+  start, stop = t - MIN_ENGAGE_BUFFER, t + lag_at(t)
+  num_steps = np.maximum(np.ceil((stop - start) / DT_MDL), 0).astype(int)
+  step = (start + DT_MDL) - start
+  engaged = np.zeros(len(idxs), dtype=bool)
+  for c in range(0, len(idxs), chunk_size):
+    rows = np.s_[c:c + chunk_size]
+    k = np.arange(num_steps[rows].max(initial=0))
+    ts = start[rows, None] + k * step[rows, None]
+    if len(k) > 1:
+      ts[:, 1] = start[rows] + DT_MDL
+    in_range = k < num_steps[rows, None]
+    i = idxs[rows, None]
+    lat_active_ok = np.all((_interp_window(ts, cc_t, lat_active, cc_lo[i], cc_hi[i]) != 0) | ~in_range, axis=1)
+    no_override = np.all((_interp_window(ts, cs_t, steer_override, cs_lo[i], cs_hi[i]) == 0) | ~in_range, axis=1)
+    engaged[rows] = lat_active_ok & no_override
+
+  valid = engaged & (vego > MIN_VEL) & (np.abs(steer) > STEER_MIN_THRESHOLD)
+  return steer, lateral_acc, valid
+
 
 class TorqueEstimator(ParameterEstimator):
   def __init__(self, CP, decimated=False, track_all_points=False):
@@ -201,6 +334,20 @@ class TorqueEstimator(ParameterEstimator):
           if self.track_all_points:
             self.all_torque_points.append([steer, lateral_acc])
 
+  def fit_series(self, series: TorqueSeries) -> tuple[float, float, float]:
+    """
+      Adds the points of a whole route at once and returns estimate_params(), like calling handle_log for every
+      message of the series in order. The raw points histories aren't carried over to later handle_log calls.
+    """
+    steer, lateral_acc, valid = torque_points(series, self.hist_len)
+    in_range = valid & (np.abs(lateral_acc) <= LAT_ACC_THRESHOLD)
+    self.filtered_points.add_points(steer[in_range], lateral_acc[in_range])
+    if self.track_all_points:
+      self.all_torque_points.extend(np.column_stack([steer[valid], lateral_acc[valid]]).tolist())
+    if len(series.lateral_delay):
+      self.lag = series.lateral_delay[-1]
+    return self.estimate_params()
+
   def get_msg(self, valid=True, with_points=False):
     msg = messaging.new_message('liveTorqueParameters')
     msg.valid = valid
@@ -239,6 +386,24 @@ class TorqueEstimator(ParameterEstimator):
     return msg
 
 
+def step(sm: messaging.SubMaster, pm: messaging.PubMaster, params: Params, estimator: TorqueEstimator) -> None:
+  """One iteration of the main loop, after sm was updated"""
+  if sm.all_checks():
+    for which in sm.updated.keys():
+      if sm.updated[which]:
+        t = sm.logMonoTime[which] * 1e-9
+        estimator.handle_log(t, which, sm[which])
+
+  # 4Hz driven by livePose
+  if sm.frame % 5 == 0:
+    pm.send('liveTorqueParameters', estimator.get_msg(valid=sm.all_checks()))
+
+  # Cache points every 60 seconds while onroad
+  if sm.frame % 240 == 0:
+    msg = estimator.get_msg(valid=sm.all_checks(), with_points=True)
+    params.put_nonblocking("LiveTorqueParameters", msg.to_bytes())
+
+
 def main(demo=False):
   config_realtime_process([0, 1, 2, 3], 5)
 
@@ -250,20 +415,7 @@ def main(demo=False):
 
   while True:
     sm.update()
-    if sm.all_checks():
-      for which in sm.updated.keys():
-        if sm.updated[which]:
-          t = sm.logMonoTime[which] * 1e-9
-          estimator.handle_log(t, which, sm[which])
-
-    # 4Hz driven by livePose
-    if sm.frame % 5 == 0:
-      pm.send('liveTorqueParameters', estimator.get_msg(valid=sm.all_checks()))
-
-    # Cache points every 60 seconds while onroad
-    if sm.frame % 240 == 0:
-      msg = estimator.get_msg(valid=sm.all_checks(), with_points=True)
-      params.put_nonblocking("LiveTorqueParameters", msg.to_bytes())
+    step(sm, pm, params, estimator)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
-import bisect
 import math
 import os
+import numpy as np
 from enum import IntEnum
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
 
 from cereal import log, car
 import cereal.messaging as messaging
@@ -45,39 +45,56 @@ class ET:
 
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
+NUM_EVENTS = max(EVENT_NAME) + 1
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+  """Indexes of the set bits in mask, lowest first"""
+  while mask:
+    low = mask & -mask
+    yield low.bit_length() - 1
+    mask ^= low
 
 
 class Events:
+  """
+    Active events as an integer bitset indexed by EventName, so adding and clearing events are single
+    integer operations. An event can only be active once.
+  """
+
   def __init__(self):
-    self.events: list[int] = []
-    self.static_events: list[int] = []
-    self.event_counters = dict.fromkeys(EVENTS.keys(), 0)
+    self.events = 0
+    self.static_events = 0
+    self.event_counters = np.zeros(NUM_EVENTS, dtype=np.int64)
 
   @property
   def names(self) -> list[int]:
-    return self.events
+    return list(iter_bits(self.events))
 
   def __len__(self) -> int:
-    return len(self.events)
+    return self.events.bit_count()
 
   def add(self, event_name: int, static: bool=False) -> None:
     if static:
-      bisect.insort(self.static_events, event_name)
-    bisect.insort(self.events, event_name)
+      self.static_events |= 1 << event_name
+    self.events |= 1 << event_name
 
   def clear(self) -> None:
-    self.event_counters = {k: (v + 1 if k in self.events else 0) for k, v in self.event_counters.items()}
-    self.events = self.static_events.copy()
+    active = self.names
+    counters = self.event_counters[active] + 1
+    self.event_counters[:] = 0
+    self.event_counters[active] = counters
+    self.events = self.static_events
 
   def contains(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    return any(event_type in EVENTS.get(e, {}) for e in iter_bits(self.events))
 
   def create_alerts(self, event_types: list[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
     ret = []
-    for e in self.events:
+    for e in iter_bits(self.events):
       types = EVENTS[e].keys()
       for et in event_types:
         if et in types:
@@ -93,11 +110,11 @@ class Events:
 
   def add_from_msg(self, events):
     for e in events:
-      bisect.insort(self.events, e.name.raw)
+      self.events |= 1 << e.name.raw
 
   def to_msg(self):
     ret = []
-    for event_name in self.events:
+    for event_name in iter_bits(self.events):
       event = log.OnroadEvent.new_message()
       event.name = event_name
       for event_type in EVENTS.get(event_name, {}):
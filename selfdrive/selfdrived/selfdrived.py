@@ -78,7 +78,7 @@ class SelfdriveD:
                                    'controlsState', 'carControl', 'driverAssistance', 'alertDebug', 'userFlag'] + \
                                    self.camera_packets + self.sensor_packets + self.gps_packets,
                                   ignore_alive=ignore, ignore_avg_freq=ignore,
-                                  ignore_valid=ignore, frequency=int(1/DT_CTRL))
+                                  ignore_valid=ignore, frequency=int(1/DT_CTRL), lazy=True)
 
     # read params
     self.is_metric = self.params.get_bool("IsMetric")
@@ -105,7 +105,7 @@ class SelfdriveD:
     self.last_steering_pressed_frame = 0
     self.distance_traveled = 0
     self.last_functional_fan_frame = 0
-    self.events_prev = []
+    self.events_prev = 0
     self.logged_comm_issue = None
     self.not_running_prev = None
     self.experimental_mode = False
@@ -459,12 +459,12 @@ class SelfdriveD:
     self.pm.send('selfdriveState', ss_msg)
 
     # onroadEvents - logged every second or on change
-    if (self.sm.frame % int(1. / DT_CTRL) == 0) or (self.events.names != self.events_prev):
+    if (self.sm.frame % int(1. / DT_CTRL) == 0) or (self.events.events != self.events_prev):
       ce_send = messaging.new_message('onroadEvents', len(self.events))
       ce_send.valid = True
       ce_send.onroadEvents = self.events.to_msg()
       self.pm.send('onroadEvents', ce_send)
-    self.events_prev = self.events.names.copy()
+    self.events_prev = self.events.events
 
   def step(self):
     CS = self.data_sample()
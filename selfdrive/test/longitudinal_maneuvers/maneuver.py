@@ -1,3 +1,4 @@
+import concurrent.futures
 import numpy as np
 from openpilot.selfdrive.test.longitudinal_maneuvers.plant import Plant
 
@@ -81,3 +82,18 @@ class Maneuver:
 
     print("maneuver end", valid)
     return valid, np.array(logs)
+
+
+def _evaluate(maneuver):
+  return maneuver.evaluate()
+
+
+def evaluate_maneuvers(maneuvers, workers=None):
+  """
+    Evaluates the maneuvers in parallel across a process pool, each with its own planner.
+    Yields (maneuver, valid, logs) in the order of maneuvers.
+  """
+  maneuvers = list(maneuvers)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    for maneuver, (valid, logs) in zip(maneuvers, pool.map(_evaluate, maneuvers), strict=True):
+      yield maneuver, valid, logs
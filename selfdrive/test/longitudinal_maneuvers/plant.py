@@ -1,9 +1,7 @@
 #!/usr/bin/env python3
-import time
+from types import SimpleNamespace
 import numpy as np
 
-from cereal import log
-import cereal.messaging as messaging
 from openpilot.common.realtime import Ratekeeper, DT_MDL
 from openpilot.selfdrive.controls.lib.longcontrol import LongCtrlState
 from openpilot.selfdrive.modeld.constants import ModelConstants
@@ -11,20 +9,24 @@ from openpilot.selfdrive.controls.lib.longitudinal_planner import LongitudinalPl
 from openpilot.selfdrive.controls.radard import _LEAD_ACCEL_TAU
 
 
+T_IDXS = np.array(ModelConstants.T_IDXS)
+
+
+def lead_data(d_rel=0.0, v_rel=0.0, a_rel=0.0, v_lead=0.0, a_lead=0.0, status=False, prob=0.0):
+  return SimpleNamespace(dRel=d_rel, yRel=0.0, vRel=v_rel, aRel=a_rel, vLead=v_lead, vLeadK=v_lead, aLeadK=a_lead,
+                         aLeadTau=_LEAD_ACCEL_TAU, status=status, modelProb=prob)
+
+
 class Plant:
-  messaging_initialized = False
+  """
+    Simulates the car and a lead in lockstep with LongitudinalPlanner.update, which is called directly
+    with lightweight stand-ins for the messages it reads. Runs as fast as the planner unless realtime is set.
+  """
 
   def __init__(self, lead_relevancy=False, speed=0.0, distance_lead=2.0,
-               enabled=True, only_lead2=False, only_radar=False, e2e=False, personality=0, force_decel=False):
+               enabled=True, only_lead2=False, only_radar=False, e2e=False, personality=0, force_decel=False, realtime=False):
     self.rate = 1. / DT_MDL
-
-    if not Plant.messaging_initialized:
-      Plant.radar = messaging.pub_sock('radarState')
-      Plant.controls_state = messaging.pub_sock('controlsState')
-      Plant.selfdrive_state = messaging.pub_sock('selfdriveState')
-      Plant.car_state = messaging.pub_sock('carState')
-      Plant.plan = messaging.sub_sock('longitudinalPlan')
-      Plant.messaging_initialized = True
+    self.frame = 0
 
     self.v_lead_prev = 0.0
 
@@ -43,10 +45,14 @@ class Plant:
     self.personality = personality
     self.force_decel = force_decel
 
-    self.rk = Ratekeeper(self.rate, print_delay_threshold=100.0)
+    self.rk = Ratekeeper(self.rate, print_delay_threshold=100.0) if realtime else None
     self.ts = 1. / self.rate
-    time.sleep(0.1)
-    self.sm = messaging.SubMaster(['longitudinalPlan'])
+
+    # messages that don't change during a maneuver
+    self.controls_state = SimpleNamespace(longControlState=LongCtrlState.pid if self.enabled else LongCtrlState.off, forceDecel=self.force_decel)
+    self.selfdrive_state = SimpleNamespace(enabled=self.enabled, experimentalMode=self.e2e, personality=self.personality)
+    self.live_parameters = SimpleNamespace(angleOffsetDeg=0.0)
+    self.no_lead = lead_data()
 
     from opendbc.car.honda.values import CAR
     from opendbc.car.honda.interface import CarInterface
@@ -55,18 +61,11 @@ class Plant:
 
   @property
   def current_time(self):
-    return float(self.rk.frame) / self.rate
+    return float(self.frame) / self.rate
 
   def step(self, v_lead=0.0, prob_lead=1.0, v_cruise=50., pitch=0.0, prob_throttle=1.0):
-    # ******** publish a fake model going straight and fake calibration ********
+    # ******** fake a model going straight and fake calibration ********
     # note that this is worst case for MPC, since model will delay long mpc by one time step
-    radar = messaging.new_message('radarState')
-    control = messaging.new_message('controlsState')
-    ss = messaging.new_message('selfdriveState')
-    car_state = messaging.new_message('carState')
-    lp = messaging.new_message('liveParameters')
-    car_control = messaging.new_message('carControl')
-    model = messaging.new_message('modelV2')
     a_lead = (v_lead - self.v_lead_prev)/self.ts
     self.v_lead_prev = v_lead
 
@@ -85,55 +84,34 @@ class Plant:
       prob_lead = 0.0
       status = False
 
-    lead = log.RadarState.LeadData.new_message()
-    lead.dRel = float(d_rel)
-    lead.yRel = 0.0
-    lead.vRel = float(v_rel)
-    lead.aRel = float(a_lead - self.acceleration)
-    lead.vLead = float(v_lead)
-    lead.vLeadK = float(v_lead)
-    lead.aLeadK = float(a_lead)
     # TODO use real radard logic for this
-    lead.aLeadTau = float(_LEAD_ACCEL_TAU)
-    lead.status = status
-    lead.modelProb = float(prob_lead)
-    if not self.only_lead2:
-      radar.radarState.leadOne = lead
-    radar.radarState.leadTwo = lead
+    lead = lead_data(float(d_rel), float(v_rel), float(a_lead - self.acceleration), float(v_lead), float(a_lead), status, float(prob_lead))
+    radar_state = SimpleNamespace(leadOne=self.no_lead if self.only_lead2 else lead, leadTwo=lead)
 
     # Simulate model predicting slightly faster speed
     # this is to ensure lead policy is effective when model
     # does not predict slowdown in e2e mode
-    position = log.XYZTData.new_message()
-    position.x = [float(x) for x in (self.speed + 0.5) * np.array(ModelConstants.T_IDXS)]
-    model.modelV2.position = position
-    model.modelV2.action.desiredAcceleration = float(self.acceleration + 0.1)
-    velocity = log.XYZTData.new_message()
-    velocity.x = [float(x) for x in (self.speed + 0.5) * np.ones_like(ModelConstants.T_IDXS)]
-    velocity.x[0] = float(self.speed) # always start at current speed
-    model.modelV2.velocity = velocity
-    acceleration = log.XYZTData.new_message()
-    acceleration.x = [float(x) for x in np.zeros_like(ModelConstants.T_IDXS)]
-    model.modelV2.acceleration = acceleration
-    model.modelV2.meta.disengagePredictions.gasPressProbs = [float(prob_throttle) for _ in range(6)]
-
-    control.controlsState.longControlState = LongCtrlState.pid if self.enabled else LongCtrlState.off
-    ss.selfdriveState.experimentalMode = self.e2e
-    ss.selfdriveState.personality = self.personality
-    control.controlsState.forceDecel = self.force_decel
-    car_state.carState.vEgo = float(self.speed)
-    car_state.carState.standstill = bool(self.speed < 0.01)
-    car_state.carState.vCruise = float(v_cruise * 3.6)
-    car_control.carControl.orientationNED = [0., float(pitch), 0.]
-
-    # ******** get controlsState messages for plotting ***
-    sm = {'radarState': radar.radarState,
-          'carState': car_state.carState,
-          'carControl': car_control.carControl,
-          'controlsState': control.controlsState,
-          'selfdriveState': ss.selfdriveState,
-          'liveParameters': lp.liveParameters,
-          'modelV2': model.modelV2}
+    velocity = np.full(len(T_IDXS), self.speed + 0.5)
+    velocity[0] = self.speed  # always start at current speed
+    model = SimpleNamespace(
+      position=SimpleNamespace(x=(self.speed + 0.5) * T_IDXS),
+      velocity=SimpleNamespace(x=velocity),
+      acceleration=SimpleNamespace(x=np.zeros(len(T_IDXS))),
+      action=SimpleNamespace(desiredAcceleration=self.acceleration + 0.1),
+      temporalPose=SimpleNamespace(trans=[]),
+      meta=SimpleNamespace(disengagePredictions=SimpleNamespace(gasPressProbs=[float(prob_throttle)] * 6)),
+    )
+
+    car_state = SimpleNamespace(vEgo=float(self.speed), aEgo=0.0, standstill=bool(self.speed < 0.01), vCruise=float(v_cruise * 3.6), steeringAngleDeg=0.0)
+    car_control = SimpleNamespace(orientationNED=[0., float(pitch), 0.])
+
+    sm = {'radarState': radar_state,
+          'carState': car_state,
+          'carControl': car_control,
+          'controlsState': self.controls_state,
+          'selfdriveState': self.selfdrive_state,
+          'liveParameters': self.live_parameters,
+          'modelV2': model}
     self.planner.update(sm)
     self.acceleration = self.planner.output_a_target
     self.speed = self.speed + self.acceleration * self.ts
@@ -157,13 +135,15 @@ class Plant:
       v_rel = 0.
 
     # print at 5hz
-    # if (self.rk.frame % (self.rate // 5)) == 0:
+    # if (self.frame % (self.rate // 5)) == 0:
     #   print("%2.2f sec   %6.2f m  %6.2f m/s  %6.2f m/s2   lead_rel: %6.2f m  %6.2f m/s"
     #         % (self.current_time, self.distance, self.speed, self.acceleration, d_rel, v_rel))
 
 
     # ******** update prevs ********
-    self.rk.monitor_time()
+    self.frame += 1
+    if self.rk is not None:
+      self.rk.keep_time()
 
     return {
       "distance": self.distance,
@@ -176,7 +156,7 @@ class Plant:
 
 # simple engage in standalone mode
 def plant_thread():
-  plant = Plant()
+  plant = Plant(realtime=True)
   while 1:
     plant.step()
 
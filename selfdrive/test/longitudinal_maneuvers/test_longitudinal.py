@@ -2,7 +2,7 @@ import itertools
 from parameterized import parameterized_class
 
 from openpilot.selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import STOP_DISTANCE
-from openpilot.selfdrive.test.longitudinal_maneuvers.maneuver import Maneuver
+from openpilot.selfdrive.test.longitudinal_maneuvers.maneuver import Maneuver, evaluate_maneuvers
 
 
 # TODO: make new FCW tests
@@ -184,8 +184,7 @@ class TestLongitudinalControl:
   force_decel: bool
 
   def test_maneuver(self, subtests):
-    for maneuver in create_maneuvers({"e2e": self.e2e, "force_decel": self.force_decel}):
+    for maneuver, valid, _ in evaluate_maneuvers(create_maneuvers({"e2e": self.e2e, "force_decel": self.force_decel})):
       with subtests.test(title=maneuver.title, e2e=maneuver.e2e, force_decel=maneuver.force_decel):
         print(maneuver.title, f'in {"e2e" if maneuver.e2e else "acc"} mode')
-        valid, _ = maneuver.evaluate()
         assert valid
@@ -0,0 +1,147 @@
+import os
+import time
+from collections import defaultdict
+
+import capnp
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import car
+from cereal.services import SERVICE_LIST
+from openpilot.common.params import Params
+from openpilot.selfdrive.controls import radard
+from openpilot.selfdrive.locationd import calibrationd, lagd, locationd, paramsd, torqued
+
+
+class CollectingPubMaster(messaging.PubMaster):
+  """PubMaster that keeps the sent messages instead of publishing them"""
+
+  def __init__(self):
+    self.sock = {}
+    self.msgs: list[bytes] = []
+
+  def send(self, s: str, dat: bytes | capnp._DynamicStructBuilder) -> None:
+    self.msgs.append(dat if isinstance(dat, bytes) else dat.to_bytes())
+
+  def pop(self) -> list[bytes]:
+    msgs, self.msgs = self.msgs, []
+    return msgs
+
+
+class ReplaySubMaster(messaging.SubMaster):
+  """SubMaster that is only fed through update_msgs, so it doesn't open any sockets"""
+
+  def _sub_sock(self, s: str, poller: messaging.Poller | None, addr: str) -> None:
+    return None
+
+
+class InProcessDaemon:
+  """
+    One iteration of a daemon's main loop per replay cycle, without msgq, fake events or a subprocess.
+    The received messages are handed to the SubMaster as readers, keeping only the last one of each service like
+    the conflated sockets do, services in drained_services get all their messages like drain_sock does.
+    update() calls the same step function as the daemon's main().
+  """
+  drained_services: tuple[str, ...] = ()
+
+  def __init__(self, services: list[str], poll: str):
+    self.sm = ReplaySubMaster(services, poll=poll)
+    self.pm = CollectingPubMaster()
+    self.params = Params()
+
+  def step(self, msgs: list[capnp._DynamicStructReader]) -> list[bytes]:
+    conflated: dict[str, capnp._DynamicStructReader] = {}
+    drained: dict[str, list[capnp._DynamicStructReader]] = defaultdict(list)
+    for msg in msgs:
+      which = msg.which()
+      if which in self.drained_services:
+        drained[which].append(msg)
+      elif which in self.sm.services:
+        conflated[which] = msg
+
+    self.sm.update_msgs(time.monotonic(), list(conflated.values()))
+    self.update(drained)
+    return self.pm.pop()
+
+  def update(self, drained: dict[str, list[capnp._DynamicStructReader]]) -> None:
+    raise NotImplementedError
+
+
+class Radard(InProcessDaemon):
+  def __init__(self):
+    super().__init__(['modelV2', 'carState', 'liveTracks'], 'modelV2')
+    CP = messaging.log_from_bytes(self.params.get("CarParams"), car.CarParams)
+    self.RD = radard.RadarD(CP.radarDelay)
+
+  def update(self, drained):
+    radard.step(self.sm, self.pm, self.RD)
+
+
+class Calibrationd(InProcessDaemon):
+  def __init__(self):
+    super().__init__(['cameraOdometry', 'carState'], 'cameraOdometry')
+    CP = messaging.log_from_bytes(self.params.get("CarParams"), car.CarParams)
+    self.calibrator = calibrationd.Calibrator(param_put=True)
+    self.calibrator.not_car = CP.notCar
+
+  def update(self, drained):
+    calibrationd.step(self.sm, self.pm, self.calibrator)
+
+
+class Locationd(InProcessDaemon):
+  drained_services = ('accelerometer', 'gyroscope')
+
+  def __init__(self):
+    super().__init__(['carState', 'liveCalibration', 'cameraOdometry'], 'cameraOdometry')
+    self.state = locationd.LocationdState(self.params, bool(int(os.getenv("DEBUG", "0"))), bool(int(os.getenv("SIMULATION", "0"))))
+
+  def update(self, drained):
+    locationd.step(self.sm, self.pm, self.state, drained['accelerometer'], drained['gyroscope'])
+
+
+class Paramsd(InProcessDaemon):
+  def __init__(self):
+    super().__init__(['livePose', 'liveCalibration', 'carState'], 'livePose')
+    self.debug = bool(int(os.getenv("DEBUG", "0")))
+    CP = messaging.log_from_bytes(self.params.get("CarParams"), car.CarParams)
+    paramsd.migrate_cached_vehicle_params_if_needed(self.params)
+
+    replay = bool(int(os.getenv("REPLAY", "0")))
+    steer_ratio, stiffness_factor, angle_offset_deg, pInitial = paramsd.retrieve_initial_vehicle_params(self.params, CP, replay, self.debug)
+    self.learner = paramsd.VehicleParamsLearner(CP, steer_ratio, stiffness_factor, np.radians(angle_offset_deg), pInitial)
+
+  def update(self, drained):
+    paramsd.step(self.sm, self.pm, self.params, self.learner, self.debug)
+
+
+class Lagd(InProcessDaemon):
+  def __init__(self):
+    super().__init__(['livePose', 'liveCalibration', 'carState', 'controlsState', 'carControl'], 'livePose')
+    self.debug = bool(int(os.getenv("DEBUG", "0")))
+    CP = messaging.log_from_bytes(self.params.get("CarParams"), car.CarParams)
+    self.lag_learner = lagd.LateralLagEstimator(CP, 1. / SERVICE_LIST['livePose'].frequency, enabled=not self.params.get_bool("IsReleaseBranch"))
+    if (initial_lag_params := lagd.retrieve_initial_lag(self.params, CP)) is not None:
+      self.lag_learner.reset(*initial_lag_params)
+
+  def update(self, drained):
+    lagd.step(self.sm, self.pm, self.params, self.lag_learner, self.debug)
+
+
+class Torqued(InProcessDaemon):
+  def __init__(self):
+    super().__init__(['carControl', 'carOutput', 'carState', 'liveCalibration', 'livePose', 'liveDelay'], 'livePose')
+    self.estimator = torqued.TorqueEstimator(messaging.log_from_bytes(self.params.get("CarParams"), car.CarParams))
+
+  def update(self, drained):
+    torqued.step(self.sm, self.pm, self.params, self.estimator)
+
+
+# pure-Python daemons whose main loop is a step function that can run in-process
+IN_PROCESS_DAEMONS: dict[str, type[InProcessDaemon]] = {
+  "radard": Radard,
+  "calibrationd": Calibrationd,
+  "locationd": Locationd,
+  "paramsd": Paramsd,
+  "lagd": Lagd,
+  "torqued": Torqued,
+}
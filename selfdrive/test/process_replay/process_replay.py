@@ -4,7 +4,7 @@ import time
 import copy
 import heapq
 import signal
-from collections import Counter, OrderedDict
+from collections import Counter, OrderedDict, deque
 from dataclasses import dataclass, field
 from typing import Any
 from collections.abc import Callable, Iterable
@@ -26,6 +26,7 @@ from openpilot.system.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.process_replay.inprocess import IN_PROCESS_DAEMONS, InProcessDaemon
 from openpilot.tools.lib.logreader import LogIterable
 from openpilot.tools.lib.framereader import FrameReader
 
@@ -125,6 +126,51 @@ class ReplayContext:
       self.all_recv_called_events[index].wait()
 
 
+class ReplayLog:
+  """
+    Events of a log, shared between replays of many processes. Iterating yields the events in log order.
+    The migrated logs, the sorted events and the events published to each set of processes are computed once and cached.
+  """
+  def __init__(self, lr: LogIterable):
+    self._lr = list(lr)
+    self._msgs: list[capnp._DynamicStructReader] | None = None
+    self._types: list[str] | None = None
+    self._migrated: dict[tuple[bool, bool], ReplayLog] = {}
+    self._filtered: dict[frozenset[str], list[capnp._DynamicStructReader]] = {}
+
+  def __iter__(self):
+    return iter(self._lr)
+
+  def __len__(self) -> int:
+    return len(self._lr)
+
+  @property
+  def msgs(self) -> list[capnp._DynamicStructReader]:
+    """Events sorted by logMonoTime"""
+    if self._msgs is None:
+      self._msgs = sorted(self._lr, key=lambda msg: msg.logMonoTime)
+    return self._msgs
+
+  @property
+  def types(self) -> list[str]:
+    if self._types is None:
+      self._types = [msg.which() for msg in self.msgs]
+    return self._types
+
+  def migrated(self, panda_states: bool, camera_states: bool) -> 'ReplayLog':
+    key = (panda_states, camera_states)
+    if key not in self._migrated:
+      self._migrated[key] = ReplayLog(migrate_all(self._lr, manager_states=True, panda_states=panda_states, camera_states=camera_states))
+    return self._migrated[key]
+
+  def filter(self, msg_types: Iterable[str]) -> list[capnp._DynamicStructReader]:
+    """Events of the given types, in order"""
+    msg_types = frozenset(msg_types)
+    if msg_types not in self._filtered:
+      self._filtered[msg_types] = [msg for msg, t in zip(self.msgs, self.types, strict=True) if t in msg_types]
+    return self._filtered[msg_types]
+
+
 @dataclass
 class ProcessConfig:
   proc_name: str
@@ -317,6 +363,59 @@ class ProcessContainer:
     return output_msgs
 
 
+class InProcessContainer(ProcessContainer):
+  """
+    Replays a pure-Python daemon by running its main loop's step function in this process, see inprocess.py.
+    Messages are handed over as readers, so there is no msgq, fake event handshake or (de)serialization of the inputs.
+  """
+  def __init__(self, cfg: ProcessConfig):
+    super().__init__(cfg)
+    self.daemon: InProcessDaemon | None = None
+
+  def start(
+    self, params_config: dict[str, Any], environ_config: dict[str, Any],
+    all_msgs: LogIterable, frs: dict[str, FrameReader] | None,
+    fingerprint: str | None, capture_output: bool
+  ):
+    assert not capture_output, "output can't be captured from in-process replays"
+    with self.prefix:
+      self._setup_env(params_config, environ_config)
+
+      if self.cfg.config_callback is not None:
+        params = Params()
+        self.cfg.config_callback(params, self.cfg, all_msgs)
+
+      if self.cfg.init_callback is not None:
+        self.cfg.init_callback(None, None, all_msgs, fingerprint)
+
+      self.daemon = IN_PROCESS_DAEMONS[self.cfg.proc_name]()
+
+  def stop(self):
+    with self.prefix:
+      self.prefix.clean_dirs()
+      self._clean_env()
+
+  def run_step(self, msg: capnp._DynamicStructReader, frs: dict[str, FrameReader] | None) -> list[capnp._DynamicStructReader]:
+    assert self.daemon is not None
+
+    output_msgs = []
+    end_of_cycle = True
+    if self.cfg.should_recv_callback is not None:
+      end_of_cycle = self.cfg.should_recv_callback(msg, self.cfg, self.cnt)
+
+    self.msg_queue.append(msg)
+    if end_of_cycle:
+      with self.prefix:
+        for dat in self.daemon.step(self.msg_queue):
+          m = messaging.log_from_bytes(dat).as_builder()
+          m.logMonoTime = msg.logMonoTime + int(self.cfg.processing_time * 1e9)
+          output_msgs.append(m.as_reader())
+      self.msg_queue = []
+      self.cnt += 1
+
+    return output_msgs
+
+
 def card_fingerprint_callback(rc, pm, msgs, fingerprint):
   print("start fingerprinting")
   params = Params()
@@ -506,7 +605,8 @@ CONFIGS = [
     proc_name="plannerd",
     pubs=["modelV2", "carControl", "carState", "controlsState", "liveParameters", "radarState", "selfdriveState"],
     subs=["longitudinalPlan", "driverAssistance"],
-    ignore=["logMonoTime", "longitudinalPlan.processingDelay", "longitudinalPlan.solverExecutionTime"],
+    ignore=["logMonoTime", "longitudinalPlan.processingDelay", "longitudinalPlan.solverExecutionTime", "longitudinalPlan.solverSetupTime",
+            "longitudinalPlan.solverLinearizationTime", "longitudinalPlan.solverIntegratorTime", "longitudinalPlan.solverQpTime"],
     init_callback=get_car_params_callback,
     should_recv_callback=FrequencyBasedRcvCallback("modelV2"),
     tolerance=NUMPY_TOLERANCE,
@@ -655,18 +755,19 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] = None,
   fingerprint: str = None, return_all_logs: bool = False, custom_params: dict[str, Any] = None,
-  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False, in_process: bool = False
 ) -> list[capnp._DynamicStructReader]:
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
   else:
     cfgs = [cfg]
 
-  all_msgs = migrate_all(lr,
-                         manager_states=True,
-                         panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
+  # pass a ReplayLog to reuse the migrated and sorted log between replays
+  if not isinstance(lr, ReplayLog):
+    lr = ReplayLog(lr)
+  all_msgs = lr.migrated(panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
                          camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, in_process)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -681,8 +782,9 @@ def replay_process(
 
 
 def _replay_multi_process(
-  cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  cfgs: list[ProcessConfig], lr: ReplayLog, frs: dict[str, FrameReader] | None, fingerprint: str | None,
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  in_process: bool = False
 ) -> list[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -701,12 +803,13 @@ def _replay_multi_process(
     required_vision_pubs = {m.camera_state for m in available_streams(lr)} & set(all_vision_pubs)
     assert all(st in frs for st in required_vision_pubs), f"frs for this process must contain following vision streams: {required_vision_pubs}"
 
-  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  all_msgs = lr.msgs
   log_msgs = []
   try:
     containers = []
     for cfg in cfgs:
-      container = ProcessContainer(cfg)
+      # pure-Python daemons can skip the subprocess, the others are always replayed over msgq
+      container = InProcessContainer(cfg) if in_process and cfg.proc_name in IN_PROCESS_DAEMONS else ProcessContainer(cfg)
       containers.append(container)
       container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
 
@@ -715,9 +818,8 @@ def _replay_multi_process(
     lr_pubs = all_pubs - all_subs
     pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
 
-    pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
     # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: list[capnp._DynamicStructReader] = pub_msgs.copy()
+    external_pub_queue: deque[capnp._DynamicStructReader] = deque(lr.filter(lr_pubs))
     internal_pub_queue: list[capnp._DynamicStructReader] = []
     # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
     internal_pub_index_heap: list[tuple[int, int]] = []
@@ -725,7 +827,7 @@ def _replay_multi_process(
     pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
     while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
       if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+        msg = external_pub_queue.popleft()
         pbar.update(1)
       else:
         _, index = heapq.heappop(internal_pub_index_heap)
@@ -0,0 +1,25 @@
+from parameterized import parameterized
+
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.inprocess import IN_PROCESS_DAEMONS
+from openpilot.selfdrive.test.process_replay.process_replay import ReplayLog, get_process_config, replay_process
+from openpilot.tools.lib.openpilotci import get_url
+from openpilot.tools.lib.logreader import LogReader
+
+TEST_SEGMENT = "regen218A4DCFAA1|2025-04-08--22-57-51--0"  # TOYOTA.TOYOTA_PRIUS
+
+
+class TestInProcessReplay:
+  @classmethod
+  def setup_class(cls):
+    cls.lr = ReplayLog(LogReader(get_url(*TEST_SEGMENT.rsplit("--", 1), "rlog.zst")))
+
+  @parameterized.expand(IN_PROCESS_DAEMONS.keys())
+  def test_matches_socket_replay(self, proc_name):
+    cfg = get_process_config(proc_name)
+
+    socket_msgs = replay_process(cfg, self.lr, disable_progress=True)
+    in_process_msgs = replay_process(cfg, self.lr, disable_progress=True, in_process=True)
+
+    diff = compare_logs(socket_msgs, in_process_msgs, cfg.ignore, tolerance=cfg.tolerance)
+    assert len(diff) == 0, f"in-process replay of {proc_name} differs from socket replay: {diff[:10]}"
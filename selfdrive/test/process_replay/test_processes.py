@@ -1,20 +1,24 @@
 #!/usr/bin/env python3
 import argparse
 import concurrent.futures
+import functools
 import os
 import sys
+import tempfile
+import time
 from collections import defaultdict
 from tqdm import tqdm
 from typing import Any
 
 from opendbc.car.car_helpers import interface_names
+from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.common.git import get_commit
 from openpilot.tools.lib.openpilotci import get_url, upload_file
 from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
-from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, replay_process, \
+from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, ReplayLog, replay_process, \
                                                                    check_most_messages_valid
 from openpilot.tools.lib.filereader import FileReader
-from openpilot.tools.lib.logreader import LogReader, save_log
+from openpilot.tools.lib.logreader import LogReader, decompress_chunks, save_log
 
 source_segments = [
   ("BODY", "937ccb7243511b65|2022-05-24--16-03-09--1"),        # COMMA.COMMA_BODY
@@ -70,12 +74,10 @@ REF_COMMIT_FN = os.path.join(PROC_REPLAY_DIR, "ref_commit")
 EXCLUDED_PROCS = {"modeld", "dmonitoringmodeld"}
 
 
-def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+def run_test_process(args, lr, segment, cfg, cur_log_fn, ref_log_path):
   res = None
   if not args.upload_only:
-    lr = LogReader.from_bytes(lr_dat)
-    res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
+    res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs, args.in_process)
     # save logs so we can upload when updating refs
     save_log(cur_log_fn, log_msgs)
 
@@ -84,16 +86,32 @@ def run_test_process(data):
     assert os.path.exists(cur_log_fn), f"Cannot find log to upload: {cur_log_fn}"
     upload_file(cur_log_fn, os.path.basename(cur_log_fn))
     os.remove(cur_log_fn)
-  return (segment, cfg.proc_name, res)
+  return (cfg.proc_name, res)
 
 
-def get_log_data(segment):
+def run_segment_tests(data):
+  """Runs all the tests of a segment in one worker, so its rlog is only parsed once"""
+  segment, args, log_fn, tests = data
+  lr, msg_count = None, 0
+  t = time.monotonic()
+  if not args.upload_only:
+    lr = ReplayLog(LogReader(log_fn))
+    msg_count = len(lr)
+  results = [run_test_process(args, lr, segment, *test) for test in tests]
+  return (segment, results, time.monotonic() - t, msg_count)
+
+
+def get_log_data(log_dir, segment):
+  """Downloads and decompresses the rlog of a segment once into log_dir, where the workers read it from"""
+  log_fn = os.path.join(log_dir, f"{segment}_rlog")
   r, n = segment.rsplit("--", 1)
-  with FileReader(get_url(r, n, "rlog.zst")) as f:
-    return (segment, f.read())
+  with FileReader(get_url(r, n, "rlog.zst")) as f, atomic_write_in_dir(log_fn, mode="wb") as out:
+    for chunk in decompress_chunks(iter(functools.partial(f.read, 1 << 20), b""), ".zst"):
+      out.write(chunk)
+  return (segment, log_fn)
 
 
-def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
+def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None, in_process=False):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
@@ -102,7 +120,7 @@ def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=Non
   ref_log_msgs = list(LogReader(ref_log_path))
 
   try:
-    log_msgs = replay_process(cfg, lr, disable_progress=True)
+    log_msgs = replay_process(cfg, lr, disable_progress=True, in_process=in_process)
   except Exception as e:
     raise Exception("failed on segment: " + segment) from e
 
@@ -110,7 +128,7 @@ def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=Non
     return f"Route did not have enough valid messages: {new_log_path}", log_msgs
 
   # skip this check if the segment is using qcom gps
-  if cfg.proc_name != 'ubloxd' or any(m.which() in cfg.pubs for m in lr):
+  if cfg.proc_name != 'ubloxd' or any(t in cfg.pubs for t in lr.types):
     seen_msgs = {m.which() for m in log_msgs}
     expected_msgs = set(cfg.subs)
     if seen_msgs != expected_msgs:
@@ -145,6 +163,8 @@ if __name__ == "__main__":
                       help="Updates reference logs using current commit")
   parser.add_argument("--upload-only", action="store_true",
                       help="Skips testing processes and uploads logs from previous test run")
+  parser.add_argument("--in-process", action="store_true",
+                      help="Replay pure-Python processes in-process instead of over msgq")
   parser.add_argument("-j", "--jobs", type=int, default=max(cpu_count - 2, 1),
                       help="Max amount of parallel jobs")
   args = parser.parse_args()
@@ -179,15 +199,17 @@ if __name__ == "__main__":
     assert len(untested) == 0, f"Cars missing routes: {str(untested)}"
 
   log_paths: defaultdict[str, dict[str, dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
-  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+  # the decompressed rlogs take several GB, they're removed after the run
+  with tempfile.TemporaryDirectory(prefix="rlogs_", dir=FAKEDATA) as log_dir, \
+       concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
     if not args.upload_only:
       download_segments = [seg for car, seg in segments if car in tested_cars]
-      log_data: dict[str, LogReader] = {}
-      p1 = pool.map(get_log_data, download_segments)
-      for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
-        log_data[segment] = lr
+      log_data: dict[str, str] = {}
+      p1 = pool.map(functools.partial(get_log_data, log_dir), download_segments)
+      for segment, log_fn in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
+        log_data[segment] = log_fn
 
-    pool_args: Any = []
+    segment_tests: defaultdict[str, list[tuple[Any, str, str]]] = defaultdict(list)
     for car_brand, segment in segments:
       if car_brand not in tested_cars:
         continue
@@ -207,17 +229,25 @@ if __name__ == "__main__":
           ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst")
           ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
 
-        dat = None if args.upload_only else log_data[segment]
-        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, dat))
+        segment_tests[segment].append((cfg, cur_log_fn, ref_log_path))
 
         log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
         log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
 
+    pool_args = [(segment, args, None if args.upload_only else log_data[segment], tests) for segment, tests in segment_tests.items()]
+
     results: Any = defaultdict(dict)
-    p2 = pool.map(run_test_process, pool_args)
-    for (segment, proc, result) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
+    replay_stats: dict[str, tuple[float, int]] = {}
+    p2 = pool.map(run_segment_tests, pool_args)
+    for (segment, segment_results, wall_time, msg_count) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
       if not args.upload_only:
-        results[segment][proc] = result
+        results[segment].update(segment_results)
+        replay_stats[segment] = (wall_time, msg_count)
+
+  if not args.upload_only:
+    print("\nReplay throughput:")
+    for segment, (wall_time, msg_count) in replay_stats.items():
+      print(f"  {segment}: {wall_time:.1f}s for {len(results[segment])} processes, {msg_count / max(wall_time, 1e-9):,.0f} input msgs/s")
 
   diff_short, diff_long, failed = format_diff(results, log_paths, ref_commit)
   if not upload:
@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import base64
+import bisect
 import hashlib
+import heapq
 import io
 import json
 import os
@@ -34,7 +36,8 @@ from openpilot.common.file_helpers import CallbackReader, get_upload_stream
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware import HARDWARE, PC
-from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
+from openpilot.system.loggerd.file_index import FileIndex
+from openpilot.system.loggerd.xattr_cache import setxattr
 from openpilot.common.swaglog import cloudlog
 from openpilot.system.version import get_build_metadata
 from openpilot.system.hardware.hw import Paths
@@ -562,43 +565,88 @@ def takeSnapshot() -> str | dict[str, str] | None:
     raise Exception("not available while camerad is started")
 
 
-def get_logs_to_send_sorted() -> list[str]:
-  # TODO: scan once then use inotify to detect file creation/deletion
-  curr_time = int(time.time())
-  logs = []
-  for log_entry in os.listdir(Paths.swaglog_root()):
-    log_path = os.path.join(Paths.swaglog_root(), log_entry)
-    time_sent = 0
+class SwaglogQueue(FileIndex):
+  """
+    swaglog files to forward, newest first. The most recent file is still being written and isn't sent.
+    Files sent more than an hour ago without a response are sent again.
+  """
+
+  def __init__(self, root: str):
+    super().__init__(root, LOG_ATTR_NAME)
+
+  def _reset(self) -> None:
+    self.unsent: list[str] = []  # sorted, sent from the end
+    self.queued: set[str] = set()
+    self.retry: list[tuple[int, str]] = []  # heap of (time sent, name)
+    self.newest = ""
+
+  @staticmethod
+  def _time_sent(value: bytes | None) -> int:
     try:
-      value = getxattr(log_path, LOG_ATTR_NAME)
-      if value is not None:
-        time_sent = int.from_bytes(value, sys.byteorder)
+      return int.from_bytes(value, sys.byteorder) if value is not None else 0
     except (ValueError, TypeError):
-      pass
+      return 0
+
+  def _sendable(self, name: str, curr_time: int) -> bool:
+    if name not in self.files[""]:
+      return False
+    time_sent = self._time_sent(self.files[""][name])
     # assume send failed and we lost the response if sent more than one hour ago
-    if not time_sent or curr_time - time_sent > 3600:
-      logs.append(log_entry)
-  # excluding most recent (active) log file
-  return sorted(logs)[:-1]
+    return not time_sent or curr_time - time_sent > 3600
+
+  def _push(self, name: str) -> None:
+    if name not in self.queued:
+      bisect.insort(self.unsent, name)
+      self.queued.add(name)
+
+  def _file_updated(self, d: str, name: str, value: bytes | None) -> None:
+    self.newest = max(self.newest, name)
+    time_sent = self._time_sent(value)
+    if not time_sent:
+      self._push(name)
+    elif value != LOG_ATTR_VALUE_MAX_UNIX_TIME:
+      heapq.heappush(self.retry, (time_sent, name))
+
+  def _file_removed(self, d: str, name: str) -> None:
+    if name == self.newest:
+      self.newest = max(self.files[""], default="")
+
+  def pop(self) -> str | None:
+    self.update()
+    if not self.scanned:
+      return None
+
+    curr_time = int(time.time())
+    while self.retry and curr_time - self.retry[0][0] > 3600:
+      time_sent, name = heapq.heappop(self.retry)
+      if name in self.files[""] and self._time_sent(self.files[""][name]) == time_sent:
+        self._push(name)
+
+    i = len(self.unsent) - 1
+    while i >= 0:
+      name = self.unsent[i]
+      if name == self.newest:
+        i -= 1
+        continue
+      del self.unsent[i]
+      self.queued.discard(name)
+      if self._sendable(name, curr_time):
+        return name
+      i -= 1
+    return None
 
 
 def log_handler(end_event: threading.Event) -> None:
   if PC:
     return
 
-  log_files = []
-  last_scan = 0.
+  log_queue = SwaglogQueue(Paths.swaglog_root())
   while not end_event.is_set():
     try:
-      curr_scan = time.monotonic()
-      if curr_scan - last_scan > 10:
-        log_files = get_logs_to_send_sorted()
-        last_scan = curr_scan
-
       # send one log
       curr_log = None
-      if len(log_files) > 0:
-        log_entry = log_files.pop() # newest log file
+      log_entry = log_queue.pop()  # newest log file
+      if log_entry is not None:
         cloudlog.debug(f"athena.log_handler.forward_request {log_entry}")
         try:
           curr_time = int(time.time())
@@ -642,6 +690,7 @@ def log_handler(end_event: threading.Event) -> None:
 
     except Exception:
       cloudlog.exception("athena.log_handler.exception")
+  log_queue.close()
 
 
 def stat_handler(end_event: threading.Event) -> None:
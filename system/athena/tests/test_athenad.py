@@ -436,13 +436,22 @@ class TestAthenadMethods:
       end_event.set()
       thread.join()
 
-  def test_get_logs_to_send_sorted(self):
+  def test_swaglog_queue(self):
     fl = list()
     for i in range(10):
       file = f'swaglog.{i:010}'
       self._create_file(file, Paths.swaglog_root())
       fl.append(file)
 
-    # ensure the list is all logs except most recent
-    sl = athenad.get_logs_to_send_sorted()
-    assert sl == fl[:-1]
+    # all logs except most recent, newest first
+    log_queue = athenad.SwaglogQueue(Paths.swaglog_root())
+    assert log_queue.pop() == fl[8]
+
+    # new logs are picked up, acknowledged and deleted logs aren't sent
+    self._create_file('swaglog.0000000010', Paths.swaglog_root())
+    athenad.setxattr(os.path.join(Paths.swaglog_root(), fl[7]), athenad.LOG_ATTR_NAME, athenad.LOG_ATTR_VALUE_MAX_UNIX_TIME)
+    os.unlink(os.path.join(Paths.swaglog_root(), fl[0]))
+    sl = []
+    while (log_entry := log_queue.pop()) is not None:
+      sl.append(log_entry)
+    assert sl == [fl[9], *fl[6:0:-1]]
@@ -0,0 +1,262 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+
+from openpilot.common.swaglog import cloudlog
+from openpilot.system.loggerd.xattr_cache import read_xattr
+
+# inotify(7) event masks
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+DIR_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+FILE_EVENTS = DIR_EVENTS | IN_CLOSE_WRITE | IN_ATTRIB
+EVENT_HEADER = struct.Struct("iIII")
+# everything is scanned again this often, in case a change was missed, e.g. in a directory that isn't watched anymore
+RESCAN_INTERVAL = 300.  # s
+
+
+class Inotify:
+  """Non-blocking inotify(7) instance, raises OSError where inotify isn't available"""
+
+  def __init__(self):
+    self.fd = -1
+    self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(self._libc, "inotify_init1"):
+      raise OSError(errno.ENOSYS, "inotify isn't available")
+    self.fd = self._check(self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC))
+
+  @staticmethod
+  def _check(ret: int, path: str | None = None) -> int:
+    if ret < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    return ret
+
+  def add_watch(self, path: str, mask: int) -> int:
+    return self._check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask)), path)
+
+  def rm_watch(self, wd: int) -> None:
+    # fails if the watched directory is already gone, its IN_IGNORED event is then pending
+    self._libc.inotify_rm_watch(self.fd, wd)
+
+  def read(self) -> list[tuple[int, int, str]]:
+    """All pending events as (wd, mask, name)"""
+    events = []
+    while True:
+      try:
+        dat = os.read(self.fd, 64 * 1024)
+      except BlockingIOError:
+        return events
+
+      pos = 0
+      while pos < len(dat):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(dat, pos)
+        pos += EVENT_HEADER.size
+        events.append((wd, mask, os.fsdecode(dat[pos:pos + length].rstrip(b"\0"))))
+        pos += length
+
+  def close(self) -> None:
+    if self.fd >= 0:
+      os.close(self.fd)
+      self.fd = -1
+
+  def __del__(self):
+    self.close()
+
+
+class FileIndex:
+  """
+    Files and the value of one xattr of each, in root or in root's subdirectories with subdirs=True.
+    Everything is scanned once, then kept up to date from inotify events, so update() only reads the pending events.
+    Without inotify, when the kernel's event queue overflowed or while root doesn't exist, update() rescans.
+    It also rescans every RESCAN_INTERVAL seconds.
+
+    Subclasses keep their queues in sync through the hooks, and can stop watching subdirectories that won't change
+    anymore. Changes to files in unwatched directories must be passed to refresh().
+  """
+
+  def __init__(self, root: str, attr_name: str, subdirs: bool = False):
+    self.root = root
+    self.attr_name = attr_name
+    self.subdirs = subdirs
+    # directory relative to root ("" for root itself without subdirs) -> file name -> xattr value
+    self.files: dict[str, dict[str, bytes | None]] = {}
+    self.inotify: Inotify | None = None
+    self.scanned = False
+    self.last_scan = 0.
+    self._root_wd = -1
+    self._wds: dict[int, str] = {}
+    self._dir_wds: dict[str, int] = {}
+    self.rescan()
+
+  # hooks
+  def _reset(self) -> None:
+    pass
+
+  def _file_updated(self, d: str, name: str, value: bytes | None) -> None:
+    pass
+
+  def _file_removed(self, d: str, name: str) -> None:
+    pass
+
+  def _dir_scanned(self, d: str, created: bool) -> None:
+    """d was listed, created is False while rescanning"""
+
+  def _dir_removed(self, d: str) -> None:
+    pass
+
+  def close(self) -> None:
+    """Stop watching, the next update() rescans"""
+    if self.inotify is not None:
+      self.inotify.close()
+      self.inotify = None
+
+  def rescan(self) -> None:
+    self.close()
+    self.last_scan = time.monotonic()
+    self.files.clear()
+    self._wds.clear()
+    self._dir_wds.clear()
+    self._reset()
+
+    self.scanned = os.path.isdir(self.root)
+    if not self.scanned:
+      return
+
+    try:
+      self.inotify = Inotify()
+      if self.subdirs:
+        self._root_wd = self.inotify.add_watch(self.root, DIR_EVENTS | IN_ONLYDIR)
+    except OSError:
+      cloudlog.exception("file_index_inotify_failed")
+      if self.inotify is not None:
+        self.inotify.close()
+        self.inotify = None
+
+    if not self.subdirs:
+      self._scan_dir("", False)
+      return
+
+    try:
+      dirs = [e.name for e in os.scandir(self.root) if e.is_dir()]
+    except OSError:
+      cloudlog.exception("file_index_scan_failed")
+      self.scanned = False
+      return
+    for d in dirs:
+      self._scan_dir(d, False)
+
+  def _scan_dir(self, d: str, created: bool) -> None:
+    path = os.path.join(self.root, d)
+    # watch before listing, so no file is missed
+    if self.inotify is not None:
+      try:
+        wd = self.inotify.add_watch(path, FILE_EVENTS | IN_ONLYDIR)
+      except OSError as e:
+        if e.errno == errno.ENOENT:
+          return
+        # likely out of watches, fall back to rescanning
+        cloudlog.exception("file_index_watch_failed")
+        self.inotify.close()
+        self.inotify = None
+      else:
+        self._wds[wd] = d
+        self._dir_wds[d] = wd
+
+    try:
+      names = [e.name for e in os.scandir(path) if not e.is_dir()]
+    except OSError:
+      self._remove_dir(d)
+      return
+
+    self.files[d] = {}
+    for name in names:
+      self._add_file(d, name)
+    self._dir_scanned(d, created)
+
+  def _add_file(self, d: str, name: str) -> None:
+    try:
+      value = read_xattr(os.path.join(self.root, d, name), self.attr_name)
+    except FileNotFoundError:
+      self._remove_file(d, name)
+      return
+    except OSError:
+      cloudlog.event("file_index_getxattr_failed", fn=os.path.join(self.root, d, name))
+      return
+
+    if d in self.files:
+      self.files[d][name] = value
+      self._file_updated(d, name, value)
+
+  def _remove_file(self, d: str, name: str) -> None:
+    if name in self.files.get(d, {}):
+      del self.files[d][name]
+      self._file_removed(d, name)
+
+  def _remove_dir(self, d: str) -> None:
+    self.unwatch(d)
+    if self.files.pop(d, None) is not None:
+      self._dir_removed(d)
+
+  def unwatch(self, d: str) -> None:
+    wd = self._dir_wds.pop(d, None)
+    if wd is not None:
+      del self._wds[wd]
+      if self.inotify is not None:
+        self.inotify.rm_watch(wd)
+
+  def refresh(self, path: str) -> None:
+    """Read the xattr of path again, or drop it if it's gone"""
+    d, name = os.path.split(os.path.relpath(path, self.root))
+    if d in self.files:
+      self._add_file(d, name)
+
+  def update(self) -> None:
+    if self.inotify is None or not self.scanned or time.monotonic() - self.last_scan > RESCAN_INTERVAL:
+      self.rescan()
+      return
+
+    for wd, mask, name in self.inotify.read():
+      if mask & IN_Q_OVERFLOW:
+        cloudlog.warning("file_index_queue_overflow")
+        self.rescan()
+        return
+
+      if wd == self._root_wd:
+        if mask & IN_IGNORED:
+          # root is gone
+          self.rescan()
+          return
+        elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+          self._scan_dir(name, True)
+        elif mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+          self._remove_dir(name)
+        continue
+
+      d = self._wds.get(wd)
+      if d is None:
+        continue  # watch was removed
+      elif mask & IN_IGNORED:
+        if d == "":
+          self.rescan()
+          return
+        self._remove_dir(d)
+      elif mask & IN_ISDIR:
+        continue
+      elif mask & (IN_DELETE | IN_MOVED_FROM):
+        self._remove_file(d, name)
+      elif not (mask == IN_CLOSE_WRITE and name in self.files.get(d, {})):
+        # written files don't change their xattr
+        self._add_file(d, name)
@@ -3,11 +3,12 @@ import time
 import threading
 import logging
 import json
+import pytest
 from pathlib import Path
 from openpilot.system.hardware.hw import Paths
 
 from openpilot.common.swaglog import cloudlog
-from openpilot.system.loggerd.uploader import main, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
+from openpilot.system.loggerd.uploader import main, UploadQueue, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE
 
 from openpilot.system.loggerd.tests.loggerd_tests_common import UploaderTestCase
 
@@ -148,6 +149,20 @@ class TestUploader(UploaderTestCase):
 
     assert log_handler.upload_order == exp_order, "Files uploaded in wrong order"
 
+  def test_upload_files_created_after_start(self):
+    self.start_thread()
+    time.sleep(0.25)
+
+    # written with locks like loggerd does, uploaded once unlocked
+    f_paths = self.gen_files(lock=True)
+    for f_path in f_paths:
+      os.unlink(f_path.with_suffix(f_path.suffix + ".lock"))
+    time.sleep(1)
+    self.join_thread()
+
+    exp_order = self.gen_order([self.seg_num], [])
+    assert log_handler.upload_order == exp_order, "Files uploaded in wrong order"
+
   def test_no_upload_with_lock_file(self):
     self.start_thread()
 
@@ -182,3 +197,37 @@ class TestUploader(UploaderTestCase):
     for f_path in f_paths:
       lock_path = f_path.with_suffix(f_path.suffix + ".lock")
       assert not lock_path.is_file(), "File lock not cleared on startup"
+
+  def test_periodic_rescan(self, mocker):
+    self.gen_files(lock=False, boot=False)
+    queue = UploadQueue(Paths.log_root(), [], {"qlog": 0, "qcamera.ts": 1})
+
+    # finished segments aren't watched, a file appearing in one is only found by a rescan
+    self.make_file_with_data(self.seg_dir, "qcamera.ts", 1)
+    queue.update()
+    assert "qcamera.ts" not in queue.files[self.seg_dir]
+
+    mocker.patch("openpilot.system.loggerd.file_index.RESCAN_INTERVAL", 0.)
+    queue.update()
+    assert "qcamera.ts" in queue.files[self.seg_dir]
+
+  def test_close_releases_inotify(self):
+    queue = UploadQueue(Paths.log_root(), [], {})
+    fd = queue.inotify.fd
+    queue.close()
+    assert queue.inotify is None
+    with pytest.raises(OSError):
+      os.fstat(fd)
+
+  def test_metered_holds_qcamera(self):
+    self.make_file_with_data(self.seg_dir, "qcamera.ts", 1)
+    queue = UploadQueue(Paths.log_root(), [], {"qlog": 0, "qcamera.ts": 1})
+
+    # qcamera.ts is only uploaded on metered connections for requested routes
+    assert queue.next_file(True, []) is None
+    assert len(queue.held) == 1 and len(queue.heap) == 0
+    assert queue.next_file(True, []) is None
+
+    route = f"0000000000000000|{self.seg_dir.rsplit('--', 1)[0]}"
+    assert queue.next_file(True, [route]) == ("qcamera.ts", f"{self.seg_dir}/qcamera.ts", f"{Paths.log_root()}/{self.seg_dir}/qcamera.ts")
+    assert queue.next_file(False, []) is not None
@@ -0,0 +1,55 @@
+import os
+
+import xattr
+
+from openpilot.system.loggerd.xattr_cache import XattrCache
+
+ATTR_NAME = 'user.upload'
+
+
+class TestXattrCache:
+  def test_invalidation(self, tmp_path):
+    fn = str(tmp_path / "qlog")
+    open(fn, "w").close()
+
+    cache = XattrCache()
+    assert cache.get(fn, ATTR_NAME) is None
+    assert cache.get(fn, ATTR_NAME) is None
+    assert cache.info()[:2] == (1, 1)
+
+    # set through the cache, or by another process
+    cache.set(fn, ATTR_NAME, b'1')
+    assert cache.get(fn, ATTR_NAME) == b'1'
+    assert cache.info()[:2] == (2, 1)
+    xattr.setxattr(fn, ATTR_NAME, b'0')
+    assert cache.get(fn, ATTR_NAME) == b'0'
+
+    # deleted and created again
+    os.unlink(fn)
+    open(fn, "w").close()
+    assert cache.get(fn, ATTR_NAME) is None
+
+  def test_bounded(self, tmp_path):
+    cache = XattrCache(max_size=10)
+    fns = [str(tmp_path / f"{i}") for i in range(25)]
+    for fn in fns:
+      open(fn, "w").close()
+      cache.get(fn, ATTR_NAME)
+    assert cache.info() == (0, 25, 10, 10)
+
+    # least recently used entries are evicted first
+    cache.get(fns[-1], ATTR_NAME)
+    cache.get(fns[0], ATTR_NAME)
+    assert cache.info()[:2] == (1, 26)
+
+  def test_prefetch(self, tmp_path):
+    fns = [str(tmp_path / f"{i}") for i in range(25)]
+    for i, fn in enumerate(fns):
+      open(fn, "w").close()
+      if i % 2:
+        xattr.setxattr(fn, ATTR_NAME, b'1')
+
+    cache = XattrCache()
+    cache.prefetch(str(tmp_path), ATTR_NAME)
+    assert [cache.get(fn, ATTR_NAME) for fn in fns] == [b'1' if i % 2 else None for i in range(25)]
+    assert cache.info() == (25, 0, 25, cache.max_size)
@@ -7,7 +7,8 @@ import threading
 import time
 import traceback
 import datetime
-from collections.abc import Iterator
+import heapq
+from collections import defaultdict
 
 from cereal import log
 import cereal.messaging as messaging
@@ -16,7 +17,8 @@ from openpilot.common.file_helpers import get_upload_stream
 from openpilot.common.params import Params
 from openpilot.common.realtime import set_core_affinity
 from openpilot.system.hardware.hw import Paths
-from openpilot.system.loggerd.xattr_cache import getxattr, setxattr
+from openpilot.system.loggerd.file_index import FileIndex
+from openpilot.system.loggerd.xattr_cache import setxattr
 from openpilot.common.swaglog import cloudlog
 
 NetworkType = log.DeviceState.NetworkType
@@ -73,6 +75,108 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+class UploadQueue(FileIndex):
+  """
+    Files to upload in upload order: files of the immediate folders first, then the immediate_priority files.
+    Directories with .lock files are skipped until they're unlocked. Once they are, only this process changes their
+    files' upload xattr, so only new and locked directories and the immediate folders are watched.
+  """
+
+  def __init__(self, root: str, immediate_folders: list[str], immediate_priority: dict[str, int]):
+    self.immediate_folders = immediate_folders
+    self.immediate_priority = immediate_priority
+    super().__init__(root, UPLOAD_ATTR_NAME, subdirs=True)
+
+  def _reset(self) -> None:
+    self.heap: list[tuple[tuple, str, str]] = []
+    self.queued: set[tuple[str, str]] = set()
+    # queued files that can't be uploaded on a metered connection right now
+    self.held: list[tuple[tuple, str, str]] = []
+    self.held_routes: list[str] = []
+    self.locks: dict[str, set[str]] = defaultdict(set)
+
+  def _is_immediate(self, d: str, name: str = "") -> bool:
+    fn = os.path.join(self.root, d, name)
+    return any(f in fn for f in self.immediate_folders)
+
+  def _pending(self, d: str, name: str) -> bool:
+    files = self.files.get(d)
+    return files is not None and name in files and files[name] != UPLOAD_ATTR_VALUE and not self.locks.get(d)
+
+  def _push(self, d: str, name: str) -> None:
+    if (d, name) in self.queued or not self._pending(d, name):
+      return
+
+    if self._is_immediate(d, name):
+      key = (0, get_directory_sort(d), self.immediate_priority.get(name, 1000), name)
+    elif name in self.immediate_priority:
+      key = (1, get_directory_sort(d), self.immediate_priority[name], name)
+    else:
+      return
+    heapq.heappush(self.heap, (key, d, name))
+    self.queued.add((d, name))
+
+  def _file_updated(self, d: str, name: str, value: bytes | None) -> None:
+    if name.endswith(".lock"):
+      self.locks[d].add(name)
+    else:
+      self._push(d, name)
+
+  def _file_removed(self, d: str, name: str) -> None:
+    if name in self.locks.get(d, ()):
+      self.locks[d].discard(name)
+      if not self.locks[d]:
+        for n in self.files[d]:
+          self._push(d, n)
+        if not self._is_immediate(d):
+          self.unwatch(d)
+
+  def _dir_scanned(self, d: str, created: bool) -> None:
+    if not created and not self.locks.get(d) and not self._is_immediate(d):
+      self.unwatch(d)
+
+  def _dir_removed(self, d: str) -> None:
+    self.locks.pop(d, None)
+
+  def _allowed_metered(self, d: str, name: str, requested_routes: list[str]) -> bool:
+    if name == "qcamera.ts" and not any(d.startswith(r.split('|')[-1]) for r in requested_routes):
+      return False
+
+    if d in self.immediate_folders:
+      try:
+        ctime = os.path.getctime(os.path.join(self.root, d, name))
+      except OSError:
+        # deleter could have deleted, so skip
+        return False
+      if (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < datetime.timedelta(hours=12):
+        return False
+    return True
+
+  def next_file(self, metered: bool, requested_routes: list[str]) -> tuple[str, str, str] | None:
+    self.update()
+
+    # files held back on a metered connection are checked again once unmetered, when the requested routes change
+    # or after the next rescan
+    if self.held and (not metered or requested_routes != self.held_routes):
+      for entry in self.held:
+        heapq.heappush(self.heap, entry)
+      self.held.clear()
+    self.held_routes = requested_routes
+
+    while self.heap:
+      _, d, name = self.heap[0]
+      if not self._pending(d, name):
+        # drop uploaded, deleted and locked files, locked files are queued again once unlocked
+        heapq.heappop(self.heap)
+        self.queued.discard((d, name))
+      elif metered and not self._allowed_metered(d, name, requested_routes):
+        # limit uploading on metered connections
+        self.held.append(heapq.heappop(self.heap))
+      else:
+        return name, os.path.join(d, name), os.path.join(self.root, d, name)
+    return None
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -86,58 +190,12 @@ class Uploader:
 
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.zst": 0, "qcamera.ts": 1}
+    self.queue = UploadQueue(root, self.immediate_folders, self.immediate_priority)
 
-  def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
+  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
     r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
     requested_routes = [] if r is None else [route for route in r.split(",") if route]
-
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
-          continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
-            continue
-
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
-            continue
-
-        yield name, key, fn
-
-  def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
-
-    for name, key, fn in upload_files:
-      if any(f in fn for f in self.immediate_folders):
-        return name, key, fn
-
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
-
-    return None
+    return self.queue.next_file(metered, requested_routes)
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -167,6 +225,7 @@ class Uploader:
       sz = os.path.getsize(fn)
     except OSError:
       cloudlog.exception("upload: getsize failed")
+      self.queue.refresh(fn)
       return False
 
     cloudlog.event("upload_start", key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
@@ -208,6 +267,7 @@ class Uploader:
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
       except OSError:
         cloudlog.event("uploader_setxattr_failed", exc=last_exc, key=key, fn=fn, sz=sz)
+      self.queue.refresh(fn)
 
     return success
 
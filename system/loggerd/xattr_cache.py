@@ -1,23 +1,110 @@
 import errno
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
 
 import xattr
 
-_cached_attributes: dict[tuple, bytes | None] = {}
+# entries kept, least recently used ones are evicted first
+MAX_CACHE_SIZE = 16384
 
-def getxattr(path: str, attr_name: str) -> bytes | None:
-  key = (path, attr_name)
-  if key not in _cached_attributes:
+
+class CacheInfo(NamedTuple):
+  hits: int
+  misses: int
+  size: int
+  max_size: int
+
+
+class XattrCache:
+  """
+    LRU cache of xattr values, validated against the inode and ctime of the file on every lookup.
+    Setting an xattr updates the file's ctime, so entries of deleted, replaced or re-tagged files, also by other
+    processes, are read again. A lookup costs a stat instead of a getxattr.
+  """
+
+  def __init__(self, max_size: int = MAX_CACHE_SIZE):
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._entries: OrderedDict[tuple[str, str], tuple[int, int, bytes | None]] = OrderedDict()
+    self._lock = threading.Lock()
+
+  def _put(self, key: tuple[str, str], st: os.stat_result, value: bytes | None) -> None:
+    with self._lock:
+      self._entries[key] = (st.st_ino, st.st_ctime_ns, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def get(self, path: str, attr_name: str) -> bytes | None:
+    key = (path, attr_name)
+    # stat before reading, so a change in between invalidates the entry
+    st = os.stat(path)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[:2] == (st.st_ino, st.st_ctime_ns):
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[2]
+      self.misses += 1
+
+    value = read_xattr(path, attr_name)
+    self._put(key, st, value)
+    return value
+
+  def set(self, path: str, attr_name: str, attr_value: bytes) -> None:
+    xattr.setxattr(path, attr_name, attr_value)
     try:
-      response = xattr.getxattr(path, attr_name)
-    except OSError as e:
-      # ENODATA (Linux) or ENOATTR (macOS) means attribute hasn't been set
-      if e.errno == errno.ENODATA or (hasattr(errno, 'ENOATTR') and e.errno == errno.ENOATTR):
-        response = None
+      self._put((path, attr_name), os.stat(path), attr_value)
+    except OSError:
+      self.invalidate(path)
+
+  def prefetch(self, directory: str, attr_name: str) -> None:
+    """Read attr_name of every entry of directory into the cache"""
+    with os.scandir(directory) as it:
+      for entry in it:
+        path = os.path.join(directory, entry.name)
+        try:
+          st = entry.stat(follow_symlinks=True)
+          self._put((path, attr_name), st, read_xattr(path, attr_name))
+        except OSError:
+          pass  # removed while listing
+
+  def invalidate(self, path: str | None = None) -> None:
+    with self._lock:
+      if path is None:
+        self._entries.clear()
       else:
-        raise
-    _cached_attributes[key] = response
-  return _cached_attributes[key]
+        for key in [k for k in self._entries if k[0] == path]:
+          del self._entries[key]
+
+  def info(self) -> CacheInfo:
+    with self._lock:
+      return CacheInfo(self.hits, self.misses, len(self._entries), self.max_size)
+
+
+def read_xattr(path: str, attr_name: str) -> bytes | None:
+  """Uncached read, None if the attribute isn't set"""
+  try:
+    return xattr.getxattr(path, attr_name)
+  except OSError as e:
+    # ENODATA (Linux) or ENOATTR (macOS) means attribute hasn't been set
+    if e.errno == errno.ENODATA or (hasattr(errno, 'ENOATTR') and e.errno == errno.ENOATTR):
+      return None
+    raise
+
+_cache = XattrCache()
+
+def getxattr(path: str, attr_name: str) -> bytes | None:
+  return _cache.get(path, attr_name)
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
-  _cached_attributes.pop((path, attr_name), None)
-  xattr.setxattr(path, attr_name, attr_value)
+  _cache.set(path, attr_name, attr_value)
+
+def prefetch_xattrs(directory: str, attr_name: str) -> None:
+  _cache.prefetch(directory, attr_name)
+
+def cache_info() -> CacheInfo:
+  return _cache.info()
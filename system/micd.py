@@ -19,14 +19,20 @@ SAMPLE_BUFFER = 4096  # approx 100ms
 def get_a_weighting_filter():
   # Calculate the A-weighting filter
   # https://en.wikipedia.org/wiki/A-weighting
-  freqs = np.fft.fftfreq(FFT_SAMPLES, d=1 / SAMPLE_RATE)
+  # the filter is even in frequency, so only the non-negative half is needed for the real FFT
+  freqs = np.fft.rfftfreq(FFT_SAMPLES, d=1 / SAMPLE_RATE)
   A = 12194 ** 2 * freqs ** 4 / ((freqs ** 2 + 20.6 ** 2) * (freqs ** 2 + 12194 ** 2) * np.sqrt((freqs ** 2 + 107.7 ** 2) * (freqs ** 2 + 737.9 ** 2)))
   return A / np.max(A)
 
 
+@cache
+def get_window(n: int) -> np.ndarray:
+  return np.hanning(n)
+
+
 def calculate_spl(measurements):
   # https://www.engineeringtoolbox.com/sound-pressure-d_711.html
-  sound_pressure = np.sqrt(np.mean(measurements ** 2))  # RMS of amplitudes
+  sound_pressure = np.sqrt(np.dot(measurements, measurements) / measurements.size)  # RMS of amplitudes
   if sound_pressure > 0:
     sound_pressure_level = 20 * np.log10(sound_pressure / REFERENCE_SPL)  # dB
   else:
@@ -35,19 +41,56 @@ def calculate_spl(measurements):
 
 
 def apply_a_weighting(measurements: np.ndarray) -> np.ndarray:
-  # Generate a Hanning window of the same length as the audio measurements
-  measurements_windowed = measurements * np.hanning(len(measurements))
+  # Hanning window of the same length as the audio measurements
+  measurements_windowed = measurements * get_window(len(measurements))
+
+  # Apply the A-weighting filter to the signal, the input is real so the real FFT gives the same result
+  return np.abs(np.fft.irfft(np.fft.rfft(measurements_windowed) * get_a_weighting_filter(), n=len(measurements)))
+
+
+class AudioRingBuffer:
+  """
+    Last size samples, stored twice back to back so the newest window is always a contiguous view without copying.
+  """
 
-  # Apply the A-weighting filter to the signal
-  return np.abs(np.fft.ifft(np.fft.fft(measurements_windowed) * get_a_weighting_filter()))
+  def __init__(self, size: int):
+    self.size = size
+    self.buf = np.zeros(2 * size)
+    self.idx = 0  # position of the oldest sample
+    self.count = 0  # samples written, up to size
+
+  def write(self, samples: np.ndarray) -> None:
+    if len(samples) > self.size:
+      samples = samples[-self.size:]
+    n = len(samples)
+    first = min(n, self.size - self.idx)
+    for offset in (0, self.size):
+      self.buf[offset + self.idx:offset + self.idx + first] = samples[:first]
+      self.buf[offset:offset + n - first] = samples[first:]
+    self.idx = (self.idx + n) % self.size
+    self.count = min(self.count + n, self.size)
+
+  def window(self) -> np.ndarray:
+    """The last size samples, oldest first"""
+    return self.buf[self.idx:self.idx + self.size]
 
 
 class Mic:
-  def __init__(self):
+  """
+    Sound pressure of the last FFT_SAMPLES samples, updated every hop samples. hop < FFT_SAMPLES overlaps the windows,
+    with decimation > 1 only every decimation-th window is processed.
+  """
+
+  def __init__(self, hop: int = FFT_SAMPLES, decimation: int = 1):
+    assert 0 < hop <= FFT_SAMPLES and decimation >= 1
     self.rk = Ratekeeper(RATE)
     self.pm = messaging.PubMaster(['microphone'])
 
-    self.measurements = np.empty(0)
+    self.hop = hop
+    self.decimation = decimation
+    self.measurements = AudioRingBuffer(FFT_SAMPLES)
+    self.hop_samples = 0  # samples since the last window
+    self.windows = 0
 
     self.sound_pressure = 0
     self.sound_pressure_weighted = 0
@@ -77,17 +120,28 @@ class Mic:
     Logged A-weighted equivalents are rough approximations of the human-perceived loudness.
     """
     with self.lock:
-      self.measurements = np.concatenate((self.measurements, indata[:, 0]))
-
-      while self.measurements.size >= FFT_SAMPLES:
-        measurements = self.measurements[:FFT_SAMPLES]
-
+      samples = indata[:, 0]
+      while len(samples):
+        # write up to the next hop, so every window is processed
+        n = min(len(samples), self.hop - self.hop_samples)
+        self.measurements.write(samples[:n])
+        samples = samples[n:]
+        self.hop_samples += n
+        if self.hop_samples < self.hop:
+          continue
+
+        self.hop_samples = 0
+        if self.measurements.count < FFT_SAMPLES:
+          continue
+        self.windows += 1
+        if self.windows % self.decimation != 0:
+          continue
+
+        measurements = self.measurements.window()
         self.sound_pressure, _ = calculate_spl(measurements)
         measurements_weighted = apply_a_weighting(measurements)
         self.sound_pressure_weighted, self.sound_pressure_level_weighted = calculate_spl(measurements_weighted)
 
-        self.measurements = self.measurements[FFT_SAMPLES:]
-
   @retry(attempts=7, delay=3)
   def get_stream(self, sd):
     # reload sounddevice to reinitialize portaudio
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
+import math
 import os
+import struct
 import zmq
 import time
 import uuid
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime, UTC
-from typing import NoReturn
+from typing import NoReturn, TextIO
 
 from openpilot.common.params import Params
 from cereal.messaging import SubMaster
@@ -22,11 +24,59 @@ class METRIC_TYPE:
   GAUGE = 'g'
   SAMPLE = 'sa'
 
+# batched binary messages start with a byte that can't start a text metric,
+# followed by records of type, value, name length and the utf-8 name
+BINARY_BATCH_MAGIC = b"\x00"
+BINARY_RECORD = struct.Struct("<BdH")
+BINARY_METRIC_TYPES = (METRIC_TYPE.GAUGE, METRIC_TYPE.SAMPLE)
+
+
+def encode_metrics(metrics: list[tuple[str, float, str]]) -> bytes:
+  dat = bytearray(BINARY_BATCH_MAGIC)
+  for name, value, metric_type in metrics:
+    name_dat = name.encode()
+    dat += BINARY_RECORD.pack(BINARY_METRIC_TYPES.index(metric_type), value, len(name_dat))
+    dat += name_dat
+  return bytes(dat)
+
+
+def decode_metrics(dat: bytes) -> list[tuple[str, float, str]]:
+  """Metrics of a text or batched binary message as (name, value, type), raises ValueError if it's malformed"""
+  if not dat.startswith(BINARY_BATCH_MAGIC):
+    name_value, metric_type = dat.decode().split('|')[:2]
+    name, value = name_value.split(':')[:2]
+    return [(name, float(value), metric_type)]
+
+  metrics = []
+  pos = len(BINARY_BATCH_MAGIC)
+  try:
+    while pos < len(dat):
+      type_idx, value, name_len = BINARY_RECORD.unpack_from(dat, pos)
+      pos += BINARY_RECORD.size
+      if pos + name_len > len(dat) or type_idx >= len(BINARY_METRIC_TYPES):
+        raise ValueError("truncated or unknown metric")
+      metrics.append((dat[pos:pos + name_len].decode(), value, BINARY_METRIC_TYPES[type_idx]))
+      pos += name_len
+  except struct.error as e:
+    raise ValueError(str(e)) from e
+  return metrics
+
+
 class StatLog:
-  def __init__(self):
+  """
+    Sends metrics to statsd. With max_batch > 1, metrics are buffered and sent in the batched binary format
+    once max_batch of them are buffered, or when a metric is added after the oldest one is max_delay seconds old.
+    There's no timer, callers that go quiet should flush() or their batch is only sent when the StatLog is deleted.
+  """
+
+  def __init__(self, max_batch: int = 1, max_delay: float = 1.0):
     self.pid = None
     self.zctx = None
     self.sock = None
+    self.max_batch = max_batch
+    self.max_delay = max_delay
+    self.batch: list[tuple[str, float, str]] = []
+    self.batch_start = 0.
 
   def connect(self) -> None:
     self.zctx = zmq.Context()
@@ -37,45 +87,143 @@ class StatLog:
 
   def __del__(self):
     if self.sock is not None:
+      if self.pid == os.getpid():
+        self.flush()
       self.sock.close()
     if self.zctx is not None:
       self.zctx.term()
 
-  def _send(self, metric: str) -> None:
+  def _send(self, dat: str | bytes) -> None:
     if os.getpid() != self.pid:
+      self.batch.clear()  # buffered by the parent process
       self.connect()
 
     try:
-      self.sock.send_string(metric, zmq.NOBLOCK)
+      if isinstance(dat, str):
+        self.sock.send_string(dat, zmq.NOBLOCK)
+      else:
+        self.sock.send(dat, zmq.NOBLOCK)
     except zmq.error.Again:
       # drop :/
       pass
 
+  def _add(self, name: str, value: float, metric_type: str) -> None:
+    if self.max_batch <= 1:
+      self._send(f"{name}:{value}|{metric_type}")
+      return
+
+    if not self.batch:
+      self.batch_start = time.monotonic()
+    self.batch.append((name, value, metric_type))
+    if len(self.batch) >= self.max_batch or time.monotonic() - self.batch_start > self.max_delay:
+      self.flush()
+
+  def flush(self) -> None:
+    """Send the buffered metrics"""
+    if self.batch:
+      batch, self.batch = self.batch, []
+      self._send(encode_metrics(batch))
+
   def gauge(self, name: str, value: float) -> None:
-    self._send(f"{name}:{value}|{METRIC_TYPE.GAUGE}")
+    self._add(name, value, METRIC_TYPE.GAUGE)
 
-  # Samples will be recorded in a buffer and at aggregation time,
+  # Samples are aggregated into a quantile sketch and at aggregation time,
   # statistical properties will be logged (mean, count, percentiles, ...)
   def sample(self, name: str, value: float):
-    self._send(f"{name}:{value}|{METRIC_TYPE.SAMPLE}")
+    self._add(name, value, METRIC_TYPE.SAMPLE)
+
+
+class QuantileSketch:
+  """
+    Fixed-memory quantile sketch with relative accuracy, like DDSketch. Values are counted in logarithmic bins, so
+    quantiles are within relative_accuracy of the exact ones. Once there are more than max_bins bins of one sign,
+    the bins closest to zero are merged, which only affects the quantiles of the smallest magnitudes.
+    count, sum, min and max are exact.
+  """
+
+  def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 1024, min_value: float = 1e-9):
+    self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    self.log_gamma = math.log(self.gamma)
+    self.max_bins = max_bins
+    self.min_value = min_value  # magnitudes below this count as zero
+    self.positive: dict[int, int] = defaultdict(int)
+    self.negative: dict[int, int] = defaultdict(int)
+    self.zeros = 0
+    self.count = 0
+    self.sum = 0.
+    self.min = math.inf
+    self.max = -math.inf
+
+  def __len__(self) -> int:
+    return self.count
+
+  def _key(self, value: float) -> int:
+    return math.ceil(math.log(value) / self.log_gamma)
+
+  def _value(self, key: int) -> float:
+    return 2 * self.gamma ** key / (self.gamma + 1)
+
+  def add(self, value: float) -> None:
+    if not math.isfinite(value):
+      raise ValueError(f"sample isn't finite: {value}")
+    self.count += 1
+    self.sum += value
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+
+    if value > self.min_value:
+      bins = self.positive
+      bins[self._key(value)] += 1
+    elif value < -self.min_value:
+      bins = self.negative
+      bins[self._key(-value)] += 1
+    else:
+      self.zeros += 1
+      return
+
+    if len(bins) > self.max_bins:
+      lowest = sorted(bins)[:len(bins) - self.max_bins + 1]
+      bins[lowest[-1]] += sum(bins.pop(k) for k in lowest[:-1])
+
+  def quantile(self, q: float) -> float:
+    """Value of rank round(q * (count - 1)) in the sorted samples"""
+    if self.count == 0:
+      raise ValueError("empty sketch")
+    rank = int(round(q * (self.count - 1)))
+    if rank == 0:
+      return self.min
+    elif rank == self.count - 1:
+      return self.max
+
+    seen = 0
+    for key in sorted(self.negative, reverse=True):
+      seen += self.negative[key]
+      if seen > rank:
+        return max(-self._value(key), self.min)
+    seen += self.zeros
+    if seen > rank:
+      return 0.
+    for key in sorted(self.positive):
+      seen += self.positive[key]
+      if seen > rank:
+        return min(self._value(key), self.max)
+    return self.max
+
+
+def write_influxdb_line(f: TextIO, measurement: str, value: float | dict[str, float], tags: str, fields: str) -> None:
+  # tags and the trailing fields are formatted once per flush
+  f.write(measurement)
+  f.write(tags)
+  f.write(" ")
+  if isinstance(value, float):
+    value = {'value': value}
+  for k, v in value.items():
+    f.write(f"{k}={v},")
+  f.write(fields)
 
 
 def main() -> NoReturn:
   dongle_id = Params().get("DongleId", encoding='utf-8')
-  def get_influxdb_line(measurement: str, value: float | dict[str, float],  timestamp: datetime, tags: dict) -> str:
-    res = f"{measurement}"
-    for k, v in tags.items():
-      res += f",{k}={str(v)}"
-    res += " "
-
-    if isinstance(value, float):
-      value = {'value': value}
-
-    for k, v in value.items():
-      res += f"{k}={v},"
-
-    res += f"dongle_id=\"{dongle_id}\" {int(timestamp.timestamp() * 1e9)}\n"
-    return res
 
   # open statistics socket
   ctx = zmq.Context.instance()
@@ -106,7 +254,7 @@ def main() -> NoReturn:
   boot_uid = str(uuid.uuid4())[:8]
   last_flush_time = time.monotonic()
   gauges = {}
-  samples: dict[str, list[float]] = defaultdict(list)
+  samples: dict[str, QuantileSketch] = defaultdict(QuantileSketch)
   try:
     while True:
       started_prev = sm['deviceState'].started
@@ -115,63 +263,54 @@ def main() -> NoReturn:
       # Update metrics
       while True:
         try:
-          metric = sock.recv_string(zmq.NOBLOCK)
+          dat = sock.recv(zmq.NOBLOCK)
           try:
-            metric_type = metric.split('|')[1]
-            metric_name = metric.split(':')[0]
-            metric_value = float(metric.split('|')[0].split(':')[1])
-
-            if metric_type == METRIC_TYPE.GAUGE:
-              gauges[metric_name] = metric_value
-            elif metric_type == METRIC_TYPE.SAMPLE:
-              samples[metric_name].append(metric_value)
-            else:
-              cloudlog.event("unknown metric type", metric_type=metric_type)
+            for metric_name, metric_value, metric_type in decode_metrics(dat):
+              if metric_type == METRIC_TYPE.GAUGE:
+                gauges[metric_name] = metric_value
+              elif metric_type == METRIC_TYPE.SAMPLE:
+                samples[metric_name].add(metric_value)
+              else:
+                cloudlog.event("unknown metric type", metric_type=metric_type)
           except Exception:
-            cloudlog.event("malformed metric", metric=metric)
+            cloudlog.event("malformed metric", metric=dat.decode(errors='backslashreplace'))
         except zmq.error.Again:
           break
 
       # flush when started state changes or after FLUSH_TIME_S
       if (time.monotonic() > last_flush_time + STATS_FLUSH_TIME_S) or (sm['deviceState'].started != started_prev):
-        result = ""
         current_time = datetime.now(UTC)
         tags['started'] = sm['deviceState'].started
-
-        for key, value in gauges.items():
-          result += get_influxdb_line(f"gauge.{key}", value, current_time, tags)
-
-        for key, values in samples.items():
-          values.sort()
-          sample_count = len(values)
-          sample_sum = sum(values)
-
-          stats = {
-            'count': sample_count,
-            'min': values[0],
-            'max': values[-1],
-            'mean': sample_sum / sample_count,
-          }
-          for percentile in [0.05, 0.5, 0.95]:
-            value = values[int(round(percentile * (sample_count - 1)))]
-            stats[f"p{int(percentile * 100)}"] = value
-
-          result += get_influxdb_line(f"sample.{key}", stats, current_time, tags)
-
-        # clear intermediate data
-        gauges.clear()
-        samples.clear()
-        last_flush_time = time.monotonic()
+        tags_str = "".join(f",{k}={str(v)}" for k, v in tags.items())
+        fields_str = f"dongle_id=\"{dongle_id}\" {int(current_time.timestamp() * 1e9)}\n"
 
         # check that we aren't filling up the drive
         if len(os.listdir(STATS_DIR)) < STATS_DIR_FILE_LIMIT:
-          if len(result) > 0:
+          if len(gauges) > 0 or len(samples) > 0:
             stats_path = os.path.join(STATS_DIR, f"{boot_uid}_{idx}")
             with atomic_write_in_dir(stats_path) as f:
-              f.write(result)
+              for key, value in gauges.items():
+                write_influxdb_line(f, f"gauge.{key}", value, tags_str, fields_str)
+
+              for key, sketch in samples.items():
+                stats = {
+                  'count': sketch.count,
+                  'min': sketch.min,
+                  'max': sketch.max,
+                  'mean': sketch.sum / sketch.count,
+                }
+                for percentile in [0.05, 0.5, 0.95]:
+                  stats[f"p{int(percentile * 100)}"] = sketch.quantile(percentile)
+
+                write_influxdb_line(f, f"sample.{key}", stats, tags_str, fields_str)
             idx += 1
         else:
           cloudlog.error("stats dir full")
+
+        # clear intermediate data
+        gauges.clear()
+        samples.clear()
+        last_flush_time = time.monotonic()
   finally:
     sock.close()
     ctx.term()
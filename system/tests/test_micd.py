@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from openpilot.system.micd import FFT_SAMPLES, SAMPLE_BUFFER, AudioRingBuffer, Mic, apply_a_weighting, calculate_spl
+
+
+def reference_a_weighting(measurements):
+  freqs = np.fft.fftfreq(FFT_SAMPLES, d=1 / 44100)
+  A = 12194 ** 2 * freqs ** 4 / ((freqs ** 2 + 20.6 ** 2) * (freqs ** 2 + 12194 ** 2) * np.sqrt((freqs ** 2 + 107.7 ** 2) * (freqs ** 2 + 737.9 ** 2)))
+  return np.abs(np.fft.ifft(np.fft.fft(measurements * np.hanning(len(measurements))) * A / np.max(A)))
+
+
+class TestMicd:
+  def test_a_weighting_matches_complex_fft(self):
+    x = np.random.default_rng(0).normal(0, 0.1, FFT_SAMPLES)
+    np.testing.assert_allclose(apply_a_weighting(x), reference_a_weighting(x), atol=1e-12)
+
+  def test_ring_buffer(self):
+    rb = AudioRingBuffer(10)
+    data = np.arange(37, dtype=float)
+    written = 0
+    for n in (3, 7, 10, 1, 9, 2, 5):
+      rb.write(data[written:written + n])
+      written += n
+      window = rb.window()
+      assert rb.count == min(written, 10)
+      np.testing.assert_array_equal(window[10 - rb.count:], data[max(0, written - 10):written])
+
+  @pytest.mark.parametrize("hop,decimation", [(FFT_SAMPLES, 1), (FFT_SAMPLES // 4, 1), (FFT_SAMPLES // 2, 3)])
+  def test_windows(self, mocker, hop, decimation):
+    mocker.patch("openpilot.system.micd.messaging.PubMaster")
+    calculate = mocker.patch("openpilot.system.micd.calculate_spl", return_value=(0., 0.))
+    mic = Mic(hop, decimation)
+
+    x = np.random.default_rng(0).normal(0, 0.1, 10 * FFT_SAMPLES + 123)
+    windows = []
+    calculate.side_effect = lambda m: windows.append(m.copy()) or (0., 0.)
+    # uneven blocks, as the audio callback doesn't always get SAMPLE_BUFFER frames
+    pos = 0
+    for n in [SAMPLE_BUFFER, 1000, 5000, 1, SAMPLE_BUFFER] * 10:
+      mic.callback(x[pos:pos + n, None], n, None, None)
+      pos += n
+
+    starts = list(range(0, len(x) - FFT_SAMPLES + 1, hop))[decimation - 1::decimation]
+    raw_windows = windows[::2]  # every window is followed by its weighted version
+    assert len(raw_windows) == len(starts)
+    for start, window in zip(starts, raw_windows, strict=True):
+      np.testing.assert_array_equal(window, x[start:start + FFT_SAMPLES])
+
+  def test_spl(self):
+    x = np.full(FFT_SAMPLES, 0.02)
+    assert calculate_spl(x) == pytest.approx((0.02, 60.))
+    assert calculate_spl(np.zeros(FFT_SAMPLES)) == (0., 0)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from openpilot.system.statsd import METRIC_TYPE, QuantileSketch, StatLog, decode_metrics, encode_metrics
+
+
+class TestStatsd:
+  @pytest.mark.parametrize("dist", ["lognormal", "normal", "zeros"])
+  def test_sketch_quantiles(self, dist):
+    rng = np.random.default_rng(0)
+    values = {
+      "lognormal": rng.lognormal(0, 3, 50000),
+      "normal": rng.normal(1, 10, 50000),
+      "zeros": np.concatenate([np.zeros(1000), rng.uniform(-5, 5, 1000)]),
+    }[dist]
+
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for v in values:
+      sketch.add(float(v))
+
+    values = np.sort(values)
+    assert sketch.count == len(values)
+    assert sketch.sum == pytest.approx(values.sum())
+    assert (sketch.min, sketch.max) == (values[0], values[-1])
+    for q in (0., 0.05, 0.5, 0.95, 1.):
+      exact = values[int(round(q * (len(values) - 1)))]
+      assert sketch.quantile(q) == pytest.approx(exact, rel=0.01, abs=1e-9)
+
+  def test_sketch_bounded_memory(self):
+    sketch = QuantileSketch(relative_accuracy=0.01, max_bins=64)
+    values = np.geomspace(1e-6, 1e6, 10000)
+    for v in values:
+      sketch.add(float(v))
+
+    # bins closest to zero are merged, the high quantiles stay accurate
+    assert len(sketch.positive) == 64
+    assert sketch.quantile(0.99) == pytest.approx(values[int(round(0.99 * 9999))], rel=0.01)
+    assert sketch.quantile(0.) == values[0]
+
+  def test_wire_formats(self):
+    metrics = [("power_draw", 1.5, METRIC_TYPE.SAMPLE), ("cpu0_temperature", 45., METRIC_TYPE.GAUGE), ("ünïcode", -2., METRIC_TYPE.SAMPLE)]
+    assert decode_metrics(encode_metrics(metrics)) == metrics
+    assert decode_metrics(b"power_draw:1.5|sa") == [("power_draw", 1.5, METRIC_TYPE.SAMPLE)]
+
+    for malformed in (encode_metrics(metrics)[:-1], encode_metrics(metrics)[:5], b"power_draw:1.5", b"power_draw|g"):
+      with pytest.raises(ValueError):
+        decode_metrics(malformed)
+
+  def test_statlog_batching(self, mocker):
+    statlog = StatLog(max_batch=3)
+    send = mocker.patch.object(statlog, "_send")
+    statlog.sample("a", 1.)
+    statlog.gauge("b", 2.)
+    send.assert_not_called()
+    statlog.sample("a", 3.)
+    send.assert_called_once_with(encode_metrics([("a", 1., METRIC_TYPE.SAMPLE), ("b", 2., METRIC_TYPE.GAUGE), ("a", 3., METRIC_TYPE.SAMPLE)]))
+    assert statlog.batch == []
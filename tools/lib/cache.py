@@ -1,6 +1,10 @@
 import os
 import urllib.parse
 
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.filereader import resolve_name
+from openpilot.tools.lib.url_file import hash_256
+
 DEFAULT_CACHE_DIR = os.getenv("CACHE_ROOT", os.path.expanduser("~/.commacache"))
 
 def cache_path_for_file_path(fn, cache_dir=DEFAULT_CACHE_DIR):
@@ -12,3 +16,13 @@ def cache_path_for_file_path(fn, cache_dir=DEFAULT_CACHE_DIR):
   else:
     cache_fn = f'{fn_parsed.hostname}_{fn_parsed.path.replace("/", "_")}'
   return os.path.join(dir_, cache_fn)
+
+def download_cache_path(fn: str, name: str) -> str:
+  """Path of a sidecar file derived from a log or video file, stored in the download cache"""
+  fn = resolve_name(fn)
+  key = fn
+  if not fn.startswith(("http://", "https://")):
+    # local files can change in place
+    st = os.stat(fn)
+    key = f"{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}"
+  return os.path.join(Paths.download_cache_root(), f"{hash_256(key)}_{name}")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Size-bounded LRU management and stats for the URLFile download cache (FILEREADER_CACHE)
+
+Usage::
+
+  ./download_cache.py stats [--top N]   # hit rate, bytes saved and hottest URLs
+  ./download_cache.py evict [--budget-gb GB]  # evict least recently used files down to the budget
+"""
+import argparse
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import Iterator
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.system.hardware.hw import Paths
+
+DEFAULT_BUDGET_GB = 20.
+# evict down to a fraction of the budget, so we don't scan the cache on every download once it's full
+EVICT_TARGET = 0.9
+# access counters are kept in memory and written to the stats files at most this often, and at exit
+STATS_FLUSH_INTERVAL = 10.
+
+STATS_FILE = "cache_stats.json"
+LOCK_FILE = "cache_stats.lock"
+# per-URL lock files, never removed so every process locks the same inode, also across evictions
+LOCK_DIR = "locks"
+CACHE_FILE_RE = re.compile(r"^([0-9a-f]{64})_")
+
+
+def cache_budget() -> int:
+  return int(float(os.environ.get("FILEREADER_CACHE_SIZE_GB", DEFAULT_BUDGET_GB)) * 1e9)
+
+
+@contextlib.contextmanager
+def locked_file(path: str, operation: int = fcntl.LOCK_EX) -> Iterator[int]:
+  fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+  try:
+    fcntl.flock(fd, operation)
+    yield fd
+  finally:
+    os.close(fd)
+
+
+def url_lock(root: str, url_hash: str, operation: int = fcntl.LOCK_EX) -> contextlib.AbstractContextManager[int]:
+  """Lock held by readers, writers and the evictor of the cached files of a URL"""
+  return locked_file(os.path.join(root, LOCK_DIR, url_hash), operation)
+
+
+def _read_json(fd: int) -> dict:
+  try:
+    return json.loads(os.pread(fd, os.fstat(fd).st_size, 0) or b"{}")
+  except json.JSONDecodeError:
+    return {}
+
+
+def _write_json(fd: int, d: dict) -> None:
+  os.ftruncate(fd, 0)
+  os.pwrite(fd, json.dumps(d).encode(), 0)
+
+
+class DownloadCache:
+  """
+    Access stats and LRU eviction for the download cache, safe to share between processes.
+    Every URL has a stats file next to its cached files. The last access time of a URL is the latest mtime of its other
+    files, reads touch the data file.
+  """
+
+  # counters not yet written to the stats files, by (root, url hash), shared by all instances in a process
+  _pending: dict[tuple[str, str], dict] = {}
+  _pending_lock = threading.Lock()
+  _last_flush = time.monotonic()
+
+  @staticmethod
+  def _reset_pending() -> None:
+    # the parent process writes its own counters
+    DownloadCache._pending = {}
+    DownloadCache._pending_lock = threading.Lock()
+    DownloadCache._last_flush = time.monotonic()
+
+  @staticmethod
+  def flush_all() -> None:
+    for root in {root for root, _ in DownloadCache._pending}:
+      DownloadCache(root).flush()
+
+  def __init__(self, root: str | None = None, budget: int | None = None):
+    self.root = os.path.normpath(root if root is not None else Paths.download_cache_root())
+    self.budget = budget if budget is not None else cache_budget()
+
+  @contextlib.contextmanager
+  def _global_stats(self, write: bool = True) -> Iterator[dict]:
+    os.makedirs(self.root, exist_ok=True)
+    with locked_file(os.path.join(self.root, LOCK_FILE), fcntl.LOCK_EX if write else fcntl.LOCK_SH):
+      stats_path = os.path.join(self.root, STATS_FILE)
+      try:
+        with open(stats_path) as f:
+          stats = json.load(f)
+      except (FileNotFoundError, json.JSONDecodeError):
+        stats = {}
+      stats.setdefault("size_estimate", 0)
+      stats.setdefault("evicted_bytes", 0)
+
+      yield stats
+
+      if write:
+        with atomic_write_in_dir(stats_path, mode="w", overwrite=True) as f:
+          json.dump(stats, f)
+
+  def record_access(self, url_hash: str, url: str, cached_bytes: int, downloaded_bytes: int) -> None:
+    """Record a read of cached_bytes served from the cache and downloaded_bytes added to it"""
+    with DownloadCache._pending_lock:
+      entry = DownloadCache._pending.setdefault((self.root, url_hash), {"url": url, "hits": 0, "misses": 0, "cached_bytes": 0, "downloaded_bytes": 0})
+      entry["hits" if downloaded_bytes == 0 else "misses"] += 1
+      entry["cached_bytes"] += cached_bytes
+      entry["downloaded_bytes"] += downloaded_bytes
+      due = time.monotonic() - DownloadCache._last_flush > STATS_FLUSH_INTERVAL
+
+    if due:
+      self.flush()
+
+  def flush(self) -> None:
+    """Write the counters recorded by this process to the stats files, and evict if the cache outgrew its budget"""
+    with DownloadCache._pending_lock:
+      pending = {url_hash: DownloadCache._pending.pop((root, url_hash)) for root, url_hash in list(DownloadCache._pending) if root == self.root}
+      DownloadCache._last_flush = time.monotonic()
+    # nothing to do if the whole cache was removed
+    if not pending or not os.path.isdir(self.root):
+      return
+
+    os.makedirs(os.path.join(self.root, LOCK_DIR), exist_ok=True)
+    for url_hash, counts in pending.items():
+      # under the URL lock, so the evictor doesn't unlink the stats file while it's updated
+      with url_lock(self.root, url_hash):
+        fd = os.open(os.path.join(self.root, f"{url_hash}_stats"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+          entry = {"url": counts["url"], "hits": 0, "misses": 0, "cached_bytes": 0, "downloaded_bytes": 0, **_read_json(fd)}
+          for k in ("hits", "misses", "cached_bytes", "downloaded_bytes"):
+            entry[k] += counts[k]
+          _write_json(fd, entry)
+        finally:
+          os.close(fd)
+
+    downloaded_bytes = sum(counts["downloaded_bytes"] for counts in pending.values())
+    if downloaded_bytes > 0:
+      with self._global_stats() as stats:
+        stats["size_estimate"] += downloaded_bytes
+        if stats["size_estimate"] > self.budget:
+          self._evict(stats, self.budget * EVICT_TARGET)
+
+  def _scan(self) -> dict[str, tuple[float, int, list[str]]]:
+    # every file of a URL (stats, length, data, chunk bitmap, log sidecars) shares its hash prefix
+    groups: dict[str, tuple[float, int, list[str]]] = {}
+    for fn in os.listdir(self.root):
+      if (m := CACHE_FILE_RE.match(fn)) is None:
+        continue
+      path = os.path.join(self.root, fn)
+      try:
+        st = os.stat(path)
+      except FileNotFoundError:
+        continue
+      last_access, size, files = groups.get(m.group(1), (0., 0, []))
+      # stats files are written on flushes, not on accesses
+      if not fn.endswith("_stats"):
+        last_access = max(last_access, st.st_mtime)
+      # data files are sparse, count the allocated blocks
+      groups[m.group(1)] = (last_access, size + min(st.st_size, st.st_blocks * 512), [*files, path])
+    return groups
+
+  def _evict(self, stats: dict, target: float) -> int:
+    os.makedirs(os.path.join(self.root, LOCK_DIR), exist_ok=True)
+    groups = self._scan()
+    total = sum(size for _, size, _ in groups.values())
+    evicted = 0
+    for url_hash, (_, size, files) in sorted(groups.items(), key=lambda g: g[1][0]):
+      if total - evicted <= target:
+        break
+
+      # the chunk bitmap goes first and always, files created since the scan are then treated as missing
+      bitmap_path = os.path.join(self.root, f"{url_hash}_chunks")
+      with url_lock(self.root, url_hash):
+        for path in [bitmap_path, *files]:
+          with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+      evicted += size
+
+    stats["size_estimate"] = total - evicted
+    stats["evicted_bytes"] += evicted
+    return evicted
+
+  def evict(self, budget: int | None = None) -> int:
+    """Evict the least recently used URLs until the cache fits in the budget, returns the evicted bytes"""
+    with self._global_stats() as stats:
+      return self._evict(stats, self.budget if budget is None else budget)
+
+  def stats(self, top: int = 10) -> dict:
+    self.flush()
+    with self._global_stats(write=False) as stats:
+      groups = self._scan()
+
+    entries = []
+    for url_hash in groups:
+      with contextlib.suppress(FileNotFoundError, json.JSONDecodeError), open(os.path.join(self.root, f"{url_hash}_stats")) as f:
+        entries.append(json.load(f))
+
+    hits = sum(e["hits"] for e in entries)
+    misses = sum(e["misses"] for e in entries)
+    hottest = sorted(entries, key=lambda e: e["hits"] + e["misses"], reverse=True)[:top]
+    return {
+      "size": sum(size for _, size, _ in groups.values()),
+      "budget": self.budget,
+      "urls": len(groups),
+      "hits": hits,
+      "misses": misses,
+      "hit_rate": hits / (hits + misses) if hits + misses else 0.,
+      "bytes_saved": sum(e["cached_bytes"] for e in entries),
+      "bytes_downloaded": sum(e["downloaded_bytes"] for e in entries),
+      "evicted_bytes": stats["evicted_bytes"],
+      "hottest": [(e["url"], e["hits"], e["misses"]) for e in hottest],
+    }
+
+
+atexit.register(DownloadCache.flush_all)
+os.register_at_fork(after_in_child=DownloadCache._reset_pending)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Manage the URLFile download cache")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  stats_parser = subparsers.add_parser("stats", help="show cache stats")
+  stats_parser.add_argument("--top", type=int, default=10, help="number of hottest URLs to show")
+  evict_parser = subparsers.add_parser("evict", help="evict least recently used files")
+  evict_parser.add_argument("--budget-gb", type=float, default=None, help="size to evict down to")
+  args = parser.parse_args()
+
+  cache = DownloadCache()
+  if args.command == "stats":
+    stats = cache.stats(args.top)
+    print(f"cache root:       {cache.root}")
+    print(f"size:             {stats['size'] / 1e9:.2f} / {stats['budget'] / 1e9:.2f} GB ({stats['urls']} URLs)")
+    print(f"hit rate:         {100 * stats['hit_rate']:.1f}% ({stats['hits']} hits, {stats['misses']} misses)")
+    print(f"bytes saved:      {stats['bytes_saved'] / 1e9:.2f} GB")
+    print(f"bytes downloaded: {stats['bytes_downloaded'] / 1e9:.2f} GB")
+    print(f"bytes evicted:    {stats['evicted_bytes'] / 1e9:.2f} GB")
+    print("hottest URLs:")
+    for url, hits, misses in stats["hottest"]:
+      print(f"  {hits:6d} hits {misses:6d} misses  {url}")
+  elif args.command == "evict":
+    budget = None if args.budget_gb is None else int(args.budget_gb * 1e9)
+    print(f"evicted {cache.evict(budget) / 1e9:.2f} GB")
+
+
+if __name__ == "__main__":
+  main()
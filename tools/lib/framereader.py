@@ -1,11 +1,15 @@
 import os
 import subprocess
 import json
+import threading
+from collections import OrderedDict, deque
 from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import numpy as np
-from lru import LRU
 
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import download_cache_path
 from openpilot.tools.lib.filereader import FileReader, resolve_name
 from openpilot.tools.lib.exceptions import DataUnreadableError
 from openpilot.tools.lib.vidindex import hevc_index
@@ -15,6 +19,15 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# bump when the cached video index layout changes
+VIDEO_INDEX_VERSION = 1
+# video files are indexed in chunks, without reading the whole file into memory
+HEVC_INDEX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# bump when the cached keyframe thumbnails change
+KEYFRAME_VERSION = 1
+KEYFRAME_WIDTH = 320
+
 
 def assert_hvec(fn: str) -> None:
   with FileReader(fn) as f:
@@ -25,7 +38,16 @@ def assert_hvec(fn: str) -> None:
     if 'hevc' not in fn:
       raise NotImplementedError(fn)
 
-def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.ndarray:
+def frame_shape(w: int, h: int, pix_fmt: str) -> tuple[int, ...]:
+  if pix_fmt == "rgb24":
+    return (h, w, 3)
+  elif pix_fmt in ["nv12", "yuv420p"]:
+    return (h*w*3//2,)
+  else:
+    raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
+
+def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc', scale: tuple[int, int]|None = None) -> np.ndarray:
+  """Decode a whole stream, scale=(w, h) resizes the decoded frames"""
   threads = os.getenv("FFMPEG_THREADS", "0")
   args = ["ffmpeg", "-v", "quiet",
           "-threads", threads,
@@ -33,19 +55,91 @@ def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.n
           "-vsync", "0",
           "-f", vid_fmt,
           "-flags2", "showall",
-          "-i", "-",
-          "-f", "rawvideo",
-          "-pix_fmt", pix_fmt,
-          "-"]
+          "-i", "-"]
+  if scale is not None:
+    w, h = scale
+    args += ["-vf", f"scale={w}:{h}"]
+  args += ["-f", "rawvideo",
+           "-pix_fmt", pix_fmt,
+           "-"]
   dat = subprocess.check_output(args, input=rawdat)
+  return np.frombuffer(dat, dtype=np.uint8).reshape(-1, *frame_shape(w, h, pix_fmt))
 
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt in ["nv12", "yuv420p"]:
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  else:
-    raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
-  return ret
+
+class FfmpegPipe:
+  """
+    Long-lived ffmpeg process decoding GOPs written to its stdin, frames are read from its stdout as they are decoded.
+    Only for streams without B-frames: decoding is single threaded, so no frames are held back by reordering or frame threads.
+  """
+
+  def __init__(self, prefix: bytes, w: int, h: int, pix_fmt: str = "rgb24"):
+    self.prefix = prefix
+    self.shape = frame_shape(w, h, pix_fmt)
+    args = ["ffmpeg", "-v", "quiet",
+            "-threads", "1",
+            "-probesize", "32",
+            "-analyzeduration", "0",
+            "-c:v", "hevc",
+            "-vsync", "0",
+            "-f", "hevc",
+            "-flags2", "showall",
+            "-i", "-",
+            "-f", "rawvideo",
+            "-pix_fmt", pix_fmt,
+            "-flush_packets", "1",
+            "-"]
+    self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+    self.lock = threading.Lock()
+    self._writer: threading.Thread | None = None
+    self._write(prefix)
+
+  def _write(self, dat: bytes) -> None:
+    try:
+      self.proc.stdin.write(dat)
+    except (BrokenPipeError, ValueError):
+      pass  # ffmpeg exited, the reader sees EOF
+
+  def _read_frame(self) -> np.ndarray | None:
+    frame = np.empty(self.shape, dtype=np.uint8)
+    buf = memoryview(frame).cast('B')
+    pos = 0
+    while pos < len(buf):
+      n = self.proc.stdout.readinto(buf[pos:])
+      if not n:
+        return None
+      pos += n
+    return frame
+
+  def decode(self, raw: bytes, n_frames: int) -> Iterator[np.ndarray]:
+    """Decode a GOP of n_frames frames, must be called with the lock held"""
+    # the parser only emits the last frame of the GOP once the next access unit starts, so follow it with the parameter sets.
+    # written from a thread so ffmpeg never blocks on a full stdout pipe while we're writing
+    self._writer = threading.Thread(target=self._write, args=(raw + self.prefix,), daemon=True)
+    self._writer.start()
+    decoded = 0
+    try:
+      while decoded < n_frames:
+        frame = self._read_frame()
+        if frame is None:
+          raise DataUnreadableError("ffmpeg exited while decoding")
+        decoded += 1
+        yield frame
+    finally:
+      # drain the rest of the GOP if the consumer stopped early, so the next GOP starts at a frame boundary
+      while decoded < n_frames and self._read_frame() is not None:
+        decoded += 1
+      self._writer.join()
+
+  def close(self) -> None:
+    if self.proc.poll() is None:
+      self.proc.kill()
+      self.proc.wait()
+    self.proc.stdin.close()
+    self.proc.stdout.close()
+
+  def __del__(self):
+    if hasattr(self, 'proc'):
+      self.close()
 
 def ffprobe(fn, fmt=None):
   fn = resolve_name(fn)
@@ -69,16 +163,40 @@ def get_index_data(fn: str, index_data: dict|None = None):
   stream = index_data["probe"]["streams"][0]
   return index_data["index"], index_data["global_prefix"], stream["width"], stream["height"]
 
-def get_video_index(fn):
+def load_video_index(path: str) -> dict|None:
+  try:
+    with np.load(path) as f:
+      return {
+        'index': f['index'],
+        'global_prefix': f['global_prefix'].tobytes(),
+        'probe': json.loads(str(f['probe'])),
+      }
+  except (OSError, KeyError, ValueError):
+    return None
+
+def save_video_index(path: str, index_data: dict) -> None:
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    np.savez(f, index=index_data['index'], global_prefix=np.frombuffer(index_data['global_prefix'], dtype=np.uint8),
+             probe=np.array(json.dumps(index_data['probe'])))
+
+def get_video_index(fn, cache: bool = True):
+  path = download_cache_path(fn, f"vidindex_v{VIDEO_INDEX_VERSION}.npz") if cache else None
+  if path is not None and (index_data := load_video_index(path)) is not None:
+    return index_data
+
   assert_hvec(fn)
-  frame_types, dat_len, prefix = hevc_index(fn)
+  frame_types, dat_len, prefix = hevc_index(fn, chunk_size=HEVC_INDEX_CHUNK_SIZE)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
   probe = ffprobe(fn, "hevc")
-  return {
+  index_data = {
     'index': index,
     'global_prefix': prefix,
     'probe': probe
   }
+  if path is not None:
+    save_video_index(path, index_data)
+  return index_data
 
 
 class FfmpegDecoder:
@@ -90,6 +208,13 @@ class FfmpegDecoder:
     self.iframes = np.where(self.index[:, 0] == HEVC_SLICE_I)[0]
     self.pix_fmt = pix_fmt
 
+    # B-frames are held back by the decoder until later frames arrive, those streams are decoded one GOP per process
+    self.use_pipe = not np.any(self.index[:-1, 0] == HEVC_SLICE_B)
+    self._pipes: list[FfmpegPipe] = []
+    self._pipes_lock = threading.Lock()
+    self._file = None
+    self._file_lock = threading.Lock()
+
   def _gop_bounds(self, frame_idx: int):
     f_b = frame_idx
     while f_b > 0 and self.index[f_b, 0] != HEVC_SLICE_I:
@@ -99,23 +224,78 @@ class FfmpegDecoder:
       f_e += 1
     return f_b, f_e, self.index[f_b, 1], self.index[f_e, 1]
 
-  def _decode_gop(self, raw: bytes) -> Iterator[np.ndarray]:
-    yield from decompress_video_data(raw, self.w, self.h, self.pix_fmt)
+  def _read(self, off_b: int, off_e: int) -> bytes:
+    with self._file_lock:
+      if self._file is None:
+        self._file = FileReader(self.fn)
+      self._file.seek(off_b)
+      return self._file.read(off_e - off_b)
+
+  def _acquire_pipe(self, max_pipes: int) -> FfmpegPipe | None:
+    with self._pipes_lock:
+      for pipe in self._pipes:
+        if pipe.lock.acquire(blocking=False):
+          return pipe
+      if len(self._pipes) >= max_pipes:
+        return None
+      pipe = FfmpegPipe(self.prefix, self.w, self.h, self.pix_fmt)
+      pipe.lock.acquire()
+      self._pipes.append(pipe)
+      return pipe
+
+  def _decode_gop(self, raw: bytes, n_frames: int, max_pipes: int = 1) -> Iterator[np.ndarray]:
+    decoded = 0
+    # if every pipe is in the middle of a GOP, this one is decoded on its own
+    pipe = self._acquire_pipe(max_pipes) if self.use_pipe else None
+    if pipe is not None:
+      frames = pipe.decode(raw, n_frames)
+      try:
+        for frame in frames:
+          decoded += 1
+          yield frame
+        return
+      except DataUnreadableError:
+        # the pipe died, the rest of the GOP is decoded on its own
+        pipe.close()
+        with self._pipes_lock:
+          self._pipes.remove(pipe)
+      finally:
+        frames.close()
+        pipe.lock.release()
+    yield from decompress_video_data(self.prefix + raw, self.w, self.h, self.pix_fmt)[decoded:]
+
+  def _decode_gop_frames(self, f_b: int, f_e: int, max_pipes: int) -> list[np.ndarray]:
+    _, _, off_b, off_e = self._gop_bounds(f_b)
+    return list(self._decode_gop(self._read(off_b, off_e), f_e - f_b, max_pipes))
 
   def get_gop_start(self, frame_idx: int):
     return self.iframes[np.searchsorted(self.iframes, frame_idx, side="right") - 1]
 
+  def get_next_gop_start(self, frame_idx: int):
+    i = np.searchsorted(self.iframes, frame_idx, side="right")
+    return self.iframes[i] if i < len(self.iframes) else self.frame_count
+
+  def decode_iframes(self, w: int, h: int) -> np.ndarray:
+    """Decode only the I-frames, scaled to w x h rgb24. I-frames don't reference other frames, so the rest of each GOP isn't read"""
+    raw = b"".join(self.prefix + self._read(self.index[i, 1], self.index[i + 1, 1]) for i in self.iframes)
+    frames = decompress_video_data(raw, self.w, self.h, scale=(w, h))
+    if len(frames) != len(self.iframes):
+      raise DataUnreadableError(f"decoded {len(frames)} of {len(self.iframes)} I-frames of {self.fn}")
+    return frames
+
   def get_iterator(self, start_fidx: int = 0, end_fidx: int|None = None,
-                   frame_skip: int = 1) -> Iterator[tuple[int, np.ndarray]]:
+                   frame_skip: int = 1, workers: int = 1, readahead: int|None = None) -> Iterator[tuple[int, np.ndarray]]:
     end_fidx = end_fidx or self.frame_count
+    if workers > 1:
+      yield from self._get_parallel_iterator(start_fidx, end_fidx, frame_skip, workers, readahead or workers)
+      return
+
     fidx = start_fidx
     while fidx < end_fidx:
       f_b, f_e, off_b, off_e = self._gop_bounds(fidx)
-      with FileReader(self.fn) as f:
-        f.seek(off_b)
-        raw = self.prefix + f.read(off_e - off_b)
+      raw = self._read(off_b, off_e)
       # number of frames to discard inside this GOP before the wanted one
-      for i, frm in enumerate(decompress_video_data(raw, self.w, self.h, self.pix_fmt)):
+      for i, frm in enumerate(self._decode_gop(raw, f_e - f_b)):
         fidx = f_b + i
         if fidx >= end_fidx:
           return
@@ -123,33 +303,211 @@ class FfmpegDecoder:
           yield fidx, frm
       fidx += 1
 
+  def _get_parallel_iterator(self, start_fidx: int, end_fidx: int, frame_skip: int,
+                             workers: int, readahead: int) -> Iterator[tuple[int, np.ndarray]]:
+    # GOPs decode independently, decode up to readahead of them at once on the pool and yield their frames in order
+    wanted = range(start_fidx, end_fidx, frame_skip)
+    gops: list[tuple[int, int]] = []
+    fidx = start_fidx
+    while fidx < end_fidx:
+      f_b, f_e, _, _ = self._gop_bounds(fidx)
+      gops.append((f_b, f_e))
+      # skip GOPs without wanted frames
+      fidx = f_e + (start_fidx - f_e) % frame_skip
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending: deque[tuple[int, Future[list[np.ndarray]]]] = deque()
+    try:
+      for gop_idx in range(len(gops)):
+        while len(pending) < readahead and gop_idx + len(pending) < len(gops):
+          f_b, f_e = gops[gop_idx + len(pending)]
+          pending.append((f_b, pool.submit(self._decode_gop_frames, f_b, f_e, workers)))
+        f_b, future = pending.popleft()
+        for i, frm in enumerate(future.result()):
+          if f_b + i in wanted:
+            yield f_b + i, frm
+    finally:
+      pool.shutdown(wait=True, cancel_futures=True)
+
+  def close(self) -> None:
+    with self._pipes_lock:
+      for pipe in self._pipes:
+        pipe.close()
+      self._pipes.clear()
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
 def FrameIterator(fn: str, index_data: dict|None=None,
                         pix_fmt: str = "rgb24",
-                        start_fidx:int=0, end_fidx=None, frame_skip:int=1) -> Iterator[np.ndarray]:
+                        start_fidx:int=0, end_fidx=None, frame_skip:int=1,
+                        workers:int=1, readahead:int|None=None) -> Iterator[np.ndarray]:
   dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data)
-  for _, frame in dec.get_iterator(start_fidx=start_fidx, end_fidx=end_fidx, frame_skip=frame_skip):
-    yield frame
+  try:
+    for _, frame in dec.get_iterator(start_fidx=start_fidx, end_fidx=end_fidx, frame_skip=frame_skip, workers=workers, readahead=readahead):
+      yield frame
+  finally:
+    dec.close()
+
+class GOPCache:
+  """LRU of decoded GOPs, bounded by the size of their frames. The most recently used GOP is always kept"""
+
+  def __init__(self, max_bytes: int):
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self._gops: OrderedDict[int, list[np.ndarray]] = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._gops)
+
+  def get(self, gop_start: int, fidx: int) -> np.ndarray | None:
+    frames = self._gops.get(gop_start)
+    if frames is None or fidx - gop_start >= len(frames):
+      return None
+    self._gops.move_to_end(gop_start)
+    return frames[fidx - gop_start]
+
+  def add(self, gop_start: int, fidx: int, frame: np.ndarray) -> None:
+    frames = self._gops.get(gop_start)
+    if frames is None or len(frames) != fidx - gop_start:
+      # new GOP, or the GOP is decoded again from its start
+      if frames is not None:
+        self.nbytes -= sum(f.nbytes for f in frames)
+      frames = self._gops[gop_start] = []
+    frames.append(frame)
+    self.nbytes += frame.nbytes
+    self._gops.move_to_end(gop_start)
+
+    while self.nbytes > self.max_bytes and len(self._gops) > 1:
+      _, evicted = self._gops.popitem(last=False)
+      self.nbytes -= sum(f.nbytes for f in evicted)
+
+
+def keyframe_size(w: int, h: int, width: int = KEYFRAME_WIDTH) -> tuple[int, int]:
+  # keeps the aspect ratio, with even dimensions for the scaler
+  width = min(width, w) // 2 * 2
+  return width, max(2, round(h * width / w / 2) * 2)
+
+
+class KeyframeStore:
+  """
+    Downscaled rgb24 thumbnails of the I-frames of a video file, one per GOP.
+    They're decoded once and kept in the download cache as an .npy file, later uses memory-map it without decoding anything.
+  """
+
+  def __init__(self, fn: str, index_data: dict|None = None, width: int = KEYFRAME_WIDTH, cache: bool = True):
+    self.fn = fn
+    self.decoder = FfmpegDecoder(fn, index_data)
+    self.iframes = self.decoder.iframes
+    self.w, self.h = keyframe_size(self.decoder.w, self.decoder.h, width)
+    self._path = download_cache_path(fn, f"keyframes_v{KEYFRAME_VERSION}_{self.w}x{self.h}.npy") if cache else None
+    self._thumbnails: np.ndarray | None = None
+
+  def __len__(self) -> int:
+    return len(self.iframes)
+
+  @property
+  def thumbnails(self) -> np.ndarray:
+    """All thumbnails, shape (len(iframes), h, w, 3)"""
+    if self._thumbnails is None:
+      self._thumbnails = self._load()
+    return self._thumbnails
+
+  def _load(self) -> np.ndarray:
+    shape = (len(self.iframes), self.h, self.w, 3)
+    if self._path is not None:
+      try:
+        thumbnails = np.load(self._path, mmap_mode='r')
+        if thumbnails.shape == shape and thumbnails.dtype == np.uint8:
+          return thumbnails
+      except (OSError, ValueError):
+        pass
+
+    thumbnails = self.decoder.decode_iframes(self.w, self.h)
+    self.decoder.close()
+    if self._path is not None:
+      os.makedirs(os.path.dirname(self._path), exist_ok=True)
+      with atomic_write_in_dir(self._path, mode="wb", overwrite=True) as f:
+        np.save(f, thumbnails)
+    return thumbnails
+
+  def get(self, fidx: int) -> tuple[int, np.ndarray]:
+    """Index and thumbnail of the I-frame starting the GOP of frame fidx"""
+    i = np.searchsorted(self.iframes, fidx, side="right") - 1
+    return int(self.iframes[i]), self.thumbnails[i]
+
+  def close(self) -> None:
+    self.decoder.close()
+    self._thumbnails = None
+
+
+class RouteKeyframes:
+  """Keyframe thumbnails of a route's video files, keyed by segment number and frame index. Segments without video are None"""
+
+  def __init__(self, camera_paths: list[str|None], width: int = KEYFRAME_WIDTH):
+    self.camera_paths = camera_paths
+    self.width = width
+    self._stores: dict[int, KeyframeStore] = {}
+
+  def segment(self, seg: int) -> KeyframeStore:
+    if seg not in self._stores:
+      fn = self.camera_paths[seg]
+      if fn is None:
+        raise DataUnreadableError(f"segment {seg} has no video")
+      self._stores[seg] = KeyframeStore(fn, width=self.width)
+    return self._stores[seg]
+
+  def get(self, seg: int, fidx: int) -> tuple[int, np.ndarray]:
+    return self.segment(seg).get(fidx)
+
+  def close(self) -> None:
+    for store in self._stores.values():
+      store.close()
+    self._stores.clear()
+
 
 class FrameReader:
   def __init__(self, fn: str, index_data: dict|None = None,
-               cache_size: int = 30, pix_fmt: str = "rgb24"):
+               cache_size: int = 30, pix_fmt: str = "rgb24", cache_bytes: int|None = None, workers: int = 1):
     self.decoder = FfmpegDecoder(fn, index_data, pix_fmt)
     self.iframes = self.decoder.iframes
-    self._cache: LRU[int, np.ndarray] = LRU(cache_size)
     self.w, self.h, self.frame_count, = self.decoder.w, self.decoder.h, self.decoder.frame_count
     self.pix_fmt = pix_fmt
+    # cache_size is in frames, cache_bytes overrides it
+    if cache_bytes is None:
+      cache_bytes = cache_size * int(np.prod(frame_shape(self.w, self.h, pix_fmt)))
+    self._cache = GOPCache(cache_bytes)
+    # with more than one worker, the following GOPs are decoded in parallel while frames are read
+    self.workers = workers
 
     self.it: Iterator[tuple[int, np.ndarray]] | None = None
     self.fidx = -1
+    self._keyframes: KeyframeStore | None = None
 
   def get(self, fidx:int) -> list[np.ndarray]:
-    if fidx in self._cache:  # If frame is cached, return it
-      return [self._cache[fidx]]
     read_start = self.decoder.get_gop_start(fidx)
-    if not self.it or fidx < self.fidx or read_start != self.decoder.get_gop_start(self.fidx):  # If the frame is in a different GOP, reset the iterator
-      self.it = self.decoder.get_iterator(read_start)
+    frame = self._cache.get(read_start, fidx)
+    if frame is not None:  # If frame is cached, return it
+      return [frame]
+    # reset on seeks, but keep reading into the next GOP, which the parallel iterator is already decoding
+    gops = (self.decoder.get_gop_start(self.fidx), self.decoder.get_next_gop_start(self.fidx))
+    if not self.it or fidx <= self.fidx or read_start not in gops:
+      self.it = self.decoder.get_iterator(read_start, workers=self.workers)
       self.fidx = -1
     while self.fidx < fidx:
       self.fidx, frame = next(self.it)
-      self._cache[self.fidx] = frame
-    return [self._cache[fidx]]  # TODO: return just frame
+      self._cache.add(self.decoder.get_gop_start(self.fidx), self.fidx, frame)
+    return [frame]  # TODO: return just frame
+
+  def get_keyframe(self, fidx: int, width: int = KEYFRAME_WIDTH) -> tuple[int, np.ndarray]:
+    """Index and rgb24 thumbnail of the I-frame starting the GOP of frame fidx, from the persistent KeyframeStore"""
+    if self._keyframes is None or self._keyframes.w != keyframe_size(self.w, self.h, width)[0]:
+      index_data = {'index': self.decoder.index, 'global_prefix': self.decoder.prefix, 'probe': {'streams': [{'width': self.w, 'height': self.h}]}}
+      self._keyframes = KeyframeStore(self.decoder.fn, index_data, width)
+    return self._keyframes.get(fidx)
+
+  def close(self) -> None:
+    self.it = None
+    self.decoder.close()
+    if self._keyframes is not None:
+      self._keyframes.close()
@@ -0,0 +1,77 @@
+import os
+from collections.abc import Iterable
+
+import capnp
+import numpy as np
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.cache import download_cache_path
+
+# bump when the index layout changes, old indexes are then rebuilt
+INDEX_VERSION = 1
+
+# type id of events that aren't a valid union type
+INVALID_TYPE = -1
+
+
+def index_path(fn: str) -> str:
+  return download_cache_path(fn, f"index_v{INDEX_VERSION}.npz")
+
+
+class LogIndex:
+  """Offset, size, logMonoTime and union type of every event in a decompressed log file"""
+
+  def __init__(self, offsets: np.ndarray, sizes: np.ndarray, mono_times: np.ndarray, type_ids: np.ndarray, type_names: list[str]):
+    self.offsets = offsets
+    self.sizes = sizes
+    self.mono_times = mono_times
+    self.type_ids = type_ids
+    self.type_names = type_names
+
+  def __len__(self) -> int:
+    return len(self.offsets)
+
+  @classmethod
+  def from_events(cls, events: Iterable[tuple[int, int, capnp._DynamicStructReader]]) -> 'LogIndex':
+    offsets, sizes, mono_times, type_ids = [], [], [], []
+    type_names: dict[str, int] = {}
+    for offset, size, ev in events:
+      offsets.append(offset)
+      sizes.append(size)
+      mono_times.append(ev.logMonoTime)
+      try:
+        type_ids.append(type_names.setdefault(ev.which(), len(type_names)))
+      except capnp.KjException:
+        type_ids.append(INVALID_TYPE)
+
+    return cls(np.array(offsets, dtype=np.uint64), np.array(sizes, dtype=np.uint32), np.array(mono_times, dtype=np.uint64),
+               np.array(type_ids, dtype=np.int16), list(type_names))
+
+  @classmethod
+  def load(cls, path: str) -> 'LogIndex | None':
+    try:
+      with np.load(path) as f:
+        return cls(f['offsets'], f['sizes'], f['mono_times'], f['type_ids'], f['type_names'].tolist())
+    except (OSError, KeyError, ValueError):
+      return None
+
+  def save(self, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      np.savez(f, offsets=self.offsets, sizes=self.sizes, mono_times=self.mono_times, type_ids=self.type_ids,
+               type_names=np.array(self.type_names, dtype=str))
+
+  def select(self, msg_types: Iterable[str] | None = None, start_time: int | None = None, end_time: int | None = None,
+             only_union_types: bool = False) -> np.ndarray:
+    """Indexes of the events matching the types and start_time <= logMonoTime < end_time, in file order"""
+    mask = np.ones(len(self), dtype=bool)
+    if msg_types is not None:
+      ids = [self.type_names.index(t) for t in msg_types if t in self.type_names]
+      mask &= np.isin(self.type_ids, ids)
+    elif only_union_types:
+      mask &= self.type_ids != INVALID_TYPE
+    if start_time is not None:
+      mask &= self.mono_times >= start_time
+    if end_time is not None:
+      mask &= self.mono_times < end_time
+    return np.flatnonzero(mask)
@@ -1,5 +1,26 @@
+import operator
+import os
+
 import numpy as np
 
+from openpilot.common.file_helpers import atomic_write_in_dir
+
+# service name -> field paths separated by "/", or None for every scalar and list field
+Selection = dict[str, list[str] | None]
+Columns = dict[str, dict[str, np.ndarray]]
+
+CAPNP_DTYPES = {
+  'bool': np.bool_,
+  'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
+  'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
+  'float32': np.float32, 'float64': np.float64,
+  'enum': np.uint16,  # raw enumerant value
+}
+INITIAL_CAPACITY = 1024
+# bump when the cached columns layout changes
+COLUMNS_VERSION = 1
+RAGGED_LENGTHS_SUFFIX = ":lengths"
+
 
 def flatten_type_dict(d, sep="/", prefix=None):
   res = {}
@@ -76,6 +97,179 @@ def msgs_to_time_series(msgs):
   return values
 
 
+
+def _field_dtype(field) -> tuple[np.dtype, bool, bool] | None:
+  # returns the column dtype, if the field is a list and if it's an enum, None for unsupported types
+  typ = field.proto.slot.type
+  if typ.which() == 'list':
+    elem = typ.list.elementType.which()
+    return (CAPNP_DTYPES[elem], True, False) if elem in CAPNP_DTYPES and elem != 'enum' else None
+  return (CAPNP_DTYPES[typ.which()], False, typ.which() == 'enum') if typ.which() in CAPNP_DTYPES else None
+
+
+def _schema_fields(schema, prefix: str = "") -> dict[str, tuple[np.dtype, bool, bool]]:
+  fields = {}
+  for name in schema.non_union_fields:
+    field = schema.fields[name]
+    path = prefix + name
+    if field.proto.which() == 'group' or field.proto.slot.type.which() == 'struct':
+      fields.update(_schema_fields(field.schema, path + "/"))
+    elif (dtype := _field_dtype(field)) is not None:
+      fields[path] = dtype
+  return fields
+
+
+def _resolve_field(schema, path: str) -> tuple[np.dtype, bool, bool]:
+  *parents, name = path.split("/")
+  for parent in parents:
+    schema = schema.fields[parent].schema
+  dtype = _field_dtype(schema.fields[name])
+  if dtype is None:
+    raise ValueError(f"unsupported field type for {path}")
+  return dtype
+
+
+class _Column:
+  """Preallocated typed array that doubles its capacity when full, falls back to a ragged object column for lists of varying length"""
+
+  def __init__(self, path: str, dtype: np.dtype, is_list: bool = False, is_enum: bool = False):
+    self.get = operator.attrgetter(path.replace("/", "."))
+    self.dtype = dtype
+    self.is_list = is_list
+    self.is_enum = is_enum
+    self.arr: np.ndarray | None = None
+    self.ragged: list[np.ndarray] | None = None
+    self.n = 0
+
+  def append(self, msg) -> None:
+    value = self.get(msg)
+    if self.is_enum:
+      value = value.raw
+    elif self.is_list:
+      value = np.array(value, dtype=self.dtype)
+      if self.ragged is not None:
+        self.ragged.append(value)
+        self.n += 1
+        return
+
+    if self.arr is None:
+      self.arr = np.empty((INITIAL_CAPACITY, *np.shape(value)), dtype=self.dtype)
+    elif self.n == len(self.arr):
+      arr = np.empty((2 * len(self.arr), *self.arr.shape[1:]), dtype=self.dtype)
+      arr[:self.n] = self.arr
+      self.arr = arr
+
+    if self.is_list and value.shape != self.arr.shape[1:]:
+      self.ragged = list(self.arr[:self.n])
+      self.ragged.append(value)
+    else:
+      self.arr[self.n] = value
+    self.n += 1
+
+  def values(self) -> np.ndarray:
+    if self.ragged is not None:
+      return _object_array(self.ragged)
+    if self.arr is None:
+      return np.empty(0, dtype=self.dtype)
+    return self.arr[:self.n]
+
+
+def _object_array(values: list) -> np.ndarray:
+  arr = np.empty(len(values), dtype=object)
+  arr[:] = values
+  return arr
+
+
+def msgs_to_columns(msgs, selection: Selection) -> Columns:
+  """
+    Like msgs_to_time_series, but only extracts the selected fields of the selected services,
+    reading them directly into typed arrays. Enums are stored as their raw values.
+    Services that aren't structs, like lists, are skipped.
+  """
+  columns: dict[str, dict[str, _Column]] = {}
+  times: dict[str, _Column] = {}
+  for msg in msgs:
+    typ = msg.which()
+    if typ not in selection:
+      continue
+
+    service = msg._get(typ)
+    if not hasattr(service, 'schema'):
+      # list services have no fields to select
+      continue
+
+    if typ not in columns:
+      fields = selection[typ]
+      fields = _schema_fields(service.schema) if fields is None else {f: _resolve_field(service.schema, f) for f in fields}
+      columns[typ] = {path: _Column(path, *dtype) for path, dtype in fields.items()}
+      columns[typ]["_valid"] = _Column("valid", np.bool_)
+      times[typ] = _Column("logMonoTime", np.uint64)
+
+    times[typ].append(msg)
+    columns[typ]["_valid"].append(msg)
+    for path, column in columns[typ].items():
+      if path != "_valid":
+        column.append(service)
+
+  values = {}
+  for typ, group in columns.items():
+    t = times[typ].values() / 1.0e9
+    order = np.argsort(t, kind='stable')
+    values[typ] = {"t": t[order], **{path: column.values()[order] for path, column in group.items()}}
+  return values
+
+
+def concat_columns(segments: list[Columns]) -> Columns:
+  values = {}
+  for typ in dict.fromkeys(typ for columns in segments for typ in columns):
+    groups = [columns[typ] for columns in segments if typ in columns]
+    group = {}
+    for name in groups[0]:
+      arrs = [g[name] for g in groups]
+      if len({a.shape[1:] for a in arrs}) > 1:
+        # lists of different length across segments
+        arrs = [_object_array(list(a)) for a in arrs]
+      group[name] = np.concatenate(arrs)
+    order = np.argsort(group["t"], kind='stable')
+    values[typ] = {name: arr[order] for name, arr in group.items()}
+  return values
+
+
+def save_columns(path: str, columns: Columns) -> None:
+  arrays = {}
+  for typ, group in columns.items():
+    for name, arr in group.items():
+      key = f"{typ}/{name}"
+      if arr.dtype == object:
+        # store ragged columns flattened with the length of each row to avoid pickling
+        arrays[key] = np.concatenate(arr) if len(arr) else np.empty(0)
+        arrays[key + RAGGED_LENGTHS_SUFFIX] = np.array([len(a) for a in arr], dtype=np.int64)
+      else:
+        arrays[key] = arr
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    np.savez(f, **arrays)
+
+
+def load_columns(path: str) -> Columns | None:
+  try:
+    with np.load(path) as f:
+      columns: Columns = {}
+      for key in f.files:
+        if key.endswith(RAGGED_LENGTHS_SUFFIX):
+          continue
+        typ, name = key.split("/", 1)
+        arr = f[key]
+        if key + RAGGED_LENGTHS_SUFFIX in f.files:
+          lengths = f[key + RAGGED_LENGTHS_SUFFIX]
+          arr = _object_array(np.split(arr, np.cumsum(lengths)[:-1]) if len(lengths) else [])
+        columns.setdefault(typ, {})[name] = arr
+      return columns
+  except (OSError, ValueError):
+    return None
+
+
 if __name__ == "__main__":
   import sys
   from openpilot.tools.lib.logreader import LogReader
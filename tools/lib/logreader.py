@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 import bz2
 from functools import cache, partial
+import itertools
 import multiprocessing
+import multiprocessing.pool
 import capnp
 import enum
+import hashlib
+import json
+import numpy as np
 import os
 import pathlib
+import struct
 import sys
 import tqdm
 import urllib.parse
@@ -13,6 +19,7 @@ import warnings
 import zstandard as zstd
 
 from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
@@ -20,8 +27,11 @@ from openpilot.common.swaglog import cloudlog
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
 from openpilot.tools.lib.filereader import FileReader, file_exists, internal_source_available
+from openpilot.tools.lib.cache import download_cache_path
+from openpilot.tools.lib.log_index import LogIndex, index_path
 from openpilot.tools.lib.route import Route, SegmentRange
-from openpilot.tools.lib.log_time_series import msgs_to_time_series
+from openpilot.tools.lib.log_time_series import COLUMNS_VERSION, Columns, Selection, concat_columns, load_columns, msgs_to_columns, \
+                                                msgs_to_time_series, save_columns
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
@@ -48,41 +58,183 @@ def decompress_stream(data: bytes):
 
   return decompressed_data
 
+# size of the compressed chunks read from the source in streaming mode
+STREAM_CHUNK_SIZE = 1 << 20
+
+# capnp allows at most 512 segments per message, anything above is a corrupted header
+MAX_CAPNP_SEGMENTS = 512
+
+
+def _compression_from_ext(fn: str) -> str:
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in ('', '.bz2', '.zst'):
+    # old rlogs weren't compressed
+    raise ValueError(f"unknown extension {ext}")
+  return ext
+
+
+def decompress_chunks(chunks: Iterable[bytes], ext: str | None = None) -> Iterator[bytes]:
+  """Incrementally decompress an iterable of bz2, zstd or uncompressed chunks"""
+  chunks = iter(chunks)
+  first = next(chunks, b"")
+  chunks = itertools.chain([first], chunks)
+
+  if ext == ".bz2" or first.startswith(b'BZh9'):
+    new_decompressor = bz2.BZ2Decompressor
+  elif ext == ".zst" or first.startswith(b'\x28\xB5\x2F\xFD'):
+    new_decompressor = zstd.ZstdDecompressor().decompressobj
+  else:
+    yield from chunks
+    return
+
+  # files can be made of multiple concatenated streams/frames
+  decompressor = new_decompressor()
+  for chunk in chunks:
+    while chunk:
+      yield decompressor.decompress(chunk)
+      chunk = b""
+      if decompressor.eof:
+        chunk = decompressor.unused_data
+        decompressor = new_decompressor()
+
+
+def _capnp_message_size(buf: bytearray, offset: int) -> int | None:
+  # capnp stream framing: (segment count - 1), then the size of each segment in words, padded to 8 bytes
+  if len(buf) - offset < 4:
+    return None
+  num_segments = struct.unpack_from("<I", buf, offset)[0] + 1
+  if num_segments > MAX_CAPNP_SEGMENTS:
+    raise ValueError(f"invalid segment count {num_segments}")
+
+  header_size = (4 + 4 * num_segments + 7) & ~7
+  if len(buf) - offset < header_size:
+    return None
+  return header_size + 8 * sum(struct.unpack_from(f"<{num_segments}I", buf, offset + 4))
+
+
+def iter_framed_events(chunks: Iterable[bytes]) -> Iterator[tuple[int, int, capnp._DynamicStructReader]]:
+  """Parse events from decompressed chunks, only keeping a window of incomplete messages in memory.
+  Yields the offset and size of each event in the decompressed stream along with the event."""
+  buf = bytearray()
+  buf_offset = 0
+  for chunk in chunks:
+    buf += chunk
+
+    # find the end of the last complete message in the window
+    end = 0
+    sizes = []
+    try:
+      while (size := _capnp_message_size(buf, end)) is not None and end + size <= len(buf):
+        sizes.append(size)
+        end += size
+    except ValueError:
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+      return
+
+    if end > 0:
+      offset = buf_offset
+      try:
+        for size, ev in zip(sizes, capnp_log.Event.read_multiple_bytes(bytes(buf[:end])), strict=False):
+          yield offset, size, ev
+          offset += size
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+        return
+      del buf[:end]
+      buf_offset += end
+
+  if len(buf):
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+
+def iter_events(chunks: Iterable[bytes]) -> Iterator[capnp._DynamicStructReader]:
+  return (ev for _, _, ev in iter_framed_events(chunks))
+
+
 class _LogFileReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, streaming=False):
     self.data_version = None
     self._only_union_types = only_union_types
-
-    ext = None
+    self._sort_by_time = sort_by_time
+    self._fn = fn
+    self._dat = dat
+    self._ext = None
     if not dat:
-      _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-      if ext not in ('', '.bz2', '.zst'):
-        # old rlogs weren't compressed
-        raise ValueError(f"unknown extension {ext}")
+      self._ext = _compression_from_ext(fn)
 
-      with FileReader(fn) as f:
+    # in streaming mode events are decompressed and parsed as they are iterated,
+    # sorting needs every event so it falls back to buffering them on the first iteration
+    self._decompressed: bytes | None = None
+    self._ents: list[capnp._DynamicStructReader] | None = None
+    if not streaming:
+      self._decompressed = self._read_file()
+
+  def _read_file(self) -> bytes:
+    dat = self._dat
+    if not dat:
+      with FileReader(self._fn) as f:
         dat = f.read()
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
+    if self._ext == ".bz2" or dat.startswith(b'BZh9'):
       dat = bz2.decompress(dat)
-    elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
+    elif self._ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
       # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
       dat = decompress_stream(dat)
+    return dat
+
+  def _decompressed_chunks(self) -> Iterator[bytes]:
+    if self._decompressed is not None:
+      yield self._decompressed
+    elif self._dat:
+      chunks = (self._dat[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(self._dat), STREAM_CHUNK_SIZE))
+      yield from decompress_chunks(chunks, self._ext)
+    else:
+      with FileReader(self._fn) as f:
+        yield from decompress_chunks(iter(partial(f.read, STREAM_CHUNK_SIZE), b""), self._ext)
 
-    ents = capnp_log.Event.read_multiple_bytes(dat)
-
-    self._ents = []
-    try:
-      for e in ents:
-        self._ents.append(e)
-    except capnp.KjException:
-      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
-
-    if sort_by_time:
-      self._ents.sort(key=lambda x: x.logMonoTime)
+  def _events(self) -> list[capnp._DynamicStructReader]:
+    if self._ents is None:
+      ents = []
+      if self._decompressed is not None:
+        try:
+          for e in capnp_log.Event.read_multiple_bytes(self._decompressed):
+            ents.append(e)
+        except capnp.KjException:
+          warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+      else:
+        ents = list(iter_events(self._decompressed_chunks()))
+
+      if self._sort_by_time:
+        ents.sort(key=lambda x: x.logMonoTime)
+      self._ents = ents
+    return self._ents
+
+  def build_index(self) -> LogIndex:
+    return LogIndex.from_events(iter_framed_events(self._decompressed_chunks()))
+
+  def read_events(self, offsets: Iterable[int], sizes: Iterable[int]) -> Iterator[capnp._DynamicStructReader]:
+    """Read single events by their offset and size in the decompressed file"""
+    offsets, sizes = list(offsets), list(sizes)
+    if not len(offsets):
+      return
+
+    dat = self._decompressed
+    if dat is None:
+      # only decompress up to the end of the last requested event
+      end = max(o + s for o, s in zip(offsets, sizes, strict=True))
+      buf = bytearray()
+      for chunk in self._decompressed_chunks():
+        buf += chunk
+        if len(buf) >= end:
+          break
+      dat = bytes(buf)
+
+    for offset, size in zip(offsets, sizes, strict=True):
+      yield from capnp_log.Event.read_multiple_bytes(dat[offset:offset + size])
 
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
+    streamed = self._decompressed is None and not self._sort_by_time
+    for ent in (iter_events(self._decompressed_chunks()) if streamed else self._events()):
       if self._only_union_types:
         try:
           ent.which()
@@ -254,6 +406,11 @@ def parse_direct(identifier: str):
   return None
 
 
+def _run_on_segment(func, lr_kwargs, fn):
+  # only the identifier is sent to the workers, not the LogReader and its loaded segments
+  return func(_LogFileReader(fn, **lr_kwargs))
+
+
 class LogReader:
   def _parse_identifier(self, identifier: str) -> list[LogPath]:
     # useradmin, etc.
@@ -275,7 +432,8 @@ class LogReader:
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               source: Source = auto_source, sort_by_time=False, only_union_types=False):
+               source: Source = auto_source, sort_by_time=False, only_union_types=False, streaming=False, use_index=False,
+               prefetch: int = 0):
     self.default_mode = default_mode
     self.source = source
     self.identifier = identifier
@@ -284,29 +442,106 @@ class LogReader:
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    self.streaming = streaming
+    self.use_index = use_index
+    # number of segments downloaded and decompressed ahead of the one being iterated
+    self.prefetch = prefetch
+
+    self._pool: multiprocessing.pool.Pool | None = None
+    self._pool_size = 0
 
     self.__lrs: dict[int, _LogFileReader] = {}
+    self.__indexes: dict[int, LogIndex] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                                     streaming=self.streaming)
     return self.__lrs[i]
 
-  def __iter__(self):
+  def _get_index(self, i) -> LogIndex:
+    if i not in self.__indexes:
+      path = index_path(self.logreader_identifiers[i])
+      index = LogIndex.load(path)
+      if index is None:
+        index = self._get_lr(i).build_index()
+        index.save(path)
+      self.__indexes[i] = index
+    return self.__indexes[i]
+
+  def _iter_segment_indexed(self, i, msg_types: list[str] | None = None, start_time: int | None = None, end_time: int | None = None):
+    index = self._get_index(i)
+    idxs = index.select(msg_types, start_time, end_time, only_union_types=self.only_union_types)
+    if len(idxs) == 0:
+      # segments without matches aren't downloaded once their index is cached
+      return
+    if self.sort_by_time:
+      idxs = idxs[np.argsort(index.mono_times[idxs], kind='stable')]
+    yield from self._get_lr(i).read_events(index.offsets[idxs].tolist(), index.sizes[idxs].tolist())
+
+  def _iter_indexed(self, msg_types: list[str] | None = None, start_time: int | None = None, end_time: int | None = None):
     for i in range(len(self.logreader_identifiers)):
-      yield from self._get_lr(i)
+      yield from self._iter_segment_indexed(i, msg_types, start_time, end_time)
 
-  def _run_on_segment(self, func, i):
-    return func(self._get_lr(i))
+  def __iter__(self):
+    num_segs = len(self.logreader_identifiers)
+    if self.prefetch <= 0 or self.streaming:
+      for i in range(num_segs):
+        yield from self._get_lr(i)
+      return
+
+    executor = ThreadPoolExecutor(max_workers=self.prefetch)
+    futures: dict[int, Future] = {}
+    try:
+      for i in range(num_segs):
+        for j in range(i, min(i + self.prefetch + 1, num_segs)):
+          if j not in futures:
+            futures[j] = executor.submit(self._get_lr, j)
+        futures.pop(i).result()
+        yield from self._get_lr(i)
+    finally:
+      executor.shutdown(wait=False, cancel_futures=True)
+
+  def _get_pool(self, num_processes: int) -> multiprocessing.pool.Pool:
+    # the worker pool is reused across calls, spawning it is expensive
+    if self._pool is None or self._pool_size != num_processes:
+      self.close()
+      self._pool = multiprocessing.Pool(num_processes)
+      self._pool_size = num_processes
+    return self._pool
+
+  def iter_across_segments(self, num_processes, func):
+    """Run func on each segment in a worker pool, yielding the results in segment order as they finish"""
+    lr_kwargs = {'sort_by_time': self.sort_by_time, 'only_union_types': self.only_union_types, 'streaming': self.streaming}
+    yield from self._get_pool(num_processes).imap(partial(_run_on_segment, func, lr_kwargs), self.logreader_identifiers)
 
   def run_across_segments(self, num_processes, func, disable_tqdm=False, desc=None):
-    with multiprocessing.Pool(num_processes) as pool:
-      ret = []
-      num_segs = len(self.logreader_identifiers)
-      for p in tqdm.tqdm(pool.imap(partial(self._run_on_segment, func), range(num_segs)), total=num_segs, disable=disable_tqdm, desc=desc):
-        ret.extend(p)
-      return ret
+    ret = []
+    num_segs = len(self.logreader_identifiers)
+    for p in tqdm.tqdm(self.iter_across_segments(num_processes, func), total=num_segs, disable=disable_tqdm, desc=desc):
+      ret.extend(p)
+    return ret
+
+  def close(self):
+    if getattr(self, '_pool', None) is not None:
+      self._pool.terminate()
+      self._pool.join()
+      self._pool = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def __del__(self):
+    self.close()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['_pool'] = None
+    return state
 
   def reset(self):
     self.logreader_identifiers = []
@@ -318,8 +553,16 @@ class LogReader:
     return _LogFileReader("", dat=dat)
 
   def filter(self, msg_type: str):
+    if self.use_index:
+      return (getattr(m, msg_type) for m in self._iter_indexed([msg_type]))
     return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
 
+  def time_range(self, start_time: int | None = None, end_time: int | None = None):
+    """Messages with start_time <= logMonoTime < end_time"""
+    if self.use_index:
+      return self._iter_indexed(start_time=start_time, end_time=end_time)
+    return (m for m in self if (start_time is None or m.logMonoTime >= start_time) and (end_time is None or m.logMonoTime < end_time))
+
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
 
@@ -327,6 +570,21 @@ class LogReader:
   def time_series(self):
     return msgs_to_time_series(self)
 
+  def columns(self, selection: Selection, cache: bool = True) -> Columns:
+    """Columnar time series of the selected services and fields, each segment's columns are cached in the download cache"""
+    selection_hash = hashlib.sha256(json.dumps(selection, sort_keys=True).encode()).hexdigest()[:16]
+    segments = []
+    for i, fn in enumerate(self.logreader_identifiers):
+      path = download_cache_path(fn, f"columns_v{COLUMNS_VERSION}_{selection_hash}.npz")
+      columns = load_columns(path) if cache else None
+      if columns is None:
+        msgs = self._iter_segment_indexed(i, list(selection)) if self.use_index else self._get_lr(i)
+        columns = msgs_to_columns(msgs, selection)
+        if cache:
+          save_columns(path, columns)
+      segments.append(columns)
+    return concat_columns(segments)
+
 if __name__ == "__main__":
   import codecs
 
@@ -1,11 +1,15 @@
 import http.server
+import multiprocessing
 import os
+import random
 import shutil
 import socket
+import time
 import pytest
 
 from openpilot.selfdrive.test.helpers import http_server_context
 from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.download_cache import DownloadCache
 from openpilot.tools.lib.url_file import URLFile
 
 
@@ -28,11 +32,35 @@ class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
 
 
+class RangeTestRequestHandler(http.server.BaseHTTPRequestHandler):
+  DATA = bytes(range(256)) * 100
+  requests: list[str] = []
+
+  def do_GET(self):
+    start, end = (int(x) for x in self.headers["Range"].removeprefix("bytes=").split("-"))
+    RangeTestRequestHandler.requests.append(self.headers["Range"])
+    self.send_response(206)
+    self.send_header("Content-Length", str(end - start + 1))
+    self.end_headers()
+    self.wfile.write(self.DATA[start:end + 1])
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.DATA)))
+    self.end_headers()
+
+
 @pytest.fixture
 def host():
   with http_server_context(handler=CachingTestRequestHandler) as (host, port):
     yield f"http://{host}:{port}"
 
+
+@pytest.fixture
+def range_host():
+  with http_server_context(handler=RangeTestRequestHandler) as (host, port):
+    yield f"http://{host}:{port}"
+
 class TestFileDownload:
 
   def test_pipeline_defaults(self, host):
@@ -128,3 +156,90 @@ class TestFileDownload:
     CachingTestRequestHandler.FILE_EXISTS = True
     length = URLFile(file_url).get_length()
     assert length == 4
+
+  def test_chunked_cache(self, mocker, tmp_path, range_host):
+    mocker.patch("openpilot.system.hardware.hw.Paths.download_cache_root", return_value=str(tmp_path) + "/")
+    mocker.patch("openpilot.tools.lib.url_file.CHUNK_SIZE", 1000)
+    mocker.patch("openpilot.tools.lib.url_file.MAX_RANGE_CHUNKS", 4)
+    url = f"{range_host}/test.bin"
+    data = RangeTestRequestHandler.DATA
+    RangeTestRequestHandler.requests = []
+
+    f = URLFile(url, cache=True)
+    f.seek(1500)
+    assert f.read(2000) == data[1500:3500]
+    assert RangeTestRequestHandler.requests == ["bytes=1000-3999"]
+
+    # only the missing chunks are downloaded, adjacent ones in a single request
+    RangeTestRequestHandler.requests = []
+    f.seek(0)
+    assert f.read() == data
+    assert sorted(RangeTestRequestHandler.requests) == sorted(["bytes=0-999", "bytes=4000-7999", "bytes=8000-11999",
+                                                               "bytes=12000-15999", "bytes=16000-19999", "bytes=20000-23999",
+                                                               "bytes=24000-25599"])
+
+    # everything is cached
+    RangeTestRequestHandler.requests = []
+    f = URLFile(url, cache=True)
+    f.seek(len(data) - 100)
+    assert f.read(200) == data[-100:]
+    assert f.read() == b""
+    assert RangeTestRequestHandler.requests == []
+
+    # counters are written out on stats() or periodically, not on every read
+    assert not any(fn.endswith("_stats") for fn in os.listdir(tmp_path))
+    stats = DownloadCache(str(tmp_path)).stats()
+    assert {fn.split("_", 1)[-1] for fn in os.listdir(tmp_path)} == {"length", "data", "chunks", "stats", "stats.json", "stats.lock", "locks"}
+    assert stats["urls"] == 1
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["bytes_downloaded"] == len(data)
+    assert stats["bytes_saved"] == 3000 + 100
+
+  def test_cache_eviction(self, mocker, tmp_path, range_host):
+    mocker.patch("openpilot.system.hardware.hw.Paths.download_cache_root", return_value=str(tmp_path) + "/")
+    mocker.patch("openpilot.tools.lib.download_cache.cache_budget", return_value=50_000)
+    data = RangeTestRequestHandler.DATA
+
+    for i in range(4):
+      assert URLFile(f"{range_host}/test_{i}.bin", cache=True).read() == data
+      time.sleep(0.01)
+    # the least recently used file is evicted first
+    URLFile(f"{range_host}/test_0.bin", cache=True).read()
+
+    cache = DownloadCache(str(tmp_path))
+    stats = cache.stats()
+    assert stats["size"] <= 50_000
+    assert stats["evicted_bytes"] > 0
+    assert f"{range_host}/test_0.bin" in [url for url, _, _ in stats["hottest"]]
+    assert f"{range_host}/test_1.bin" not in [url for url, _, _ in stats["hottest"]]
+
+    assert cache.evict(0) > 0
+    assert cache.stats()["size"] == 0
+    assert URLFile(f"{range_host}/test_0.bin", cache=True).read() == data
+
+  def test_eviction_race(self, mocker, tmp_path, range_host):
+    mocker.patch("openpilot.system.hardware.hw.Paths.download_cache_root", return_value=str(tmp_path) + "/")
+    mocker.patch("openpilot.tools.lib.url_file.CHUNK_SIZE", 1000)
+    url = f"{range_host}/test.bin"
+    data = RangeTestRequestHandler.DATA
+
+    def read(seed):
+      rng = random.Random(seed)
+      for _ in range(200):
+        f = URLFile(url, cache=True)
+        start, size = rng.randrange(len(data)), rng.randrange(1, 5000)
+        f.seek(start)
+        assert f.read(size) == data[start:start + size]
+
+    def evict():
+      for _ in range(1000):
+        DownloadCache(str(tmp_path)).evict(0)
+
+    # readers and writers of the same chunks race the evictor
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=read, args=(i,)) for i in range(8)] + [ctx.Process(target=evict)]
+    for p in procs:
+      p.start()
+    for p in procs:
+      p.join()
+    assert [p.exitcode for p in procs] == [0] * len(procs)
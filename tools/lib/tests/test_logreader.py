@@ -1,3 +1,4 @@
+import bz2
 import capnp
 import contextlib
 import io
@@ -5,7 +6,9 @@ import shutil
 import tempfile
 import os
 import pytest
+import numpy as np
 import requests
+import zstandard as zstd
 
 from parameterized import parameterized
 
@@ -254,3 +257,93 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("compression", ["", ".bz2", ".zst"])
+  def test_streaming(self, compression):
+    with tempfile.NamedTemporaryFile(suffix=compression) as log_file:
+      num_msgs = 1000
+      dat = b"".join(capnp_log.Event.new_message(logMonoTime=i).to_bytes() for i in range(num_msgs))
+      if compression == ".bz2":
+        dat = bz2.compress(dat)
+      elif compression == ".zst":
+        dat = zstd.compress(dat, 10)
+      with open(log_file.name, "wb") as f:
+        f.write(dat)
+
+      msgs = list(LogReader(log_file.name))
+      streamed_msgs = list(LogReader(log_file.name, streaming=True))
+      assert [m.logMonoTime for m in streamed_msgs] == [m.logMonoTime for m in msgs] == list(range(num_msgs))
+
+      # can be iterated multiple times
+      lr = LogReader(log_file.name, streaming=True)
+      assert len(list(lr)) == len(list(lr)) == num_msgs
+
+  @pytest.mark.parametrize("streaming", [True, False])
+  def test_index(self, mocker, tmp_path, streaming):
+    mocker.patch("openpilot.system.hardware.hw.Paths.download_cache_root", return_value=str(tmp_path / "cache") + "/")
+    log_file = str(tmp_path / "rlog.zst")
+    msgs = []
+    for i in range(1000):
+      msg = capnp_log.Event.new_message(logMonoTime=i)
+      msg.init("initData" if i % 100 == 50 else "carState")
+      msgs.append(msg)
+    with open(log_file, "wb") as f:
+      f.write(zstd.compress(b"".join(msg.to_bytes() for msg in msgs)))
+
+    lr = LogReader(log_file, streaming=streaming)
+    indexed_lr = LogReader(log_file, streaming=streaming, use_index=True)
+    assert len(list(indexed_lr.filter("initData"))) == len(list(lr.filter("initData"))) == 10
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+    # index is reused, events are only decoded on match
+    build_index_mock = mocker.patch("openpilot.tools.lib.logreader._LogFileReader.build_index")
+    indexed_lr = LogReader(log_file, streaming=streaming, use_index=True)
+    assert indexed_lr.first("initData").to_dict() == lr.first("initData").to_dict()
+    assert indexed_lr.first("carParams") is None
+    assert [m.logMonoTime for m in indexed_lr.time_range(200, 300)] == list(range(200, 300))
+    assert build_index_mock.call_count == 0
+
+  def test_columns(self, mocker, tmp_path):
+    mocker.patch("openpilot.system.hardware.hw.Paths.download_cache_root", return_value=str(tmp_path / "cache") + "/")
+    log_file = str(tmp_path / "rlog")
+    with open(log_file, "wb") as f:
+      for i in range(1000):
+        msg = capnp_log.Event.new_message(logMonoTime=1000 - i, valid=i % 2 == 0)
+        msg.init("carState")
+        msg.carState.vEgo = i
+        msg.carState.cruiseState.speed = 2 * i
+        f.write(msg.to_bytes())
+
+    lr = LogReader(log_file)
+    time_series = lr.time_series["carState"]
+    columns = lr.columns({"carState": ["vEgo", "cruiseState/speed"]})["carState"]
+    assert columns.keys() == {"t", "_valid", "vEgo", "cruiseState/speed"}
+    assert columns["vEgo"].dtype == np.float32
+    for name in columns:
+      assert np.array_equal(columns[name], time_series[name])
+
+    # second call loads from the cache
+    msgs_to_columns_mock = mocker.patch("openpilot.tools.lib.logreader.msgs_to_columns")
+    cached_columns = lr.columns({"carState": ["vEgo", "cruiseState/speed"]})["carState"]
+    assert msgs_to_columns_mock.call_count == 0
+    for name in columns:
+      assert np.array_equal(columns[name], cached_columns[name])
+
+  def test_prefetch(self, tmp_path):
+    log_files = []
+    for seg in range(4):
+      log_files.append(str(tmp_path / f"rlog_{seg}"))
+      with open(log_files[-1], "wb") as f:
+        f.write(b"".join(capnp_log.Event.new_message(logMonoTime=seg * 100 + i).to_bytes() for i in range(100)))
+
+    msgs = [m.logMonoTime for m in LogReader(log_files)]
+    assert [m.logMonoTime for m in LogReader(log_files, prefetch=2)] == msgs == list(range(400))
+
+    with LogReader(log_files) as lr:
+      assert len(lr.run_across_segments(2, noop)) == len(msgs)
+
+      # the worker pool is reused
+      pool = lr._pool
+      assert [len(list(seg)) for seg in lr.iter_across_segments(2, noop)] == [100] * 4
+      assert lr._pool is pool
+    assert lr._pool is None
@@ -1,11 +1,35 @@
 import pytest
+import random
 import requests
+import subprocess
 import tempfile
 
 from collections import defaultdict
 import numpy as np
-from openpilot.tools.lib.framereader import FrameReader
+from openpilot.tools.lib.framereader import FfmpegDecoder, FrameIterator, FrameReader, KeyframeStore, decompress_video_data
 from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.lib.vidindex import HevcNalUnitType, hevc_index
+
+
+def hevc_nal_unit(nal_unit_type: HevcNalUnitType, slice_type: int = 0, first_slice: bool = True, payload_size: int = 100) -> bytes:
+  header = bytes([nal_unit_type << 1, 1])
+  if nal_unit_type in (HevcNalUnitType.IDR_W_RADL, HevcNalUnitType.TRAIL_R):
+    # first_slice_segment_in_pic_flag, no_output_of_prior_pics_flag for IRAP, slice_pic_parameter_set_id=0 and slice_type as ue(v)
+    bits = ("1" if first_slice else "0") + ("0" if nal_unit_type == HevcNalUnitType.IDR_W_RADL else "") + "1" + ["1", "010", "011"][slice_type]
+    bits += "1" * (-len(bits) % 8)
+    header += int(bits, 2).to_bytes(len(bits) // 8, "big")
+  return b"\x00\x00\x00\x01" + header + b"\x80" * payload_size
+
+
+def encode_hevc(fn: str, frames: int = 60, gop_size: int = 20, w: int = 160, h: int = 120) -> dict:
+  subprocess.check_call(["ffmpeg", "-v", "quiet", "-y", "-f", "lavfi", "-i", f"testsrc=size={w}x{h}:rate=20", "-frames:v", str(frames),
+                         "-c:v", "libx265", "-x265-params", f"keyint={gop_size}:min-keyint={gop_size}:bframes=0:log-level=none", "-f", "hevc", fn])
+  frame_types, dat_len, prefix = hevc_index(fn)
+  return {
+    'index': np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32),
+    'global_prefix': prefix,
+    'probe': {'streams': [{'width': w, 'height': h}]},
+  }
 
 
 class TestReaders:
@@ -61,3 +85,97 @@ class TestReaders:
 
     fr_url = FrameReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
     _check_data(fr_url)
+
+  def test_hevc_index_chunked(self):
+    dat = b""
+    for _ in range(5):
+      dat += b"".join(hevc_nal_unit(t) for t in (HevcNalUnitType.VPS_NUT, HevcNalUnitType.SPS_NUT, HevcNalUnitType.PPS_NUT))
+      dat += hevc_nal_unit(HevcNalUnitType.IDR_W_RADL, slice_type=2, payload_size=3000)
+      dat += hevc_nal_unit(HevcNalUnitType.IDR_W_RADL, first_slice=False)
+      dat += b"".join(hevc_nal_unit(HevcNalUnitType.TRAIL_R, slice_type=1, payload_size=500 + i) for i in range(10))
+
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      fp.write(dat)
+      fp.flush()
+
+      frame_types, dat_len, prefix = hevc_index(fp.name)
+      assert [t for t, _ in frame_types] == ([2] + [1] * 10) * 5
+      assert dat_len == len(dat)
+      assert len(prefix) > 0
+      for chunk_size in (1, 2, 3, 7, 1000, 1 << 20):
+        assert hevc_index(fp.name, chunk_size=chunk_size) == (frame_types, dat_len, prefix)
+
+  @pytest.mark.parametrize("pix_fmt", ["rgb24", "nv12"])
+  def test_framereader_random_access(self, pix_fmt):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      index_data = encode_hevc(fp.name)
+      with open(fp.name, "rb") as f:
+        expected = decompress_video_data(f.read(), 160, 120, pix_fmt)
+      assert len(expected) == 60
+
+      # a cache smaller than a GOP, so GOPs are decoded again
+      fr = FrameReader(fp.name, index_data, cache_size=10, pix_fmt=pix_fmt)
+      assert fr.decoder.use_pipe
+      for fidx in [*range(60), *random.Random(0).sample(range(60), 60), 59, 0, 20, 19]:
+        assert np.array_equal(fr.get(fidx)[0], expected[fidx])
+      assert len(fr._cache) == 1
+
+      # stopping in the middle of a GOP leaves the decoder ready for the next one
+      frames = list(FrameIterator(fp.name, index_data, pix_fmt, start_fidx=5, end_fidx=25))
+      assert np.array_equal(frames, expected[5:25])
+      it = fr.decoder.get_iterator(3)
+      next(it)
+      it.close()
+      assert [fidx for fidx, _ in fr.decoder.get_iterator(41, 60, 3)] == list(range(41, 60, 3))
+      assert all(np.array_equal(frame, expected[fidx]) for fidx, frame in fr.decoder.get_iterator(30, 50))
+      fr.close()
+
+  @pytest.mark.parametrize("frame_skip", [1, 7, 25])
+  def test_framereader_parallel(self, frame_skip):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      index_data = encode_hevc(fp.name, frames=100)
+      with open(fp.name, "rb") as f:
+        expected = decompress_video_data(f.read(), 160, 120)
+
+      frames = list(FrameIterator(fp.name, index_data, start_fidx=3, end_fidx=95, frame_skip=frame_skip, workers=4, readahead=2))
+      assert np.array_equal(frames, expected[3:95:frame_skip])
+
+      fr = FrameReader(fp.name, index_data, workers=4)
+      for fidx in [*range(0, 100, frame_skip), 10, 99]:
+        assert np.array_equal(fr.get(fidx)[0], expected[fidx])
+      fr.close()
+
+  def test_framereader_parallel_sequential(self, mocker):
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      index_data = encode_hevc(fp.name, frames=100)
+      with open(fp.name, "rb") as f:
+        expected = decompress_video_data(f.read(), 160, 120)
+
+      # sequential reads keep the read-ahead across GOP boundaries, every GOP is decoded once
+      decode = mocker.spy(FfmpegDecoder, "_decode_gop_frames")
+      fr = FrameReader(fp.name, index_data, cache_size=1, workers=4)
+      for fidx in range(100):
+        assert np.array_equal(fr.get(fidx)[0], expected[fidx])
+      assert decode.call_count == len(fr.iframes)
+      fr.close()
+
+  def test_keyframe_store(self, mocker, tmp_path):
+    mocker.patch("openpilot.system.hardware.hw.Paths.download_cache_root", return_value=str(tmp_path) + "/")
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      index_data = encode_hevc(fp.name, frames=100, w=320, h=240)
+      with open(fp.name, "rb") as f:
+        expected = decompress_video_data(f.read(), 320, 240, scale=(160, 120))
+
+      fr = FrameReader(fp.name, index_data)
+      for fidx in (0, 19, 20, 55, 99):
+        keyframe_idx, thumbnail = fr.get_keyframe(fidx, width=160)
+        assert keyframe_idx == fidx // 20 * 20
+        assert np.array_equal(thumbnail, expected[keyframe_idx])
+      fr.close()
+
+      # later stores memory-map the saved thumbnails instead of decoding
+      decode = mocker.patch("openpilot.tools.lib.framereader.FfmpegDecoder.decode_iframes")
+      store = KeyframeStore(fp.name, index_data, width=160)
+      assert isinstance(store.thumbnails, np.memmap)
+      assert np.array_equal(store.thumbnails, expected[::20])
+      decode.assert_not_called()
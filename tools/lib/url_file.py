@@ -1,17 +1,24 @@
+import contextlib
+import fcntl
 import logging
 import os
 import socket
 import time
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
 from urllib3.util import Timeout
 
 from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib.download_cache import LOCK_DIR, DownloadCache, url_lock
 from openpilot.system.hardware.hw import Paths
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Missing chunks are downloaded in parallel, adjacent ones are coalesced into ranges of up to MAX_RANGE_CHUNKS
+MAX_CONCURRENT_DOWNLOADS = 8
+MAX_RANGE_CHUNKS = 8
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -23,12 +30,93 @@ class URLFileException(Exception):
   pass
 
 
+def coalesce_chunks(chunks: list[int], max_chunks: int) -> list[tuple[int, int]]:
+  """Group sorted chunk numbers into [start, end) ranges of adjacent chunks, at most max_chunks long"""
+  ranges: list[tuple[int, int]] = []
+  for chunk in chunks:
+    if ranges and ranges[-1][1] == chunk and chunk - ranges[-1][0] < max_chunks:
+      ranges[-1] = (ranges[-1][0], chunk + 1)
+    else:
+      ranges.append((chunk, chunk + 1))
+  return ranges
+
+
+class ChunkCache:
+  """One sparse data file per URL, with a bitmap of the chunks already downloaded"""
+
+  def __init__(self, url: str, length: int):
+    self.root = Paths.download_cache_root()
+    self.url_hash = hash_256(url)
+    prefix = os.path.join(self.root, self.url_hash)
+    self.data_path = prefix + "_data"
+    self.bitmap_path = prefix + "_chunks"
+    self.length = length
+
+  @staticmethod
+  def _missing(bitmap: bytes, first: int, last: int) -> list[int]:
+    return [c for c in range(first, last + 1) if c // 8 >= len(bitmap) or not (bitmap[c // 8] >> (c % 8)) & 1]
+
+  def missing_chunks(self, first: int, last: int) -> list[int]:
+    try:
+      with open(self.bitmap_path, "rb") as f:
+        return self._missing(f.read(), first, last)
+    except FileNotFoundError:
+      return list(range(first, last + 1))
+
+  def store(self, offset: int, data: bytes, start: int, end: int) -> None:
+    """Write data at offset and mark chunks [start, end) as present"""
+    # the URL lock is held while writing, other processes may be downloading or evicting chunks of the same file
+    with url_lock(self.root, self.url_hash):
+      fd = os.open(self.data_path, os.O_WRONLY | os.O_CREAT, 0o644)
+      try:
+        view = memoryview(data)
+        while len(view):
+          written = os.pwrite(fd, view, offset)
+          view = view[written:]
+          offset += written
+      finally:
+        os.close(fd)
+
+      fd = os.open(self.bitmap_path, os.O_RDWR | os.O_CREAT, 0o644)
+      try:
+        bitmap = bytearray(os.pread(fd, (end + 7) // 8, 0))
+        bitmap.extend(b"\x00" * ((end + 7) // 8 - len(bitmap)))
+        for c in range(start, end):
+          bitmap[c // 8] |= 1 << (c % 8)
+        os.pwrite(fd, bitmap, 0)
+      finally:
+        os.close(fd)
+
+  def read(self, offset: int, size: int) -> bytes:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    with url_lock(self.root, self.url_hash, fcntl.LOCK_SH):
+      # chunks may have been evicted since they were checked
+      with open(self.bitmap_path, "rb") as f:
+        bitmap = f.read()
+      if self._missing(bitmap, offset // CHUNK_SIZE, (offset + size - 1) // CHUNK_SIZE):
+        raise FileNotFoundError(f"Chunks of {self.data_path} are missing")
+
+      with open(self.data_path, "rb", buffering=0) as f:
+        # the mtime is the last access time for eviction
+        os.utime(f.fileno())
+        f.seek(offset)
+        while len(view):
+          n = f.readinto(view)
+          if not n:
+            raise FileNotFoundError(f"Cache file {self.data_path} is truncated")
+          view = view[n:]
+    return bytes(buf)
+
+
 class URLFile:
   _pool_manager: PoolManager|None = None
+  _executor: ThreadPoolExecutor|None = None
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -38,6 +126,12 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="urlfile")
+    return URLFile._executor
+
   def __init__(self, url: str, timeout: int=10, debug: bool=False, cache: bool|None=None):
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
@@ -50,7 +144,7 @@ class URLFile:
       self._force_download = not cache
 
     if not self._force_download:
-      os.makedirs(Paths.download_cache_root(), exist_ok=True)
+      os.makedirs(os.path.join(Paths.download_cache_root(), LOCK_DIR), exist_ok=True)
 
   def __enter__(self):
     return self
@@ -73,8 +167,9 @@ class URLFile:
       return self._length
 
     file_length_path = os.path.join(Paths.download_cache_root(), hash_256(self._url) + "_length")
-    if not self._force_download and os.path.exists(file_length_path):
-      with open(file_length_path) as file_length:
+    if not self._force_download:
+      # may be evicted by another process at any time
+      with contextlib.suppress(FileNotFoundError), open(file_length_path) as file_length:
         content = file_length.read()
         self._length = int(content)
         return self._length
@@ -89,47 +184,43 @@ class URLFile:
     if self._force_download:
       return self.read_aux(ll=ll)
 
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb", overwrite=True) as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
-
-  def read_aux(self, ll: int|None=None) -> bytes:
-    download_range = False
-    headers = {}
-    if self._pos != 0 or ll is not None:
-      if ll is None:
-        end = self.get_length() - 1
-      else:
-        end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
-        return b""
-      headers['Range'] = f"bytes={self._pos}-{end}"
-      download_range = True
+    file_end = min(self._pos + ll, length) if ll is not None else length
+    if file_begin >= file_end:
+      return b""
+
+    cache = ChunkCache(self._url, length)
+    missing = cache.missing_chunks(file_begin // CHUNK_SIZE, (file_end - 1) // CHUNK_SIZE)
+    ranges = coalesce_chunks(missing, MAX_RANGE_CHUNKS)
+
+    def download(chunk_range: tuple[int, int]) -> None:
+      start, end = chunk_range[0] * CHUNK_SIZE, min(chunk_range[1] * CHUNK_SIZE, length)
+      data = self._get({'Range': f"bytes={start}-{end - 1}"}, download_range=True)
+      if len(data) != end - start:
+        raise URLFileException(f"Error, expected {end - start} bytes but got {len(data)} ({self._url})")
+      cache.store(start, data, *chunk_range)
+
+    if len(ranges) == 1:
+      download(ranges[0])
+    elif len(ranges) > 1:
+      for _ in URLFile.executor().map(download, ranges):
+        pass
+
+    try:
+      ret = cache.read(file_begin, file_end - file_begin)
+    except FileNotFoundError:
+      # evicted by another process while reading
+      ret = self._get({'Range': f"bytes={file_begin}-{file_end - 1}"}, download_range=True)
+
+    downloaded = sum(min((end * CHUNK_SIZE), length) - start * CHUNK_SIZE for start, end in ranges)
+    DownloadCache().record_access(hash_256(self._url), self._url.split("?")[0], len(ret) - min(downloaded, len(ret)), downloaded)
+
+    self._pos = file_end
+    return ret
 
+  def _get(self, headers: dict[str, str], download_range: bool) -> bytes:
     if self._debug:
       t1 = time.time()
 
@@ -148,7 +239,22 @@ class URLFile:
       raise URLFileException(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
+    return ret
+
+  def read_aux(self, ll: int|None=None) -> bytes:
+    download_range = False
+    headers = {}
+    if self._pos != 0 or ll is not None:
+      if ll is None:
+        end = self.get_length() - 1
+      else:
+        end = min(self._pos + ll, self.get_length()) - 1
+      if self._pos >= end:
+        return b""
+      headers['Range'] = f"bytes={self._pos}-{end}"
+      download_range = True
 
+    ret = self._get(headers, download_range)
     self._pos += len(ret)
     return ret
 
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import argparse
+import itertools
 import os
 import struct
+from collections.abc import Iterator
 from enum import IntEnum
 
 from openpilot.tools.lib.filereader import FileReader
@@ -258,38 +260,76 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
-def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
-  with FileReader(hevc_file_name) as f:
-    dat = f.read()
-
-  if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
+def iter_hevc_nal_units(f, chunk_size: int | None = None) -> Iterator[tuple[int, bytes]]:
+  """
+  Yield the file offset and data of each NAL unit, from its start code up to the next one.
+  With a chunk_size the file is read in chunks, only keeping the current NAL unit in memory.
+  """
+  buf = bytearray(f.read(chunk_size) if chunk_size else f.read())
+  eof = not chunk_size
+  while not eof and len(buf) < NAL_UNIT_START_CODE_SIZE + 1:
+    dat = f.read(chunk_size)
+    eof = len(dat) == 0
+    buf += dat
+  if len(buf) < NAL_UNIT_START_CODE_SIZE + 1:
     raise VideoFileInvalid("data is too short")
 
-  if dat[0] != 0x00:
+  if buf[0] != 0x00:
     raise VideoFileInvalid("first byte must be 0x00")
 
+  buf_offset = 0  # file offset of buf[0]
+  i = 1 # skip past first byte 0x00
+  while True:
+    # start codes are found with bytes.find, only rescanning the overlap with the previous chunk
+    search_start = i + NAL_UNIT_START_CODE_SIZE
+    pos = buf.find(NAL_UNIT_START_CODE, search_start)
+    while pos == -1 and not eof:
+      dat = f.read(chunk_size)
+      eof = len(dat) == 0
+      search_start = max(search_start, len(buf) - NAL_UNIT_START_CODE_SIZE + 1)
+      buf += dat
+      pos = buf.find(NAL_UNIT_START_CODE, search_start)
+
+    if i >= len(buf):
+      return
+
+    nal_unit_end = pos if pos != -1 else len(buf)
+    yield buf_offset + i, bytes(buf[i:nal_unit_end])
+
+    del buf[:nal_unit_end]
+    buf_offset += nal_unit_end
+    i = 0
+
+def hevc_index(hevc_file_name: str, allow_corrupt: bool=False, chunk_size: int | None = None) -> tuple[list, int, bytes]:
   prefix_dat = b""
   frame_types = list()
 
-  i = 1 # skip past first byte 0x00
-  try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
-      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
-      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
-          frame_types.append((slice_type, i))
-      i += nal_unit_len
-  except Exception as e:
-    if not allow_corrupt:
-      raise
-    print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
-
-  return frame_types, len(dat), prefix_dat
+  with FileReader(hevc_file_name) as f:
+    nal_units = iter_hevc_nal_units(f, chunk_size)
+    first_nal_unit = next(nal_units)
+
+    i = 1
+    dat_len = 0
+    try:
+      for i, nal_unit in itertools.chain([first_nal_unit], nal_units):
+        # the NAL unit parsers expect the start code to be preceded by at least one byte
+        dat = b"\x00" + nal_unit
+        require_nal_unit_start(dat, 1)
+        nal_unit_type = get_hevc_nal_unit_type(dat, 1)
+        if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+          prefix_dat += nal_unit
+        elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+          slice_type, is_first_slice = get_hevc_slice_type(dat, 1, nal_unit_type)
+          if is_first_slice:
+            frame_types.append((slice_type, i))
+        dat_len = i + len(nal_unit)
+    except Exception as e:
+      if not allow_corrupt:
+        raise
+      print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
+      dat_len = f.get_length() if hasattr(f, "get_length") else os.fstat(f.fileno()).st_size
+
+  return frame_types, dat_len, prefix_dat
 
 def main() -> None:
   parser = argparse.ArgumentParser()